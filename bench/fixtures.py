@@ -0,0 +1,282 @@
+'''
+  ' In-process stand-ins for the discord.py objects Hector reads, for
+	' benchmarks that run without a Discord connection.
+	'
+	' Only the attributes and coroutines that Hector's code paths actually
+	' touch are provided. Every call that would be a REST request (sends,
+	' edits, reactions, deletes) goes through the guild's http, a
+	' SimulatedHTTP with latency and 429s, or just yields to the event
+	' loop once when the guild has none. Requests then succeed and update
+	' the fake's state, so repeated runs see channels that are already up
+	' to date, as a live guild would.
+'''
+import random
+import asyncio
+import datetime
+
+class SimulatedHTTP:
+	'''
+	  ' Stand-in for Discord's REST API. Each request waits a random
+		' latency (log-normal around latency seconds) and is rejected with
+		' a 429 with probability rate_limit_chance, after which it waits
+		' retry_after seconds and is retried, as discord.py does.
+	'''
+	def __init__(self, latency=0.05, rate_limit_chance=0.0, retry_after=0.5, seed=0):
+		self.latency = latency
+		self.rate_limit_chance = rate_limit_chance
+		self.retry_after = retry_after
+		self.rng = random.Random(seed)
+		self.requests = {} # (method, route) -> count, retries included
+		self.rate_limited = 0
+
+	async def request(self, method, route):
+		while True:
+			self.requests[(method, route)] = self.requests.get((method, route), 0) + 1
+			if self.latency:
+				await asyncio.sleep(self.rng.lognormvariate(0, 0.5) * self.latency)
+			else:
+				await asyncio.sleep(0)
+			if self.rng.random() >= self.rate_limit_chance:
+				return
+			self.rate_limited = self.rate_limited + 1
+			await asyncio.sleep(self.retry_after)
+
+async def _request(guild, method, route):
+	http = guild.http if guild else None
+	if http:
+		await http.request(method, route)
+	else:
+		await asyncio.sleep(0)
+
+class FakePermissions:
+	def __init__(self, administrator=False, manage_messages=False):
+		self.administrator = administrator
+		self.manage_messages = manage_messages or administrator
+
+class FakeRole:
+	def __init__(self, role_id, name, position):
+		self.id = role_id
+		self.name = name
+		self.position = position
+
+class FakeMember:
+	def __init__(self, member_id, roles, administrator=False, bot=False):
+		self.id = member_id
+		self.bot = bot
+		self.roles = roles
+		self.guild_permissions = FakePermissions(administrator)
+		self.name = 'member{0}'.format(member_id)
+		self.mention = '<@{0}>'.format(member_id)
+		self.avatar_url = ''
+
+	def __str__(self):
+		return self.name
+
+class FakeCategory:
+	def __init__(self, category_id, name, guild):
+		self.id = category_id
+		self.name = name
+		self.guild = guild
+		self.overwrites = []
+
+class FakeChannel:
+	def __init__(self, channel_id, name, guild, category_id=None, topic=None):
+		self.id = channel_id
+		self.name = name
+		self.guild = guild
+		self.category_id = category_id
+		self.topic = topic
+		self.overwrites = []
+		self.edits = 0
+		self.messages = {}
+
+	@property
+	def category(self):
+		return self.guild.get_category(self.category_id)
+
+	@property
+	def mention(self):
+		return '<#{0}>'.format(self.id)
+
+	def permissions_for(self, member):
+		return member.guild_permissions
+
+	async def send(self, content=None, embed=None):
+		await _request(self.guild, 'POST', '/channels/{channel_id}/messages')
+		message = FakeMessage(self, self.guild.me, content or '', embed=embed)
+		self.messages[message.id] = message
+		if self.guild.on_send:
+			self.guild.on_send(message)
+		return message
+
+	async def get_message(self, message_id):
+		await _request(self.guild, 'GET', '/channels/{channel_id}/messages/{message_id}')
+		message = self.messages.get(message_id)
+		if not message:
+			message = FakeMessage(self, None)
+			message.id = message_id
+		return message
+
+	async def edit(self, reason=None, **fields):
+		await _request(self.guild, 'PATCH', '/channels/{channel_id}')
+		self.edits = self.edits + 1
+		if 'name' in fields:
+			self.name = fields['name']
+		if 'topic' in fields:
+			self.topic = fields['topic']
+		if 'category' in fields:
+			self.category_id = fields['category'].id if fields['category'] else None
+		if fields.get('sync_permissions'):
+			category = self.guild.get_category(self.category_id)
+			self.overwrites = list(category.overwrites) if category else []
+
+class FakeMessage:
+	_next_id = 1
+
+	def __init__(self, channel=None, author=None, content='', mentions=(), embed=None):
+		self.id = FakeMessage._next_id
+		FakeMessage._next_id = FakeMessage._next_id + 1
+		self.channel = channel
+		self.author = author
+		self.content = content
+		self.mentions = list(mentions)
+		self.embed = embed
+		self.created_at = datetime.datetime.utcnow()
+		self.reactions = []
+
+	@property
+	def guild(self):
+		return self.channel.guild if self.channel else None
+
+	async def add_reaction(self, emoji):
+		await _request(self.guild, 'PUT', '/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me')
+		self.reactions.append(emoji)
+
+	async def remove_reaction(self, emoji, member):
+		await _request(self.guild, 'DELETE', '/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/{member_id}')
+		if member is self.guild.me and emoji in self.reactions:
+			self.reactions.remove(emoji)
+
+	async def clear_reactions(self):
+		await _request(self.guild, 'DELETE', '/channels/{channel_id}/messages/{message_id}/reactions')
+		self.reactions = []
+
+	async def edit(self, content=None, embed=None):
+		await _request(self.guild, 'PATCH', '/channels/{channel_id}/messages/{message_id}')
+		if content is not None:
+			self.content = content
+		if embed is not None:
+			self.embed = embed
+
+	async def delete(self):
+		await _request(self.guild, 'DELETE', '/channels/{channel_id}/messages/{message_id}')
+		if self.channel:
+			self.channel.messages.pop(self.id, None)
+
+class FakeGuild:
+	def __init__(self, guild_id, name='Benchmark Guild', http=None, me=None):
+		self.id = guild_id
+		self.name = name
+		self.http = http
+		self.me = me # the bot's member
+		self.unavailable = False
+		self.on_send = None # called with each message the bot sends here
+		self.roles = []
+		self.categories = []
+		self.channels = {}
+		self.members = {}
+		self._roles = {}
+		self._categories = {}
+
+	def __str__(self):
+		return self.name
+
+	def get_role(self, role_id):
+		return self._roles.get(role_id)
+
+	def get_channel(self, channel_id):
+		return self.channels.get(channel_id)
+
+	def get_category(self, category_id):
+		return self._categories.get(category_id)
+
+	def get_member(self, member_id):
+		return self.members.get(member_id)
+
+	def add_role(self, role):
+		self.roles.append(role)
+		self._roles[role.id] = role
+
+	def add_category(self, category):
+		self.categories.append(category)
+		self._categories[category.id] = category
+
+	def add_channel(self, channel):
+		self.channels[channel.id] = channel
+
+class FakeBot:
+	command_prefix = '|'
+
+	def __init__(self, db, loop, guilds=(), user=None):
+		self.db = db
+		self.loop = loop
+		self.guilds = list(guilds)
+		self.settings = {}
+		self.user = user or FakeMember(1, [], bot=True)
+		self._guilds = {}
+		self._channels = {}
+
+	def index(self):
+		''' Build id lookups once the guilds are set up; get_guild/get_channel fall back to a scan. '''
+		self._guilds = {guild.id : guild for guild in self.guilds}
+		self._channels = {channel.id : channel for guild in self.guilds for channel in guild.channels.values()}
+
+	def get_channel(self, channel_id):
+		channel = self._channels.get(channel_id)
+		if channel:
+			return channel
+		for guild in self.guilds:
+			channel = guild.get_channel(channel_id)
+			if channel:
+				return channel
+		return None
+
+	def get_guild(self, guild_id):
+		guild = self._guilds.get(guild_id)
+		if guild:
+			return guild
+		for guild in self.guilds:
+			if guild.id == guild_id:
+				return guild
+		return None
+
+	async def wait_for(self, event, timeout=None, check=None):
+		# Nobody answers prompts during a benchmark.
+		raise asyncio.TimeoutError()
+
+	def is_closed(self):
+		return False
+
+
+_words = ('old', 'mill', 'forest', 'road', 'tavern', 'north', 'river', 'keep', 'market', 'harbour', 'tower', 'ruins', 'glade', 'crossing', 'hall', 'shrine')
+
+def region_name(rng, index):
+	''' A plausible region name, unique by index (e.g. "Old Mill #42"). '''
+	return '{0} {1} #{2}'.format(rng.choice(_words).title(), rng.choice(_words).title(), index)
+
+def build_guild(guild_id, categories=10, roles=0, members=0, roles_per_member=3, seed=0):
+	'''
+	  ' A guild with `categories` active categories plus an inactive one
+		' (the last category), `roles` roles and `members` members, each
+		' holding up to roles_per_member random roles.
+	'''
+	rng = random.Random(seed)
+	guild = FakeGuild(guild_id)
+	for index in range(categories + 1):
+		guild.add_category(FakeCategory(guild_id * 1000 + index, 'category-{0}'.format(index), guild))
+	for index in range(roles):
+		guild.add_role(FakeRole(guild_id * 100000 + index, 'role-{0}'.format(index), index + 1))
+	for index in range(members):
+		held = rng.sample(guild.roles, min(len(guild.roles), rng.randint(0, roles_per_member)))
+		guild.members[index] = FakeMember(index, held)
+	return guild
@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+'''
+  ' Gateway event replay harness.
+	'
+	' Pushes a stream of gateway events through Hector's real cog
+	' handlers (Hectorbot_Core.on_message, on_raw_reaction_add and
+	' on_command_error, RPManager.on_message, and the commands
+	' themselves) in one process, against fake guilds whose REST calls go
+	' to a SimulatedHTTP with configurable latency and 429s.
+	'
+	' Events arrive open-loop at --rate per second (Poisson arrivals), as
+	' they would from the gateway, whether or not earlier handlers have
+	' finished. The report gives achieved events per second, p50/p99
+	' handler latency per event type (from arrival to handler completion,
+	' so queueing counts), event loop lag, and REST request and 429
+	' counts. Raise --guilds or --rate until loop lag or p99 latency
+	' becomes unacceptable to estimate how many guilds a process carries.
+	'
+	' Usage:
+	'   python3 bench/replay.py [--guilds 50] [--rate 200] [--duration 10]
+	'   python3 bench/replay.py --record events.jsonl   # also save the generated stream
+	'   python3 bench/replay.py --replay events.jsonl   # replay a saved stream
+	'
+	' Commands are dispatched by name to the cog's Command objects: checks
+	' run first, then the callback; errors reach on_command_error wrapped
+	' as discord.ext.commands would wrap them. Argument conversion is
+	' limited to what the generated commands need (words and rest-of-line).
+'''
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import inspect
+import argparse
+import tempfile
+import traceback
+import collections
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(root) # sql_con reads sql/schema.json relative to the repository
+
+from discord.ext import commands
+
+from fixtures import FakeBot, FakeChannel, FakeMember, FakeMessage, SimulatedHTTP, build_guild, region_name
+
+_prefix = '|'
+_lag_interval = 0.01 # seconds between event loop lag samples
+_chat = ('the', 'door', 'creaks', 'open', 'and', 'a', 'cold', 'wind', 'blows', 'through', 'hall', 'she', 'draws', 'her', 'sword', 'looks', 'around', 'quietly')
+
+def percentile(values, fraction):
+	if not values:
+		return None
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class RawReaction:
+	''' The parts of a RawReactionActionEvent that on_raw_reaction_add reads. '''
+	class Emoji:
+		def __init__(self, name):
+			self.name = name
+
+	def __init__(self, message, user_id, emoji):
+		self.message_id = message.id
+		self.channel_id = message.channel.id
+		self.guild_id = message.guild.id
+		self.user_id = user_id
+		self.emoji = RawReaction.Emoji(emoji)
+
+class FakeContext:
+	def __init__(self, bot, message, command=None, invoked_with=None):
+		self.bot = bot
+		self.message = message
+		self.author = message.author
+		self.guild = message.guild
+		self.channel = message.channel
+		self.command = command
+		self.invoked_with = invoked_with
+		self.prefix = _prefix
+
+	async def send(self, content=None, embed=None):
+		return await self.channel.send(content, embed=embed)
+
+
+class World:
+	'''
+	  ' The fake guilds, the real cogs and a shared database. Built
+		' deterministically from its parameters, so a recorded stream
+		' replays against the same guilds, regions and members.
+	'''
+	def __init__(self, db, loop, http, guilds, regions, members, seed):
+		self.params = {'guilds' : guilds, 'regions' : regions, 'members' : members, 'seed' : seed}
+		self.db = db
+		self.http = http
+		self.bot = FakeBot(db, loop, user=FakeMember(1, [], bot=True))
+		self.region_names = [] # per guild
+		self.recent = collections.deque(maxlen=500)        # bot messages, for 🚮
+		self.recent_errors = collections.deque(maxlen=500) # error reports, for ✳
+		self.last_author = {} # channel id -> member who last spoke there
+
+	async def build(self):
+		import hector
+		import permissions
+		import triggers
+		from messages import tracker
+		from mod.rp.rp import RPManager
+		hector.bot_prefix = _prefix
+
+		self.core = hector.Hectorbot_Core(self.bot, self.db)
+		self.rp = RPManager(self.bot, self.db)
+		self.perms = permissions.Permissions(self.bot)
+		self.commands = {}
+		for cog in (self.core, self.rp, self.perms):
+			for value in type(cog).__dict__.values():
+				if isinstance(value, commands.Command) and not isinstance(value, commands.Group) and value.parent is None:
+					for name in [value.name] + list(value.aliases):
+						self.commands[name] = (cog, value)
+
+		rng = random.Random(self.params['seed'])
+		player = permissions._grant_perm(permissions._grant_perm(0, permissions.p_open), permissions.close)
+		chanop = 0
+		for perm in permissions._perms_lut_unaliased.values():
+			chanop = permissions._grant_perm(chanop, perm)
+		muted = permissions._deny_perm(permissions._deny_perm(0, permissions.p_open), permissions.close)
+
+		region_rows, settings_rows, permission_rows = [], [], []
+		for g in range(self.params['guilds']):
+			# Roles 0-2 are player, chanop and muted; members hold at most one.
+			guild = build_guild(g + 1, categories=5, roles=3, members=self.params['members'], roles_per_member=1, seed=self.params['seed'] + g)
+			guild.http = self.http
+			guild.me = self.bot.user
+			guild.on_send = self._sent
+			for role, code in zip(guild.roles, (player, chanop, muted)):
+				permission_rows.append((guild.id, role.id, code))
+			settings_rows.append((guild.id, guild.categories[-1].id))
+
+			names = []
+			for r in range(self.params['regions']):
+				name = region_name(rng, r)
+				channel_id = guild.id * 10000000 + r
+				status = rng.choice((0, 1))
+				active = guild.categories[r % (len(guild.categories) - 1)]
+				region_rows.append((channel_id, guild.id, name, 'Region {0}.'.format(r), status, active.id))
+				names.append(name)
+				guild.add_channel(FakeChannel(channel_id, self.rp._sanitize_channel_name(name), guild, guild.categories[-1].id if status else active.id))
+			self.region_names.append(names)
+			self.bot.guilds.append(guild)
+
+		await self.db.executemany('INSERT INTO regions (channel_id, guild_id, name, description, status, active_category) VALUES (?,?,?,?,?,?);', region_rows)
+		await self.db.executemany('INSERT INTO guild_settings (guild_id, inactive_category) VALUES (?,?);', settings_rows)
+		await self.db.executemany('INSERT INTO permissions (guild_id, role_id, permissions) VALUES (?,?,?);', permission_rows)
+		# A third of the guilds have their own triggers, which chat rarely hits.
+		trigger_rows = [(guild.id, 'trigger phrase {0}'.format(n), 'Reply {0}.'.format(n)) for guild in self.bot.guilds[::3] for n in range(10)]
+		await self.db.executemany('INSERT INTO triggers (guild_id, phrase, response) VALUES (?,?,?);', trigger_rows)
+		for guild in self.bot.guilds:
+			for region in await self.rp._list_regions(guild.id):
+				guild.get_channel(region.channel_id).topic = await self.rp._generate_topic(region)
+		self.bot.index()
+		await tracker().load()
+		await triggers.table().load()
+
+	def _sent(self, message):
+		self.recent.append(message)
+		if message.embed is not None and message.embed.title and message.embed.title.startswith('⚠'):
+			self.recent_errors.append(message)
+
+	''' -----Event generation----- '''
+
+	def generate(self, rate, count, seed):
+		''' Yields `count` events with Poisson arrival times at `rate` per second. '''
+		rng = random.Random(seed)
+		t = 0.0
+		for i in range(count):
+			t = t + (rng.expovariate(rate) if rate else 0)
+			g = rng.randrange(self.params['guilds'])
+			event = {'t' : t, 'guild' : g, 'channel' : rng.randrange(self.params['regions']), 'member' : rng.randrange(self.params['members'])}
+			kind = rng.random()
+			if kind < 0.7:
+				event['type'] = 'message'
+				event['content'] = ' '.join(rng.choice(_chat) for n in range(rng.randint(3, 20)))
+				if rng.random() < 0.01:
+					event['mention'] = True
+				elif rng.random() < 0.005:
+					event['content'] = event['content'] + ' scp-1360'
+			elif kind < 0.9:
+				event['type'] = 'message'
+				event['content'] = self._command(rng, g)
+			else:
+				event['type'] = 'reaction'
+				event['emoji'] = '🚮' if rng.random() < 0.7 else '✳'
+				event['pick'] = rng.random()
+			yield event
+
+	def _command(self, rng, g):
+		name = rng.choice(self.region_names[g])
+		choice = rng.random()
+		if choice < 0.35:
+			return '{0}open {1}'.format(_prefix, name)
+		if choice < 0.7:
+			return '{0}close {1}'.format(_prefix, name)
+		if choice < 0.8:
+			return '{0}list'.format(_prefix)
+		if choice < 0.88:
+			return '{0}ping'.format(_prefix)
+		if choice < 0.93:
+			return '{0}myperms'.format(_prefix)
+		if choice < 0.97:
+			return '{0}describe {1}'.format(_prefix, ' '.join(rng.choice(_chat) for n in range(6)))
+		return '{0}nosuchcommand'.format(_prefix) # CommandNotFound path
+
+	''' -----Dispatch----- '''
+
+	async def handle(self, event):
+		guild = self.bot.guilds[event['guild'] % len(self.bot.guilds)]
+		channel = list(guild.channels.values())[event['channel'] % len(guild.channels)]
+		member = guild.members[event['member'] % len(guild.members)]
+
+		if event['type'] == 'message':
+			message = FakeMessage(channel, member, event['content'], mentions=[self.bot.user] if event.get('mention') else [])
+			self.last_author[channel.id] = member
+			await self.core.on_message(message)
+			await self.rp.on_message(message)
+			if message.content.startswith(_prefix):
+				await self.dispatch(message)
+			return 'command' if message.content.startswith(_prefix) else 'message'
+
+		pool = self.recent if event['emoji'] == '🚮' else self.recent_errors
+		if not pool:
+			return 'reaction'
+		target = pool[int(event['pick'] * len(pool))]
+		reactor = self.last_author.get(target.channel.id, member)
+		await self.core.on_raw_reaction_add(RawReaction(target, reactor.id, event['emoji']))
+		return 'reaction'
+
+	def _arguments(self, callback, rest):
+		''' Split the rest of the command line the way the generated commands expect. '''
+		args, kwargs = [], {}
+		words = rest.split()
+		parameters = list(inspect.signature(callback).parameters.values())[2:] # self, ctx
+		for parameter in parameters:
+			if parameter.kind == parameter.VAR_POSITIONAL:
+				args.extend(words)
+				words = []
+			elif parameter.kind == parameter.KEYWORD_ONLY:
+				if rest:
+					kwargs[parameter.name] = rest
+			elif words:
+				args.append(words.pop(0))
+		return args, kwargs
+
+	async def dispatch(self, message):
+		name, _, rest = message.content[len(_prefix):].partition(' ')
+		found = self.commands.get(name)
+		if not found:
+			ctx = FakeContext(self.bot, message, invoked_with=name)
+			await self.core.on_command_error(ctx, commands.CommandNotFound('Command "{0}" is not found'.format(name)))
+			return
+
+		cog, command = found
+		ctx = FakeContext(self.bot, message, command, name)
+		try:
+			for check in command.checks:
+				result = check(ctx)
+				if inspect.isawaitable(result):
+					result = await result
+				if not result:
+					raise commands.CheckFailure('The check functions for command {0} failed.'.format(command.qualified_name))
+			args, kwargs = self._arguments(command.callback, rest.strip())
+			try:
+				await command.callback(cog, ctx, *args, **kwargs)
+			except commands.CommandError:
+				raise
+			except Exception as e:
+				raise commands.CommandInvokeError(e) from e
+		except commands.CommandError as error:
+			await self.core.on_command_error(ctx, error)
+
+
+class Replay:
+	def __init__(self, world, events):
+		self.world = world
+		self.events = events
+		self.latencies = collections.defaultdict(list) # event type -> seconds
+		self.lag = []
+		self.failures = collections.Counter()
+		self.failure_samples = []
+
+	async def _monitor_lag(self):
+		while True:
+			expected = time.perf_counter() + _lag_interval
+			await asyncio.sleep(_lag_interval)
+			self.lag.append(max(0.0, time.perf_counter() - expected))
+
+	async def _run_one(self, event, due):
+		try:
+			kind = await self.world.handle(event)
+		except Exception as e:
+			# Command errors are handled by on_command_error; anything that
+			# escapes a handler would be a "Task exception" in production.
+			kind = event['type']
+			self.failures[type(e).__name__] += 1
+			if len(self.failure_samples) < 3:
+				self.failure_samples.append(''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+		self.latencies[kind].append(time.perf_counter() - due)
+
+	async def run(self):
+		monitor = asyncio.ensure_future(self._monitor_lag())
+		tasks = []
+		started = time.perf_counter()
+		for event in self.events:
+			due = started + event['t']
+			delay = due - time.perf_counter()
+			if delay > 0:
+				await asyncio.sleep(delay)
+			else:
+				await asyncio.sleep(0) # let running handlers progress even when behind
+			tasks.append(asyncio.ensure_future(self._run_one(event, max(due, started))))
+		arrived = time.perf_counter()
+		await asyncio.gather(*tasks)
+		finished = time.perf_counter()
+		monitor.cancel()
+		return (arrived - started, finished - started, len(tasks))
+
+	def report(self, arrival_seconds, total_seconds, count):
+		def summary(values):
+			return {'count' : len(values), 'p50_ms' : _ms(percentile(values, 0.5)), 'p99_ms' : _ms(percentile(values, 0.99)), 'max_ms' : _ms(max(values) if values else None)}
+		http = self.world.http
+		routes = sorted(http.requests.items(), key=lambda item: item[1], reverse=True)
+		return {
+			'world' : self.world.params,
+			'events' : count,
+			'arrival_seconds' : arrival_seconds,
+			'total_seconds' : total_seconds,
+			'events_per_second' : count / total_seconds if total_seconds else None,
+			'latency' : {kind : summary(values) for kind, values in sorted(self.latencies.items())},
+			'loop_lag' : summary(self.lag),
+			'http' : {
+				'requests' : sum(http.requests.values()),
+				'rate_limited' : http.rate_limited,
+				'by_route' : ['{0} {1}: {2}'.format(method, route, n) for (method, route), n in routes]
+			},
+			'handler_failures' : dict(self.failures)
+		}
+
+def _ms(seconds):
+	return None if seconds is None else round(seconds * 1000, 3)
+
+def _print_report(report):
+	print('\n{0} events for {1[guilds]} guilds ({1[regions]} regions, {1[members]} members each) in {2:.2f}s: {3:.0f} events/s'.format(report['events'], report['world'], report['total_seconds'], report['events_per_second'] or 0))
+	print('{0:<10}{1:>8}{2:>12}{3:>12}{4:>12}'.format('latency', 'count', 'p50 ms', 'p99 ms', 'max ms'))
+	for kind, stats in list(report['latency'].items()) + [('loop lag', report['loop_lag'])]:
+		print('{0:<10}{1:>8}{2:>12}{3:>12}{4:>12}'.format(kind, stats['count'], stats['p50_ms'], stats['p99_ms'], stats['max_ms']))
+	print('REST requests: {0}, 429s: {1}'.format(report['http']['requests'], report['http']['rate_limited']))
+	for line in report['http']['by_route'][:8]:
+		print('  ' + line)
+	if report['handler_failures']:
+		print('Exceptions escaping handlers: {0}'.format(report['handler_failures']))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Replay gateway events through Hector\'s cog handlers.')
+	parser.add_argument('--guilds', type=int, default=50)
+	parser.add_argument('--regions', type=int, default=20, help='regions per guild')
+	parser.add_argument('--members', type=int, default=50, help='members per guild')
+	parser.add_argument('--rate', type=float, default=200, help='events per second; 0 sends them back to back')
+	parser.add_argument('--duration', type=float, default=10, help='seconds of events to generate (ignored with --events or --replay)')
+	parser.add_argument('--events', type=int, help='number of events to generate')
+	parser.add_argument('--latency', type=float, default=0.05, help='typical REST latency in seconds')
+	parser.add_argument('--rate-limit', type=float, default=0.01, help='fraction of REST requests answered with a 429')
+	parser.add_argument('--retry-after', type=float, default=0.5, help='seconds to wait after a 429')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--record', help='save the generated event stream (JSON lines) to this file')
+	parser.add_argument('--replay', help='replay a saved event stream instead of generating one')
+	parser.add_argument('--json', help='write the report as JSON to this file')
+	args = parser.parse_args(argv)
+
+	header = None
+	recorded = None
+	if args.replay:
+		with open(args.replay) as stream:
+			header = json.loads(stream.readline())
+			recorded = [json.loads(line) for line in stream if line.strip()]
+		world_params = header['world']
+	else:
+		world_params = {'guilds' : args.guilds, 'regions' : args.regions, 'members' : args.members, 'seed' : args.seed}
+
+	directory = tempfile.mkdtemp(prefix='hector-replay-')
+	loop = asyncio.new_event_loop()
+	asyncio.set_event_loop(loop)
+	try:
+		from sql.sql import shared_db
+		from messages import tracker
+		db = shared_db(path=os.path.join(directory, 'replay.db'))
+		http = SimulatedHTTP(args.latency, args.rate_limit, args.retry_after, args.seed)
+		world = World(db, loop, http, world_params['guilds'], world_params['regions'], world_params['members'], world_params['seed'])
+		print('Building {0[guilds]} guilds...'.format(world_params))
+		loop.run_until_complete(world.build())
+
+		if recorded is None:
+			count = args.events or max(1, int(args.rate * args.duration))
+			recorded = list(world.generate(args.rate, count, args.seed))
+			if args.record:
+				with open(args.record, 'w') as stream:
+					stream.write(json.dumps({'world' : world_params}) + '\n')
+					for event in recorded:
+						stream.write(json.dumps(event) + '\n')
+
+		print('Replaying {0} events...'.format(len(recorded)))
+		replay = Replay(world, recorded)
+		report = replay.report(*loop.run_until_complete(replay.run()))
+		loop.run_until_complete(tracker().flush())
+		db.close()
+	finally:
+		loop.close()
+		shutil.rmtree(directory, ignore_errors=True)
+
+	_print_report(report)
+	for sample in replay.failure_samples:
+		print(sample)
+	if args.json:
+		with open(args.json, 'w') as output:
+			json.dump(report, output, indent=2)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+'''
+  ' Database throughput benchmark.
+	'
+	' Runs the same workloads against a temporary database with SQLite's
+	' default settings ("baseline": rollback journal, full sync, small
+	' cache) and with sql_con's default tuning ("tuned": WAL, NORMAL sync,
+	' larger cache, mmap, bigger statement cache):
+	'
+	'   writes        single-row inserts, one commit each
+	'   reads         point lookups through read-only cursors (fetchone)
+	'   reads+commit  the same lookups through transaction(), which commits
+	'   mixed         one connection writing while a second one reads, as
+	'                 two cluster processes would
+	'
+	' Usage: python3 bench/sql_bench.py [--ops N] [--json]
+'''
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+os.chdir(root) # sql_con reads sql/schema.json relative to the repository
+
+from sql.sql import sql_con, sql_async
+
+profiles = {
+	'baseline' : {'journal_mode' : 'DELETE', 'synchronous' : 'FULL', 'cache_size' : -2000, 'mmap_size' : 0, 'cached_statements' : 100},
+	'tuned' : {}
+}
+
+def _quiet_connection(path, tuning):
+	# Migration progress is printed for every fresh file; keep the report readable.
+	stdout = sys.stdout
+	sys.stdout = open(os.devnull, 'w')
+	try:
+		return sql_con(tuning=tuning, path=path)
+	finally:
+		sys.stdout.close()
+		sys.stdout = stdout
+
+async def _writes(db, ops):
+	for i in range(ops):
+		await db.execute('INSERT INTO tracked_messages (messid, sender_uid, track_time) VALUES (?,?,?);', (i, i % 97, time.time()))
+
+async def _reads(db, ops):
+	for i in range(ops):
+		await db.fetchone('SELECT messid, sender_uid FROM tracked_messages WHERE messid=?;', (i,))
+
+async def _reads_commit(db, ops):
+	for i in range(ops):
+		await db.transaction(lambda cur: cur.execute('SELECT messid, sender_uid FROM tracked_messages WHERE messid=?;', (i,)).fetchone())
+
+async def _mixed(writer, reader, ops):
+	await asyncio.gather(_writes(writer, ops), _reads(reader, ops))
+
+async def _timed(coro, ops):
+	start = time.perf_counter()
+	await coro
+	return ops / (time.perf_counter() - start)
+
+async def run_profile(name, ops):
+	directory = tempfile.mkdtemp(prefix='hector-bench-')
+	path = os.path.join(directory, 'bench.db')
+	db = sql_async(_quiet_connection(path, profiles[name]))
+	second = sql_async(_quiet_connection(path, profiles[name]))
+	try:
+		results = {}
+		results['writes'] = await _timed(_writes(db, ops), ops)
+		results['reads'] = await _timed(_reads(db, ops), ops)
+		results['reads+commit'] = await _timed(_reads_commit(db, ops), ops)
+		results['mixed'] = await _timed(_mixed(db, second, ops), ops * 2)
+		return results
+	finally:
+		db.close()
+		second.close()
+		for suffix in ('', '-wal', '-shm', '-journal'):
+			if os.path.exists(path + suffix):
+				os.remove(path + suffix)
+		os.rmdir(directory)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmark database throughput with default and tuned connection settings.')
+	parser.add_argument('--ops', type=int, default=2000, help='statements per workload (default 2000)')
+	parser.add_argument('--json', action='store_true', help='print results as JSON')
+	args = parser.parse_args(argv)
+
+	loop = asyncio.get_event_loop()
+	results = {name : loop.run_until_complete(run_profile(name, args.ops)) for name in profiles}
+
+	if args.json:
+		print(json.dumps({'ops' : args.ops, 'statements_per_second' : results}, indent=2))
+		return 0
+
+	workloads = list(results['baseline'])
+	print('{0:<14}{1:>12}{2:>12}{3:>10}'.format('statements/s', 'baseline', 'tuned', 'speedup'))
+	for workload in workloads:
+		baseline = results['baseline'][workload]
+		tuned = results['tuned'][workload]
+		print('{0:<14}{1:>12.0f}{2:>12.0f}{3:>9.2f}x'.format(workload, baseline, tuned, tuned / baseline))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+'''
+  ' Offline benchmark suite for Hector's hot paths.
+	'
+	' Drives RPManager, Permissions/get_permissions and messages.track
+	' against the fake guilds in bench/fixtures.py and a temporary SQLite
+	' file, at several region and role counts. Nothing connects to
+	' Discord; channel edits complete instantly, so the results measure
+	' Hector's own work (Python and SQLite), not the network.
+	'
+	' Usage:
+	'   python3 bench/suite.py [--quick] [--output results.json]
+	'   python3 bench/suite.py --compare old.json [--threshold 0.2]
+	'
+	' Results are JSON: one entry per benchmark and scale with iterations,
+	' elapsed seconds and operations per second. --compare runs the suite
+	' and exits with status 1 if any benchmark got slower than the given
+	' fraction relative to a previous results file.
+'''
+import os
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import sqlite3
+import asyncio
+import argparse
+import platform
+import tempfile
+import datetime
+import subprocess
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(root) # sql_con reads sql/schema.json relative to the repository
+
+from fixtures import FakeBot, FakeChannel, FakeMessage, build_guild, region_name
+
+region_scales = (10, 1000, 10000)
+role_scales = (1, 10, 100, 500)
+quick_region_scales = (10, 1000)
+quick_role_scales = (1, 100)
+
+_members_per_guild = 1000
+_min_seconds = 0.5      # run each benchmark at least this long...
+_max_iterations = 20000 # ...unless it reaches this many iterations first
+
+class Suite:
+	def __init__(self, db, loop, min_seconds=_min_seconds):
+		import permissions
+		import messages
+		from mod.rp.rp import RPManager
+		self.permissions = permissions
+		self.messages = messages
+		self.db = db
+		self.loop = loop
+		self.min_seconds = min_seconds
+		self.bot = FakeBot(db, loop)
+		self.rp = RPManager(self.bot, db)
+		self.perms_cog = permissions.Permissions(self.bot)
+		self.results = []
+		self._next_guild = 1
+
+	def _guild(self, **kwargs):
+		guild = build_guild(self._next_guild, **kwargs)
+		self._next_guild = self._next_guild + 1
+		self.bot.guilds.append(guild)
+		return guild
+
+	async def measure(self, name, params, op, max_iterations=_max_iterations):
+		''' Call `await op(i)` repeatedly for at least min_seconds and record the rate. '''
+		gc.collect()
+		iterations = 0
+		started = time.perf_counter()
+		while True:
+			await op(iterations)
+			iterations = iterations + 1
+			elapsed = time.perf_counter() - started
+			if elapsed >= self.min_seconds or iterations >= max_iterations:
+				break
+		result = {'name' : name, 'params' : params, 'iterations' : iterations, 'seconds' : elapsed, 'ops_per_second' : iterations / elapsed}
+		self.results.append(result)
+		print('  {0:<28} {1:<22} {2:>12.0f} ops/s'.format(name, ', '.join('{0}={1}'.format(k, v) for k, v in sorted(params.items())), result['ops_per_second']), flush=True)
+		return result
+
+	''' -----Fixtures----- '''
+
+	async def seed_regions(self, count):
+		''' A guild with `count` regions whose channels already match their stored state. '''
+		guild = self._guild(categories=10)
+		rng = random.Random(count)
+		inactive = guild.categories[-1]
+		await self.db.execute('INSERT INTO guild_settings (guild_id, inactive_category) VALUES (?,?);', (guild.id, inactive.id))
+
+		rows = []
+		for index in range(count):
+			channel_id = guild.id * 10000000 + index
+			status = rng.choice((0, 1))
+			active = guild.categories[index % (len(guild.categories) - 1)]
+			rows.append((channel_id, guild.id, region_name(rng, index), 'Region number {0}.'.format(index), status, active.id))
+		await self.db.executemany('INSERT INTO regions (channel_id, guild_id, name, description, status, active_category) VALUES (?,?,?,?,?,?);', rows)
+
+		for region in await self.rp._list_regions(guild.id):
+			category_id = await self.rp._target_category_id(region)
+			channel = FakeChannel(region.channel_id, self.rp._sanitize_channel_name(region.name), guild, category_id, await self.rp._generate_topic(region))
+			guild.add_channel(channel)
+		return guild
+
+	async def seed_roles(self, count):
+		''' A guild with `count` roles carrying random grant/deny codes, and members holding a few each. '''
+		guild = self._guild(categories=1, roles=count, members=_members_per_guild)
+		rng = random.Random(count)
+		perms = list(self.permissions._perms_lut_unaliased.values())
+		rows = []
+		for role in guild.roles:
+			code = 0
+			for perm in perms:
+				choice = rng.random()
+				if choice < 0.3:
+					code = self.permissions._grant_perm(code, perm)
+				elif choice < 0.4:
+					code = self.permissions._deny_perm(code, perm)
+			rows.append((guild.id, role.id, code))
+		await self.db.executemany('INSERT INTO permissions (guild_id, role_id, permissions) VALUES (?,?,?);', rows)
+		return guild
+
+	''' -----Benchmarks----- '''
+
+	async def bench_sanitize(self):
+		rng = random.Random(0)
+		names = [region_name(rng, index) + ' (ÄÖ — café!)' * (index % 3) for index in range(1000)]
+		async def op(i):
+			self.rp._sanitize_channel_name(names[i % len(names)])
+		await self.measure('sanitize_channel_name', {}, op)
+
+	async def bench_regions(self, count):
+		guild = await self.seed_regions(count)
+		params = {'regions' : count}
+		regions = await self.rp._list_regions(guild.id)
+
+		async def list_cold(i):
+			self.rp._regions.pop(guild.id, None)
+			self.rp._name_index.pop(guild.id, None)
+			await self.rp._list_regions(guild.id)
+		await self.measure('list_regions_cold', params, list_cold, max_iterations=max(10, 200000 // count))
+
+		async def list_warm(i):
+			await self.rp._list_regions(guild.id)
+		await self.measure('list_regions_warm', params, list_warm, max_iterations=max(10, 2000000 // count))
+
+		queries = [region.name[:len(region.name) // 2] for region in regions[:100]]
+		async def find(i):
+			await self.rp._find_regions(guild.id, queries[i % len(queries)])
+		await self.measure('find_regions', params, find)
+
+		async def apply(i):
+			# Open or close one region: a channel edit plus a write-through update.
+			region = regions[i % len(regions)]
+			region.status = 1 - region.status
+			await self.rp._apply_region_meta(region)
+		await self.measure('apply_region_meta', params, apply)
+
+	async def bench_permissions(self, count):
+		guild = await self.seed_roles(count)
+		params = {'roles' : count}
+		members = list(guild.members.values())
+
+		async def cold(i):
+			self.permissions.invalidate(guild.id)
+			await self.permissions.get_permissions(members[i % len(members)], guild)
+		await self.measure('get_permissions_cold', params, cold)
+
+		async def warm(i):
+			await self.permissions.get_permissions(members[i % len(members)], guild)
+		await self.measure('get_permissions_warm', params, warm)
+
+		async def perms_set(i):
+			role = guild.roles[i % len(guild.roles)]
+			mode = self.perms_cog._GRANT if i % 2 else self.perms_cog._DENY
+			await self.perms_cog._perms_set(guild.id, role.id, [self.permissions.p_open], mode=mode)
+		await self.measure('perms_set', params, perms_set)
+
+	async def bench_track(self):
+		guild = self._guild(members=1)
+		author = guild.members[0]
+		messages = [FakeMessage(author=author) for i in range(_max_iterations)]
+		async def op(i):
+			await self.messages.track(messages[i], author)
+		# Includes the batched writes the tracker starts in the background.
+		await self.measure('track', {}, op)
+		await self.messages.tracker().flush()
+
+	async def run(self, region_counts, role_counts):
+		await self.bench_sanitize()
+		for count in region_counts:
+			await self.bench_regions(count)
+		for count in role_counts:
+			await self.bench_permissions(count)
+		await self.bench_track()
+		return self.results
+
+
+def _git_revision():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def _key(result):
+	return (result['name'], tuple(sorted(result['params'].items())))
+
+def compare(old, new, threshold):
+	''' Print the change per benchmark; returns the results that slowed down by more than threshold. '''
+	previous = {_key(result) : result for result in old['results']}
+	regressions = []
+	print('\n{0:<28} {1:<22} {2:>12} {3:>12} {4:>8}'.format('benchmark', 'params', 'old ops/s', 'new ops/s', 'change'))
+	for result in new['results']:
+		before = previous.get(_key(result))
+		if not before:
+			continue
+		change = result['ops_per_second'] / before['ops_per_second'] - 1
+		flag = ''
+		if change < -threshold:
+			flag = '  REGRESSION'
+			regressions.append(result)
+		print('{0:<28} {1:<22} {2:>12.0f} {3:>12.0f} {4:>+7.1%}{5}'.format(result['name'], ', '.join('{0}={1}'.format(k, v) for k, v in sorted(result['params'].items())), before['ops_per_second'], result['ops_per_second'], change, flag))
+	return regressions
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Run Hector\'s offline benchmark suite.')
+	parser.add_argument('--quick', action='store_true', help='smaller scales: {0} regions, {1} roles'.format(quick_region_scales, quick_role_scales))
+	parser.add_argument('--min-seconds', type=float, default=_min_seconds, help='minimum run time per benchmark (default {0})'.format(_min_seconds))
+	parser.add_argument('--output', help='write results as JSON to this file')
+	parser.add_argument('--compare', help='compare with a previous results file and fail on regressions')
+	parser.add_argument('--threshold', type=float, default=0.2, help='slowdown fraction counted as a regression (default 0.2)')
+	args = parser.parse_args(argv)
+
+	directory = tempfile.mkdtemp(prefix='hector-bench-')
+	loop = asyncio.new_event_loop()
+	asyncio.set_event_loop(loop)
+	try:
+		from sql.sql import shared_db
+		db = shared_db(path=os.path.join(directory, 'bench.db')) # every module's shared_db() now returns this handle
+		suite = Suite(db, loop, args.min_seconds)
+		print('Running benchmarks...')
+		results = loop.run_until_complete(suite.run(quick_region_scales if args.quick else region_scales, quick_role_scales if args.quick else role_scales))
+		db.close()
+	finally:
+		loop.close()
+		shutil.rmtree(directory, ignore_errors=True)
+
+	report = {
+		'meta' : {
+			'revision' : _git_revision(),
+			'time' : datetime.datetime.utcnow().isoformat(),
+			'python' : platform.python_version(),
+			'sqlite' : sqlite3.sqlite_version,
+			'platform' : platform.platform(),
+			'quick' : args.quick,
+			'min_seconds' : args.min_seconds
+		},
+		'results' : results
+	}
+	if args.output:
+		with open(args.output, 'w') as output:
+			json.dump(report, output, indent=2)
+		print('Results written to {0}'.format(args.output))
+
+	if args.compare:
+		with open(args.compare) as previous:
+			regressions = compare(json.load(previous), report, args.threshold)
+		if regressions:
+			print('{0} benchmark(s) regressed by more than {1:.0%}.'.format(len(regressions), args.threshold))
+			return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,249 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import subprocess
+import traceback
+
+import discord
+from discord.ext import commands
+
+from sql.sql import sql_con, sql_cur
+from messages import track
+
+''' -----Cluster defaults----- '''
+# Overridden by the optional "cluster" block in .bot_info.json.
+_defaults = {
+	'sharded' : False,         # use AutoShardedBot in a single process
+	'processes' : 1,           # worker processes; more than 1 implies sharding
+	'shard_count' : None,      # total shards; None asks Discord for its recommendation
+	'heartbeat_seconds' : 30,  # how often each process updates cluster_health
+	'restart_delay' : 10,      # seconds before a crashed worker is restarted
+	'identify_seconds' : 5     # seconds per shard between worker starts; Discord allows one IDENTIFY every 5 seconds
+}
+
+def cluster_settings(settings):
+	result = dict(_defaults)
+	result.update(settings.get('cluster') or {})
+	return result
+
+def shard_ranges(shard_count, processes):
+	''' Split shards 0..shard_count-1 into contiguous ranges, one per process. '''
+	return [list(range(k * shard_count // processes, (k + 1) * shard_count // processes)) for k in range(processes)]
+
+def parse_shard_ids(text):
+	''' "0,1,2" or "0-2" -> [0, 1, 2] '''
+	ids = []
+	for part in text.split(','):
+		if '-' in part:
+			first, last = part.split('-', 1)
+			ids.extend(range(int(first), int(last) + 1))
+		else:
+			ids.append(int(part))
+	return ids
+
+def format_shard_ids(ids):
+	if not ids:
+		return 'none'
+	if list(ids) == list(range(ids[0], ids[-1] + 1)):
+		return '{0}-{1}'.format(ids[0], ids[-1]) if len(ids) > 1 else str(ids[0])
+	return ','.join(str(i) for i in ids)
+
+async def _fetch_recommended_shards(token):
+	http = discord.http.HTTPClient()
+	try:
+		await http.static_login(token, bot=True)
+		shards, _ = await http.get_bot_gateway()
+		return shards
+	finally:
+		await http.close()
+
+def recommended_shard_count(token):
+	''' Ask Discord how many shards this bot should run. '''
+	loop = asyncio.new_event_loop()
+	try:
+		return loop.run_until_complete(_fetch_recommended_shards(token))
+	finally:
+		loop.close()
+
+
+class Launcher:
+	'''
+	  ' Runs the bot as several worker processes, each owning a contiguous
+		' range of shards.
+		'
+		' Every worker opens the same SQLite file. The launcher applies
+		' schema migrations once before any worker starts, so workers only
+		' ever find an up-to-date schema; after that, WAL mode (the default
+		' journal_mode) and the busy timeout set by sql_con let the
+		' processes read concurrently and take turns writing. Guild state
+		' (regions, permissions, tracked messages) is naturally
+		' partitioned, because Discord routes every guild's events to
+		' exactly one shard.
+		'
+		' Workers are started one at a time: each start waits until the
+		' previous worker has had identify_seconds per shard to IDENTIFY
+		' all of its shards, since Discord only accepts one IDENTIFY per
+		' 5 seconds per bot. Restarts take their turn in the same queue.
+		'
+		' Workers that crash are restarted after a delay. SIGINT/SIGTERM
+		' are forwarded to the workers, which shut down cleanly and flush
+		' their buffers.
+	'''
+	def __init__(self, script, processes, shard_count, restart_delay=10, tuning=None, identify_seconds=5):
+		self.script = script
+		self.processes = processes
+		self.shard_count = shard_count
+		self.restart_delay = restart_delay
+		self.identify_seconds = identify_seconds
+		self.tuning = tuning
+		self.ranges = shard_ranges(shard_count, processes)
+		self.workers = {}   # cluster id -> Popen
+		self.restart_at = {} # cluster id -> time.monotonic() after which to restart
+		self.pending = []    # cluster ids waiting for their turn to start, in order
+		self.next_start = 0  # time.monotonic() after which the next pending worker may start
+		self._stopping = False
+
+	def _command(self, cluster_id):
+		return [sys.executable, self.script,
+			'--cluster-id', str(cluster_id),
+			'--shard-ids', format_shard_ids(self.ranges[cluster_id]),
+			'--shard-count', str(self.shard_count)]
+
+	def _start(self, cluster_id):
+		print('Cluster: starting process {0} for shards {1} of {2}.'.format(cluster_id, format_shard_ids(self.ranges[cluster_id]), self.shard_count))
+		self.workers[cluster_id] = subprocess.Popen(self._command(cluster_id))
+
+	def _start_pending(self):
+		''' Start the next waiting worker, if the previous one has had time to identify its shards. '''
+		now = time.monotonic()
+		if self.pending and now >= self.next_start:
+			cluster_id = self.pending.pop(0)
+			self._start(cluster_id)
+			self.next_start = now + self.identify_seconds * len(self.ranges[cluster_id])
+
+	def _prepare_database(self):
+		con = sql_con(tuning=self.tuning) # applies any pending migrations, once, before workers exist
+		with sql_cur(con) as cur:
+			cur.execute('DELETE FROM cluster_health;') # forget processes from a previous layout
+		con.raw.close()
+
+	def _request_stop(self, signum, frame):
+		self._stopping = True
+
+	def _stop_all(self):
+		for worker in self.workers.values():
+			if worker.poll() is None:
+				worker.terminate()
+		for cluster_id, worker in self.workers.items():
+			try:
+				worker.wait(timeout=30)
+			except subprocess.TimeoutExpired:
+				print('Cluster: process {0} did not stop in time, killing it.'.format(cluster_id))
+				worker.kill()
+
+	def run(self):
+		self._prepare_database()
+		signal.signal(signal.SIGTERM, self._request_stop)
+		self.pending = list(range(self.processes))
+
+		try:
+			while not self._stopping:
+				self._start_pending()
+				time.sleep(1)
+				for cluster_id, worker in list(self.workers.items()):
+					code = worker.poll()
+					if code is None:
+						continue
+					if code == 0:
+						# A clean exit (e.g. the bot was logged out) is not restarted.
+						print('Cluster: process {0} exited.'.format(cluster_id))
+						del self.workers[cluster_id]
+					elif cluster_id not in self.restart_at:
+						print('Cluster: process {0} exited with code {1}, restarting in {2}s.'.format(cluster_id, code, self.restart_delay))
+						self.restart_at[cluster_id] = time.monotonic() + self.restart_delay
+					elif time.monotonic() >= self.restart_at[cluster_id]:
+						del self.restart_at[cluster_id]
+						del self.workers[cluster_id]
+						self.pending.append(cluster_id)
+				if not self.workers and not self.pending:
+					return 0
+		except KeyboardInterrupt:
+			pass
+
+		print('Cluster: stopping {0} process(es)...'.format(len(self.workers)))
+		self._stop_all()
+		return 0
+
+
+class ClusterHealth:
+	'''
+	  ' Each process periodically records its shards, guild count and
+		' gateway latency in the shared cluster_health table, so any process
+		' can show the state of the whole cluster. A single-process bot
+		' reports as process 0.
+	'''
+	def __init__(self, bot, db_hook, heartbeat_seconds=30):
+		self.bot = bot
+		self.db = db_hook
+		self.heartbeat_seconds = heartbeat_seconds
+		self.cluster_id = getattr(bot, 'cluster_id', 0)
+		self.started = time.time()
+		self._task = None
+
+	def __unload(self):
+		if self._task:
+			self._task.cancel()
+
+	async def on_ready(self):
+		if not self._task:
+			self._task = self.bot.loop.create_task(self._run())
+
+	def _shard_ids(self):
+		shard_ids = getattr(self.bot, 'shard_ids', None)
+		if shard_ids:
+			return list(shard_ids)
+		if self.bot.shard_count:
+			return list(range(self.bot.shard_count))
+		return [0] # unsharded: the only connection is shard 0
+
+	async def heartbeat(self):
+		latency = self.bot.latency
+		await self.db.execute('INSERT OR REPLACE INTO cluster_health (cluster_id, pid, shard_ids, shard_count, guilds, latency, started, heartbeat_time) VALUES (?,?,?,?,?,?,?,?);', (self.cluster_id, os.getpid(), format_shard_ids(self._shard_ids()), self.bot.shard_count or 1, len(self.bot.guilds), None if latency != latency else latency, self.started, time.time()))
+
+	async def _run(self):
+		while not self.bot.is_closed():
+			try:
+				await self.heartbeat()
+			except Exception as e:
+				print('Cluster heartbeat failed:\n{0}'.format(''.join(traceback.format_exception(type(e), e, e.__traceback__))))
+			await asyncio.sleep(self.heartbeat_seconds)
+
+	@commands.is_owner()
+	@commands.command()
+	async def health(self, ctx):
+		''' (Owner-only) Shows shards, guilds and latency for every bot process. '''
+		await self.heartbeat()
+		rows = await self.db.fetchall('SELECT cluster_id, pid, shard_ids, shard_count, guilds, latency, started, heartbeat_time FROM cluster_health ORDER BY cluster_id;')
+		now = time.time()
+		stale_after = self.heartbeat_seconds * 3
+
+		stale = 0
+		embed = discord.Embed(title='\U0001f5a5 Cluster health', colour=discord.Colour(0x419492))
+		for row in rows:
+			age = now - row[7]
+			status = '✅'
+			if age > stale_after:
+				status = '⚠ no heartbeat'
+				stale = stale + 1
+			latency = 'unknown' if row[5] is None else '{0:.0f} ms'.format(row[5] * 1000)
+			embed.add_field(name='Process {0} (pid {1}) {2}'.format(row[0], row[1], status), value='Shards {0} of {1}, {2} guilds, latency {3}, up {4:.0f} min, last heartbeat {5:.0f}s ago'.format(row[2], row[3], row[4], latency, (now - row[6]) / 60, age), inline=False)
+		embed.description = '{0} process(es), {1} guilds in total{2}.'.format(len(rows), sum(row[4] for row in rows), ', {0} not responding'.format(stale) if stale else '')
+
+		msg = await ctx.send(content='', embed=embed)
+		await track(msg, ctx.author)
+
+
+def setup(bot):
+	bot.add_cog(ClusterHealth(bot, bot.db, cluster_settings(bot.settings)['heartbeat_seconds']))
@@ -0,0 +1,89 @@
+import datetime
+import hashlib
+import traceback
+import zlib
+
+def _chain(error):
+	''' The exception and the exceptions it was raised from, outermost first. '''
+	while error is not None:
+		yield error
+		if error.__cause__ is not None:
+			error = error.__cause__
+		elif error.__context__ is not None and not error.__suppress_context__:
+			error = error.__context__
+		else:
+			error = None
+
+def fingerprint(error):
+	'''
+	  ' Identify an error by what failed and where, not by its message.
+		' 
+		' The fingerprint hashes the type and stack frames (file, function,
+		' line) of every exception in the chain. Two failures of the same
+		' call site share a fingerprint even if their messages contain
+		' different ids or names.
+	'''
+	digest = hashlib.sha1()
+	for link in _chain(error):
+		digest.update('{0}.{1}\n'.format(type(link).__module__, type(link).__qualname__).encode())
+		for frame in traceback.extract_tb(link.__traceback__):
+			digest.update('{0}:{1}:{2}\n'.format(frame.filename, frame.name, frame.lineno).encode())
+	return digest.hexdigest()
+
+
+class ErrorStore:
+	'''
+	  ' Deduplicated storage for command errors.
+		' 
+		' Each distinct backtrace (see fingerprint()) is stored once,
+		' zlib-compressed, in error_traces along with an occurrence count.
+		' Every failure still gets its own error_messages row, which points
+		' at the trace by fingerprint, so ✳ expansion keeps working per
+		' message. Rows written before fingerprinting keep their backtrace
+		' inline in error_messages.full_backtrace.
+	'''
+	def __init__(self, db):
+		self.db = db
+
+	async def record(self, error, message, command_name, command_string):
+		'''
+		  ' Store an occurrence of error, reported in message.
+			' Returns (backtrace text, fingerprint, whether the fingerprint is new).
+		'''
+		bt_string = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+		error_fp = fingerprint(error)
+		now = datetime.datetime.utcnow()
+
+		def write(cur):
+			cur.execute('UPDATE error_traces SET occurrences=occurrences+1, last_seen=? WHERE fingerprint=?;', (now, error_fp))
+			is_new = cur.rowcount == 0
+			if is_new: # only compress traces we have not seen before
+				cur.execute('INSERT INTO error_traces (fingerprint, error_name, command_name, backtrace, occurrences, first_seen, last_seen) VALUES (?,?,?,?,1,?,?);', (error_fp, str(type(error)), command_name, zlib.compress(bt_string.encode()), now, now))
+			cur.execute('INSERT INTO error_messages (message_id, channel_id, command_name, error_name, error_text, full_command_string, error_time, fingerprint) VALUES (?,?,?,?,?,?,?,?);', (message.id, message.channel.id, command_name, str(type(error)), str(error), command_string, now, error_fp))
+			return is_new
+
+		is_new = await self.db.transaction(write)
+		return (bt_string, error_fp, is_new)
+
+	async def fetch(self, message_id, channel_id, with_backtrace=False):
+		'''
+		  ' Returns (command name, error name, error text, command string,
+			' backtrace or None) for the error reported in a message, or None.
+			' The backtrace is only read and decompressed if asked for.
+		'''
+		row = await self.db.fetchone('SELECT command_name, error_name, error_text, full_command_string, full_backtrace, fingerprint FROM error_messages WHERE message_id=? AND channel_id=?;', (message_id, channel_id))
+		if not row:
+			return None
+
+		backtrace = None
+		if with_backtrace:
+			backtrace = row[4]
+			if row[5]:
+				trace = await self.db.fetchone('SELECT backtrace FROM error_traces WHERE fingerprint=?;', (row[5],))
+				if trace:
+					backtrace = zlib.decompress(trace[0]).decode()
+		return (row[0], row[1], row[2], row[3], backtrace)
+
+	async def top(self, limit=10):
+		''' Returns the most frequent fingerprints as (fingerprint, error name, command name, occurrences, last seen). '''
+		return await self.db.fetchall('SELECT fingerprint, error_name, command_name, occurrences, last_seen FROM error_traces ORDER BY occurrences DESC LIMIT ?;', (limit,))
@@ -1,34 +1,78 @@
 #!/usr/bin/env python
+import os
 import sys
-import traceback
 import math
 import json
+import time
+import sqlite3
+import argparse
+import importlib
+import contextlib
 
 import discord
 from discord.ext import commands
 
-from sql.sql import sql_cur, sql_con
-import permissions
-from messages import track
+from sql.sql import shared_db, sql_con, check_tuning, database_initialize_error
+from messages import track, tracker
+from errors import ErrorStore
+import cluster
+import triggers
+import sweeper
 
 settings = None
 bot_version = ''
-with open('.bot_info.json') as bot_info:
-	settings = json.load(bot_info)
+bot_url = 'https://discordapp.com/api/oauth2/authorize?client_id={0}&scope=bot&permissions=469838928'
+bot_prefix = None
+_database_path = 'data/sqlite3.db'
 
-with open('version.json') as version:
-	bot_version = json.load(version)['version']
+extensions = ['metrics', 'permissions', 'mod.rp.rp', 'sweeper', 'cluster', 'profiler', 'triggers']
 
-bot_url = 'https://discordapp.com/api/oauth2/authorize?client_id={0}&scope=bot&permissions=469838928'
-bot_prefix = settings['command_prefix']
-bot_desc = settings['description']
-bot_token = settings['token']
+def load_config():
+	'''
+	  ' Load .bot_info.json and version.json into the module settings.
+	  ' Rename 'bot_info.json.skel' to '.bot_info.json' and put your token there.
+	'''
+	global settings, bot_version, bot_prefix
+	with open('.bot_info.json') as bot_info:
+		settings = json.load(bot_info)
+
+	with open('version.json') as version:
+		bot_version = json.load(version)['version']
+
+	for key in ('command_prefix', 'description', 'token'):
+		if not settings.get(key):
+			raise ValueError('.bot_info.json is missing "{0}".'.format(key))
+	bot_prefix = settings['command_prefix']
+
+class StartupTimer:
+	''' Records how long each phase of startup takes. '''
+	def __init__(self):
+		self.started = time.perf_counter()
+		self.phases = []
+		self._mark = self.started
+
+	@contextlib.contextmanager
+	def phase(self, name):
+		start = time.perf_counter()
+		yield
+		self.phases.append((name, time.perf_counter() - start))
+		self._mark = time.perf_counter()
+
+	def since_last_phase(self, name):
+		''' Record a phase that started when the previous one ended (e.g. waiting for the gateway). '''
+		self.phases.append((name, time.perf_counter() - self._mark))
+		self._mark = time.perf_counter()
+
+	def report(self):
+		breakdown = ', '.join('{0} {1:.3f}s'.format(name, seconds) for name, seconds in self.phases)
+		return 'Startup took {0:.3f}s ({1})'.format(time.perf_counter() - self.started, breakdown)
 
 class Hectorbot_Core:
 	''' Basic functionality '''
 	def __init__(self, bot, db_hook):
 		self.bot = bot
 		self.db = db_hook
+		self.errors = ErrorStore(db_hook)
 
 	
 	@commands.command()
@@ -95,18 +139,21 @@ class Hectorbot_Core:
 			if not ctx.command:
 				return
 			await msg.add_reaction('\u2733')
-			with sql_cur(self.db) as cur:
-				bt_string = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
-				print('Hector encountered an error:\n{0}'.format(bt_string))
-				cur.execute('INSERT INTO error_messages (message_id, channel_id, command_name, error_name, error_text, full_backtrace, full_command_string) VALUES (?,?,?,?,?,?,?);',(msg.id, msg.channel.id, ctx.command.name, str(type(error)), str(error), bt_string, ctx.message.content))
+			bt_string, error_fp, is_new = await self.errors.record(error, msg, ctx.command.name, ctx.message.content)
+			tracker().add_error(msg.id)
+			if is_new:
+				print('Hector encountered an error (fingerprint {0}):\n{1}'.format(error_fp, bt_string))
+			else:
+				print('Hector encountered a known error (fingerprint {0}): {1}'.format(error_fp, str(error)))
 	
 	async def on_message(self, message):
-		if 'scp-1360' in message.content.lower() or 'scp 1360' in message.content.lower():
-			if message.author.id == self.bot.user.id:
-				return
-			msg = await message.channel.send('*((I have a name, you know.))*')
+		if message.author.bot:
+			return
+		response = triggers.table().matcher(message.guild.id if message.guild else None).match(message.content.lower())
+		if response:
+			msg = await message.channel.send(response)
 			await track(msg, message.author)
-		if message.author.id != self.bot.user.id and self.bot.user in message.mentions:
+		if self.bot.user in message.mentions:
 			chan = message.channel
 			my_message = await chan.send('Use ``{0}help`` for a list of commands. (press 🚮 to remove)'.format(bot_prefix))
 			await track(my_message, message.author)
@@ -115,11 +162,14 @@ class Hectorbot_Core:
 		if payload.user_id == self.bot.user.id:
 			return
 		if payload.emoji.name == '🚮':
+			if not tracker().is_tracked(payload.message_id):
+				return
 			is_tracked = False
-			sender_uid = None
-			with sql_cur(self.db) as cur:
-				cur.execute("SELECT messid, sender_uid FROM tracked_messages WHERE messid=?", (payload.message_id,))
-				row = cur.fetchone()
+			sender_uid = tracker().sender_of(payload.message_id)
+			if sender_uid is not None:
+				is_tracked = True # Not flushed to the database yet
+			else:
+				row = await self.db.fetchone("SELECT messid, sender_uid FROM tracked_messages WHERE messid=?", (payload.message_id,))
 				if row:
 					is_tracked = True
 					sender_uid = row[1]
@@ -131,10 +181,9 @@ class Hectorbot_Core:
 					relevant_message = await self.bot.get_channel(payload.channel_id).get_message(payload.message_id)
 					await relevant_message.delete()
 		elif payload.emoji.name == '\u2733':
-			row = None
-			with sql_cur(self.db) as cur:
-				cur.execute('SELECT command_name, error_name, error_text, full_command_string, full_backtrace FROM error_messages WHERE message_id=? AND channel_id=?;',(payload.message_id, payload.channel_id))
-				row = cur.fetchone()
+			if not tracker().is_error(payload.message_id):
+				return
+			row = await self.errors.fetch(payload.message_id, payload.channel_id, with_backtrace=True)
 			if not row:
 				return
 
@@ -147,10 +196,9 @@ class Hectorbot_Core:
 		if payload.user_id == self.bot.user.id:
 			return
 		if payload.emoji.name == '\u2733':
-			row = None
-			with sql_cur(self.db) as cur:
-				cur.execute('SELECT command_name, error_name, error_text, full_command_string, full_backtrace FROM error_messages WHERE message_id=? AND channel_id=?;',(payload.message_id, payload.channel_id))
-				row = cur.fetchone()
+			if not tracker().is_error(payload.message_id):
+				return
+			row = await self.errors.fetch(payload.message_id, payload.channel_id)
 			if not row:
 				return
 
@@ -165,6 +213,16 @@ class Hectorbot_Core:
 		global bot_url
 		processed_url = bot_url.format(self.bot.user.id)
 		print('Hector is active. \nUser info: {0}\nInvite URL: {1}'.format(self.bot.user, processed_url))
+		timer = getattr(self.bot, 'startup_timer', None)
+		if timer:
+			# Only after the first connect; later on_ready events are reconnects.
+			self.bot.startup_timer = None
+			timer.since_last_phase('gateway ready')
+			print(timer.report())
+		if not tracker().loaded:
+			await tracker().load()
+		if not triggers.table().loaded:
+			await triggers.table().load()
 		await self.bot.change_presence(activity=discord.Game(name='among the twisted pines.'))
 	
 	async def on_command_completion(self, ctx):
@@ -175,6 +233,20 @@ class Hectorbot_Core:
 					break
 				
 
+	@commands.is_owner()
+	@commands.command(name='errors')
+	async def top_errors(self, ctx, count: int=10):
+		''' (Owner-only) Lists the most frequent errors by fingerprint. '''
+		rows = await self.errors.top(min(max(count, 1), 25))
+		embed = discord.Embed(title='\u26a0 Most frequent errors', colour=discord.Colour(0x913232), description='Press \u2733 on any report of an error to see its backtrace.')
+		for row in rows:
+			embed.add_field(name='{0}\u00d7 {1}'.format(row[3], row[1]), value='Fingerprint ``{0}``, command ``{1}``, last seen {2}'.format(row[0][:12], row[2], row[4]), inline=False)
+		if len(rows) == 0:
+			embed.add_field(name='No errors recorded.', value='\u2705', inline=False)
+
+		msg = await ctx.send(content='', embed=embed)
+		await track(msg, ctx.author)
+
 	@commands.command()
 	async def ping(self, ctx):
 		''' Pings Hector to check your connection. '''
@@ -194,11 +266,129 @@ class Hectorbot_Core:
 		await track(msg, ctx.author)
 
 
-global_db_hook = sql_con()
+def check(timer):
+	'''
+	  ' Validate the configuration, database schema and extensions without
+	  ' connecting to Discord or changing the database. Returns an exit code.
+	'''
+	problems = []
+	try:
+		with timer.phase('database'):
+			check_tuning(settings.get('database'))
+			directory = os.path.dirname(_database_path) or '.'
+			if not os.path.isdir(directory):
+				raise database_initialize_error('directory {0} does not exist.'.format(directory))
+			if not os.path.exists(_database_path):
+				pending = None
+			else:
+				con = sql_con(apply_migrations=False, readonly=True, path=_database_path)
+				try:
+					pending = con.pending_migrations()
+				finally:
+					con.raw.close()
+		if pending is None:
+			print('Database: {0} does not exist yet; it will be created at startup.'.format(_database_path))
+		elif pending:
+			print('Database: {0} migration(s) will be applied at startup: {1}'.format(len(pending), ', '.join(str(m['version']) for m in pending)))
+		else:
+			print('Database: schema is up to date.')
+	except (database_initialize_error, sqlite3.Error, OSError, ValueError, KeyError) as e:
+		problems.append('Database: {0}'.format(e))
+
+	with timer.phase('extensions'):
+		for extension in extensions:
+			try:
+				importlib.import_module(extension)
+			except Exception as e:
+				problems.append('Extension {0}: {1}'.format(extension, e))
+
+	print(timer.report())
+	for problem in problems:
+		print(problem)
+	if problems:
+		return 1
+	print('Configuration OK.')
+	return 0
+
+def vacuum():
+	''' The one-off conversion the sweeper needs for incremental vacuuming. Returns an exit code. '''
+	try:
+		con = sql_con(tuning=settings.get('database'), path=_database_path)
+		try:
+			print('Converting the database if needed; the full VACUUM can take a while on large databases...')
+			if sweeper.enable_incremental_vacuum(con):
+				print('Database converted to incremental auto-vacuum.')
+			else:
+				print('Database is already in incremental auto-vacuum mode.')
+		finally:
+			con.raw.close()
+	except (database_initialize_error, sqlite3.Error) as e:
+		print('Database: {0}'.format(e))
+		return 1
+	return 0
+
+def build_bot(timer, sharded=False, shard_ids=None, shard_count=None, cluster_id=0):
+	'''
+	  ' Without sharding, one gateway connection serves every guild. With
+	  ' sharding, AutoShardedBot runs shard_ids (all shards if None) out of
+	  ' shard_count (Discord's recommendation if None) in this process.
+	'''
+	if sharded or shard_ids is not None or shard_count:
+		hector_bot = commands.AutoShardedBot(command_prefix=bot_prefix, description=settings['description'], shard_ids=shard_ids, shard_count=shard_count)
+	else:
+		hector_bot = commands.Bot(command_prefix=bot_prefix, description=settings['description'])
+	with timer.phase('database'):
+		hector_bot.db = shared_db(settings.get('database')) # The only schema verification; extensions pick it up from bot.db
+	hector_bot.settings = settings
+	hector_bot.cluster_id = cluster_id
+	hector_bot.startup_timer = timer
+	with timer.phase('extensions'):
+		hector_bot.add_cog(Hectorbot_Core(hector_bot, hector_bot.db))
+		for extension in extensions:
+			hector_bot.load_extension(extension)
+	return hector_bot
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Hector, RP channel bot.')
+	parser.add_argument('--check', action='store_true', help='validate configuration and database schema, then exit')
+	parser.add_argument('--vacuum', action='store_true', help='convert the database to incremental auto-vacuum (one full VACUUM), then exit; run while Hector is stopped')
+	parser.add_argument('--processes', type=int, help='run this many worker processes, each owning a range of shards (overrides the "cluster" settings)')
+	parser.add_argument('--shard-count', type=int, help='total number of shards (default: Discord\'s recommendation)')
+	# Passed by the cluster launcher to each worker process.
+	parser.add_argument('--cluster-id', type=int, default=0, help=argparse.SUPPRESS)
+	parser.add_argument('--shard-ids', type=cluster.parse_shard_ids, help=argparse.SUPPRESS)
+	args = parser.parse_args(argv)
+
+	timer = StartupTimer()
+	try:
+		with timer.phase('config'):
+			load_config()
+	except (OSError, ValueError, KeyError) as e:
+		print('Configuration error: {0}'.format(e))
+		return 1
+
+	if args.check:
+		return check(timer)
+	if args.vacuum:
+		return vacuum()
+
+	cluster_config = cluster.cluster_settings(settings)
+	processes = args.processes or cluster_config['processes']
+	shard_count = args.shard_count or cluster_config['shard_count']
+	if args.shard_ids is None and processes > 1:
+		if not shard_count:
+			shard_count = cluster.recommended_shard_count(settings['token'])
+		# Every process needs at least one shard.
+		launcher = cluster.Launcher(os.path.abspath(__file__), processes, max(shard_count, processes), cluster_config['restart_delay'], settings.get('database'), cluster_config['identify_seconds'])
+		return launcher.run()
+
+	hector_bot = build_bot(timer, cluster_config['sharded'], args.shard_ids, shard_count, args.cluster_id)
+	hector_bot.run(settings['token'])
 
-hector_bot = commands.Bot(command_prefix=bot_prefix, description=bot_desc)
-hector_bot.add_cog(Hectorbot_Core(hector_bot, global_db_hook))
-hector_bot.load_extension('permissions')
-hector_bot.load_extension('mod.rp.rp')
+	# The event loop has stopped; write out anything still buffered.
+	tracker().close()
+	hector_bot.db.close()
+	return 0
 
-hector_bot.run(bot_token) # Token is loaded from the file '.bot_info.json' - Rename 'bot-info.json.skel' to '.bot-info.json' and put your token there.
+if __name__ == '__main__':
+	sys.exit(main())
@@ -1,4 +1,124 @@
-from sql.sql import sql_cur, sql_con
+import asyncio
+
+from sql.sql import shared_db
+
+class MessageTracker:
+	'''
+	  ' Write-behind buffer for the tracked_messages table.
+		' 
+		' track() only queues a row here. Rows are written together with a
+		' single executemany (one transaction, one commit) when the buffer
+		' reaches flush_size or flush_interval seconds after the first
+		' queued row, whichever comes first. close() writes whatever is
+		' left and must be called on shutdown.
+		' 
+		' Until a row has been committed, sender_of() answers from the
+		' buffer, so a 🚮 reaction that arrives before the flush still
+		' resolves.
+		' 
+		' The tracker also keeps the ids of every tracked message and every
+		' error report in memory (loaded once by load(), then kept current
+		' by add(), add_error() and forget()), so reactions on messages
+		' Hector never tracked are rejected without touching the database.
+	'''
+	def __init__(self, db, flush_interval=2.0, flush_size=50):
+		self.db = db
+		self.flush_interval = flush_interval
+		self.flush_size = flush_size
+		self._pending = {} # message id -> row, not yet handed to the DB thread
+		self._in_flight = {} # message id -> row, handed over but not yet committed
+		self._timer = None
+		self._tracked_ids = set()
+		self._error_ids = set()
+		self.loaded = False
+
+	async def load(self):
+		''' Read the ids of all tracked and error messages into memory. '''
+		for row in await self.db.fetchall('SELECT messid FROM tracked_messages;'):
+			self._tracked_ids.add(row[0])
+		for row in await self.db.fetchall('SELECT message_id FROM error_messages;'):
+			self._error_ids.add(row[0])
+		self.loaded = True
+
+	def is_tracked(self, message_id):
+		''' False only if message_id is definitely not a tracked message. '''
+		return not self.loaded or message_id in self._tracked_ids
+
+	def is_error(self, message_id):
+		''' False only if message_id is definitely not an error report. '''
+		return not self.loaded or message_id in self._error_ids
+
+	def add_error(self, message_id):
+		self._error_ids.add(message_id)
+
+	def forget(self, tracked_ids=(), error_ids=()):
+		''' Called when rows are deleted from the database. '''
+		self._tracked_ids.difference_update(tracked_ids)
+		self._error_ids.difference_update(error_ids)
+
+	def add(self, message_id, sender_uid, track_time):
+		self._tracked_ids.add(message_id)
+		self._pending[message_id] = (message_id, sender_uid, track_time)
+		if len(self._pending) >= self.flush_size:
+			asyncio.ensure_future(self.flush())
+		elif not self._timer:
+			loop = asyncio.get_event_loop()
+			self._timer = loop.call_later(self.flush_interval, lambda: asyncio.ensure_future(self.flush()))
+
+	def sender_of(self, message_id):
+		'''
+		  ' Returns the sender uid for a tracked message that has not been
+			' committed yet, or None if the buffer does not hold it.
+		'''
+		row = self._pending.get(message_id) or self._in_flight.get(message_id)
+		if row:
+			return row[1]
+		return None
+
+	def _write(self, cur, rows):
+		# Runs on the DB thread. Rows leave _in_flight once the statement
+		# has run; sql_cur commits straight after.
+		if not rows:
+			return
+		cur.executemany("INSERT INTO tracked_messages (messid, sender_uid, track_time) VALUES (?, ?, ?);", list(rows.values()))
+		for message_id in rows:
+			self._in_flight.pop(message_id, None)
+
+	async def flush(self):
+		if self._timer:
+			self._timer.cancel()
+			self._timer = None
+		if not self._pending:
+			return
+
+		rows = self._pending
+		self._pending = {}
+		self._in_flight.update(rows)
+		await self.db.transaction(lambda cur: self._write(cur, rows))
+
+	def close(self):
+		''' Synchronously write all buffered rows. Call after the event loop stops. '''
+		if self._timer:
+			self._timer.cancel()
+			self._timer = None
+		# Queued behind any flush still on the DB thread, so _in_flight only
+		# holds rows whose flush never ran.
+		def write_remaining(cur):
+			rows = dict(self._in_flight)
+			rows.update(self._pending)
+			self._pending = {}
+			self._write(cur, rows)
+		self.db.transaction_sync(write_remaining)
+
+
+_tracker = None
+
+def tracker():
+	''' Returns the process-wide MessageTracker, created on first use. '''
+	global _tracker
+	if not _tracker:
+		_tracker = MessageTracker(shared_db())
+	return _tracker
 
 async def track(message, author=None):
 	'''
@@ -6,9 +126,7 @@ async def track(message, author=None):
 	  ' deleted if the sender or an admin reacts with the 'trash' emoji
 	'''
 	await message.add_reaction('🚮')
-	sql_db = sql_con()
 	aid = 0
 	if author:
 		aid = author.id
-	with sql_cur(sql_db) as cur:
-				cur.execute("INSERT INTO tracked_messages (messid, sender_uid, track_time) VALUES (?, ?, ?);", (message.id, aid, message.created_at))
+	tracker().add(message.id, aid, message.created_at)
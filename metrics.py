@@ -0,0 +1,316 @@
+import os
+import time
+import bisect
+import asyncio
+import traceback
+
+import discord
+from discord.ext import commands
+
+from sql.sql import sql_cur
+from messages import track
+
+''' -----Metrics defaults----- '''
+# Overridden by the optional "metrics" block in .bot_info.json.
+_defaults = {
+	'enabled' : True,
+	'prometheus_file' : 'data/metrics.prom', # cluster process N > 0 writes data/metrics.N.prom
+	'write_interval_seconds' : 60             # 0 disables the file
+}
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+	'''
+	  ' Fixed-bucket latency histogram (Prometheus semantics). observe()
+		' is a bisect and two additions, so it is cheap enough to call on
+		' every command, statement and request.
+	'''
+	__slots__ = ('counts', 'total', 'count')
+
+	def __init__(self):
+		self.counts = [0] * (len(_buckets) + 1) # the last bucket is +Inf
+		self.total = 0.0
+		self.count = 0
+
+	def observe(self, seconds):
+		self.counts[bisect.bisect_left(_buckets, seconds)] += 1
+		self.total += seconds
+		self.count += 1
+
+	def quantile(self, q):
+		''' Upper bound of the bucket containing the q-quantile (None if empty, inf if past the last bucket). '''
+		if not self.count:
+			return None
+		rank = q * self.count
+		seen = 0
+		for bound, count in zip(_buckets + (float('inf'),), self.counts):
+			seen += count
+			if seen >= rank:
+				return bound
+		return float('inf')
+
+	def mean(self):
+		return self.total / self.count if self.count else None
+
+	def cumulative(self):
+		''' Yields (upper bound label, cumulative count), ending with +Inf. '''
+		seen = 0
+		for bound, count in zip(_buckets, self.counts):
+			seen += count
+			yield ('{0:g}'.format(bound), seen)
+		yield ('+Inf', self.count)
+
+
+def _labels(**labels):
+	pairs = []
+	for key, value in sorted(labels.items()):
+		value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+		pairs.append('{0}="{1}"'.format(key, value))
+	return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Registry:
+	'''
+	  ' Process-wide metric storage.
+		'
+		' SQL timings are recorded on the database thread and everything
+		' else on the event loop thread. Updates are plain integer and
+		' float additions without a lock; a concurrent render may see a
+		' histogram mid-update, which is acceptable for monitoring.
+	'''
+	def __init__(self):
+		self.started = time.time()
+		self.commands = {}       # command name -> Histogram
+		self.command_errors = {} # (command name, error type) -> count
+		self.sql = {'read' : Histogram(), 'write' : Histogram()}
+		self.requests = {}       # (method, route) -> Histogram
+		self.request_errors = {} # (method, route, status) -> count
+		self.gauges = {}         # (metric name, help, label items) -> callable returning a number
+
+	def observe_command(self, name, seconds):
+		histogram = self.commands.get(name)
+		if histogram is None:
+			histogram = self.commands[name] = Histogram()
+		histogram.observe(seconds)
+
+	def count_command_error(self, name, error):
+		key = (name, error)
+		self.command_errors[key] = self.command_errors.get(key, 0) + 1
+
+	def observe_sql(self, seconds, readonly):
+		self.sql['read' if readonly else 'write'].observe(seconds)
+
+	def observe_request(self, method, route, seconds, status=None):
+		key = (method, route)
+		histogram = self.requests.get(key)
+		if histogram is None:
+			histogram = self.requests[key] = Histogram()
+		histogram.observe(seconds)
+		if status is not None:
+			error_key = (method, route, status)
+			self.request_errors[error_key] = self.request_errors.get(error_key, 0) + 1
+
+	def _render_histograms(self, lines, name, help_text, histograms):
+		lines.append('# HELP {0} {1}'.format(name, help_text))
+		lines.append('# TYPE {0} histogram'.format(name))
+		for labels, histogram in histograms:
+			for bound, count in histogram.cumulative():
+				lines.append('{0}_bucket{1} {2}'.format(name, _labels(le=bound, **labels), count))
+			lines.append('{0}_sum{1} {2!r}'.format(name, _labels(**labels), histogram.total))
+			lines.append('{0}_count{1} {2}'.format(name, _labels(**labels), histogram.count))
+
+	def _render_counter(self, lines, name, help_text, samples):
+		lines.append('# HELP {0} {1}'.format(name, help_text))
+		lines.append('# TYPE {0} counter'.format(name))
+		for labels, value in samples:
+			lines.append('{0}{1} {2}'.format(name, _labels(**labels), value))
+
+	def render(self):
+		''' All metrics in the Prometheus text exposition format. '''
+		lines = []
+		self._render_histograms(lines, 'hector_command_duration_seconds', 'Time from command dispatch to completion or error.',
+			[({'command' : name}, h) for name, h in sorted(self.commands.items())])
+		self._render_counter(lines, 'hector_command_errors_total', 'Commands that raised an error, by error type.',
+			[({'command' : name, 'error' : error}, count) for (name, error), count in sorted(self.command_errors.items())])
+		self._render_histograms(lines, 'hector_sql_duration_seconds', 'Time spent in each sql_cur block, including the commit for writes.',
+			[({'mode' : mode}, h) for mode, h in sorted(self.sql.items())])
+		self._render_histograms(lines, 'hector_discord_request_duration_seconds', 'Discord REST requests by route, including rate limit waits.',
+			[({'method' : method, 'route' : route}, h) for (method, route), h in sorted(self.requests.items())])
+		self._render_counter(lines, 'hector_discord_request_errors_total', 'Discord REST requests that failed, by HTTP status.',
+			[({'method' : method, 'route' : route, 'status' : status}, count) for (method, route, status), count in sorted(self.request_errors.items())])
+
+		families = {}
+		for (name, help_text, label_items), read in self.gauges.items():
+			families.setdefault((name, help_text), []).append((dict(label_items), read()))
+		for (name, help_text), samples in sorted(families.items()):
+			lines.append('# HELP {0} {1}'.format(name, help_text))
+			lines.append('# TYPE {0} gauge'.format(name))
+			for labels, value in samples:
+				lines.append('{0}{1} {2}'.format(name, _labels(**labels), value))
+
+		lines.append('# HELP hector_process_start_time_seconds Unix time the metrics registry was created.')
+		lines.append('# TYPE hector_process_start_time_seconds gauge')
+		lines.append('hector_process_start_time_seconds {0!r}'.format(self.started))
+		return '\n'.join(lines) + '\n'
+
+_registry = None
+
+def registry():
+	''' Returns the process-wide metrics registry. '''
+	global _registry
+	if not _registry:
+		_registry = Registry()
+	return _registry
+
+
+def _format_seconds(seconds):
+	if seconds is None:
+		return '-'
+	if seconds == float('inf'):
+		return '>{0:g}s'.format(_buckets[-1])
+	if seconds < 1:
+		return '{0:.0f}ms'.format(seconds * 1000)
+	return '{0:.2f}s'.format(seconds)
+
+class Metrics:
+	'''
+	  ' Instrumentation for commands, database blocks and Discord REST
+		' calls.
+		'
+		' Command latency is measured from on_command to
+		' on_command_completion/on_command_error. Database blocks are timed
+		' through the sql_cur.observer hook, and REST calls by wrapping
+		' bot.http.request, keyed by route template (e.g.
+		' "/channels/{channel_id}") rather than by URL. When metrics are
+		' disabled neither hook is installed.
+	'''
+	def __init__(self, bot, config=None):
+		self.bot = bot
+		self.settings = dict(_defaults)
+		if config:
+			self.settings.update(config)
+		self.registry = registry()
+		self._task = None
+		self._original_request = None
+
+		self.registry.gauges[('hector_guilds', 'Guilds this process is connected to.', ())] = lambda: len(self.bot.guilds)
+		if self.settings['enabled']:
+			self._install()
+
+	def _install(self):
+		sql_cur.observer = self.registry.observe_sql
+
+		original = self.bot.http.request
+		observe = self.registry.observe_request
+		async def request(route, **kwargs):
+			started = time.perf_counter()
+			status = None
+			try:
+				return await original(route, **kwargs)
+			except discord.HTTPException as e:
+				status = str(e.status)
+				raise
+			except Exception as e:
+				status = type(e).__name__
+				raise
+			finally:
+				observe(route.method, route.path, time.perf_counter() - started, status)
+		self._original_request = original
+		self.bot.http.request = request
+
+	def __unload(self):
+		if self._task:
+			self._task.cancel()
+		if sql_cur.observer == self.registry.observe_sql:
+			sql_cur.observer = None
+		if self._original_request:
+			self.bot.http.request = self._original_request
+
+	def _prometheus_path(self):
+		path = self.settings['prometheus_file']
+		cluster_id = getattr(self.bot, 'cluster_id', 0)
+		if cluster_id:
+			root, ext = os.path.splitext(path)
+			path = '{0}.{1}{2}'.format(root, cluster_id, ext)
+		return path
+
+	def write_prometheus(self):
+		''' Write the metrics file atomically, so a scraper never reads half of it. '''
+		path = self._prometheus_path()
+		temporary = path + '.tmp'
+		with open(temporary, 'w') as prom_file:
+			prom_file.write(self.registry.render())
+		os.replace(temporary, path)
+
+	async def on_ready(self):
+		rp = self.bot.get_cog('RPManager')
+		if rp:
+			for key in rp.edit_stats:
+				self.registry.gauges[('hector_region_edits', 'Region channel refreshes by outcome (sent, coalesced, skipped, fields skipped).', (('outcome', key),))] = lambda key=key: rp.edit_stats[key]
+		if self.settings['enabled'] and self.settings['write_interval_seconds'] and not self._task:
+			self._task = self.bot.loop.create_task(self._run())
+
+	async def _run(self):
+		while not self.bot.is_closed():
+			try:
+				self.write_prometheus()
+			except Exception as e:
+				print('Writing metrics failed:\n{0}'.format(''.join(traceback.format_exception(type(e), e, e.__traceback__))))
+			await asyncio.sleep(self.settings['write_interval_seconds'])
+
+	async def on_command(self, ctx):
+		if self.settings['enabled']:
+			ctx.metrics_started = time.perf_counter()
+
+	async def on_command_completion(self, ctx):
+		started = getattr(ctx, 'metrics_started', None)
+		if started is not None:
+			self.registry.observe_command(ctx.command.qualified_name, time.perf_counter() - started)
+
+	async def on_command_error(self, ctx, error):
+		if not self.settings['enabled']:
+			return
+		name = ctx.command.qualified_name if ctx.command else '(unknown)'
+		started = getattr(ctx, 'metrics_started', None)
+		if started is not None:
+			self.registry.observe_command(name, time.perf_counter() - started)
+		self.registry.count_command_error(name, type(getattr(error, 'original', error)).__name__)
+
+	@commands.is_owner()
+	@commands.command()
+	async def stats(self, ctx):
+		''' (Owner-only) Shows command latency, database and Discord API statistics. '''
+		registry = self.registry
+		embed = discord.Embed(title='\U0001f4ca Statistics', colour=discord.Colour(0x419492), description='Up {0:.0f} min. Latencies are bucket upper bounds.'.format((time.time() - registry.started) / 60))
+
+		errors = {}
+		for (name, error), count in registry.command_errors.items():
+			errors[name] = errors.get(name, 0) + count
+		busiest = sorted(registry.commands.items(), key=lambda item: item[1].count, reverse=True)[:10]
+		lines = ['``{0}``: {1} runs, p50 {2}, p95 {3}, {4} errors'.format(name, h.count, _format_seconds(h.quantile(0.5)), _format_seconds(h.quantile(0.95)), errors.get(name, 0)) for name, h in busiest]
+		embed.add_field(name='Commands', value='\n'.join(lines) or 'None run yet.', inline=False)
+
+		lines = ['{0}: {1} blocks, mean {2}, p95 {3}'.format(mode, h.count, _format_seconds(h.mean()), _format_seconds(h.quantile(0.95))) for mode, h in sorted(registry.sql.items())]
+		embed.add_field(name='Database', value='\n'.join(lines), inline=False)
+
+		failures = {}
+		for (method, route, status), count in registry.request_errors.items():
+			failures[(method, route)] = failures.get((method, route), 0) + count
+		busiest = sorted(registry.requests.items(), key=lambda item: item[1].count, reverse=True)[:10]
+		lines = ['``{0} {1}``: {2}, p95 {3}{4}'.format(method, route, h.count, _format_seconds(h.quantile(0.95)), ', {0} failed'.format(failures[(method, route)]) if (method, route) in failures else '') for (method, route), h in busiest]
+		embed.add_field(name='Discord API', value='\n'.join(lines) or 'No requests yet.', inline=False)
+
+		rp = self.bot.get_cog('RPManager')
+		if rp:
+			embed.add_field(name='Region edits', value=', '.join('{0} {1}'.format(value, key.replace('_', ' ')) for key, value in rp.edit_stats.items()), inline=False)
+
+		if not self.settings['enabled']:
+			embed.set_footer(text='Metrics collection is disabled in .bot_info.json.')
+
+		msg = await ctx.send(content='', embed=embed)
+		await track(msg, ctx.author)
+
+
+def setup(bot):
+	bot.add_cog(Metrics(bot, bot.settings.get('metrics')))
@@ -0,0 +1,118 @@
+class Region:
+	'''
+	  ' One row of the regions table.
+		' 
+		' Records are kept by RPManager's in-memory region index, so they
+		' use __slots__ to stay small on guilds with thousands of regions.
+		' Commands receive copies (see RPManager._get_region) and only
+		' publish changes through RPManager._edit_region.
+	'''
+	__slots__ = ('channel_id', 'guild_id', 'name', 'description', 'status', 'active_category')
+
+	def __init__(self, channel_id, guild_id, name, description, status, active_category):
+		self.channel_id = channel_id
+		self.guild_id = guild_id
+		self.name = name
+		self.description = description
+		self.status = status
+		self.active_category = active_category
+
+	def copy(self):
+		return Region(self.channel_id, self.guild_id, self.name, self.description, self.status, self.active_category)
+
+	def merge(self, base, changed):
+		'''
+		  ' Copy onto this record every field in which changed differs from
+			' base (the record changed was edited from). With no base, all of
+			' changed is taken.
+		'''
+		for field in self.__slots__:
+			value = getattr(changed, field)
+			if base is None or getattr(base, field) != value:
+				setattr(self, field, value)
+
+	def __repr__(self):
+		return '<Region {0} channel_id={1} guild_id={2} status={3}>'.format(repr(self.name), self.channel_id, self.guild_id, self.status)
+
+
+class RegionNameIndex:
+	'''
+	  ' Ranked lookup of a guild's regions by sanitized name.
+		' 
+		' Every name is indexed under each of its substrings of up to
+		' gram_size characters. A query no longer than that is answered
+		' with one dict lookup; longer queries intersect the postings of
+		' their grams (smallest first) and verify the few survivors, so
+		' lookups do not scan every region in the guild.
+		' 
+		' search() ranks matches into tiers: exact names, then names that
+		' start with the query, then names that merely contain it.
+	'''
+	def __init__(self, gram_size=3):
+		self.gram_size = gram_size
+		self._names = {} # channel id -> sanitized name
+		self._grams = {} # gram -> set of channel ids
+
+	def _grams_of(self, name):
+		grams = set()
+		for size in range(1, self.gram_size + 1):
+			for start in range(len(name) - size + 1):
+				grams.add(name[start:start+size])
+		return grams
+
+	def add(self, channel_id, name):
+		if self._names.get(channel_id) == name:
+			return
+		self.remove(channel_id)
+		self._names[channel_id] = name
+		for gram in self._grams_of(name):
+			self._grams.setdefault(gram, set()).add(channel_id)
+
+	def remove(self, channel_id):
+		name = self._names.pop(channel_id, None)
+		if name is None:
+			return
+		for gram in self._grams_of(name):
+			posting = self._grams[gram]
+			posting.discard(channel_id)
+			if not posting:
+				del self._grams[gram]
+
+	def _candidates(self, query):
+		if len(query) <= self.gram_size:
+			return self._grams.get(query, set())
+
+		postings = []
+		for start in range(len(query) - self.gram_size + 1):
+			posting = self._grams.get(query[start:start+self.gram_size])
+			if not posting:
+				return set()
+			postings.append(posting)
+		postings.sort(key=len)
+		candidates = set(postings[0])
+		for posting in postings[1:]:
+			candidates &= posting
+			if not candidates:
+				break
+		return {channel_id for channel_id in candidates if query in self._names[channel_id]}
+
+	def search(self, query):
+		'''
+		  ' Returns [exact, prefix, substring] lists of channel ids matching
+			' the (already sanitized) query. Each tier is sorted by name
+			' length, then name, so the closest matches come first.
+		'''
+		tiers = ([], [], [])
+		if not query:
+			return tiers
+		for channel_id in self._candidates(query):
+			name = self._names[channel_id]
+			if name == query:
+				tiers[0].append(channel_id)
+			elif name.startswith(query):
+				tiers[1].append(channel_id)
+			else:
+				tiers[2].append(channel_id)
+		for tier in tiers:
+			tier.sort(key=lambda channel_id: (len(self._names[channel_id]), self._names[channel_id], channel_id))
+		return tiers
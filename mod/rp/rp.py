@@ -1,4 +1,7 @@
 import random
+import time
+import datetime
+import asyncio
 from asyncio import TimeoutError
 
 import discord
@@ -6,7 +9,8 @@ from discord.ext import commands
 
 import permissions
 from messages import track
-from sql.sql import sql_cur, sql_con
+from mod.rp.regions import Region, RegionNameIndex
+from mod.rp.scheduler import DeadlineScheduler
 
 class RPError(discord.ext.commands.CommandError):
 	pass
@@ -14,39 +18,136 @@ class RPError(discord.ext.commands.CommandError):
 class InvalidRegionError(RPError):
 	pass
 
+# Discord does not document a cap for bulk channel-position updates; keep
+# each request to a modest size.
+_BULK_POSITION_CHUNK = 50
+# Concurrent name/topic edits during bulk operations.
+_BULK_EDIT_CONCURRENCY = 4
+# Minimum seconds between edits of a bulk operation's progress message.
+_BULK_PROGRESS_INTERVAL = 2
+# Region names listed per kind of failure in a bulk operation's final report.
+_BULK_FAILURES_SHOWN = 10
+# Refreshes of the same channel requested within this many seconds are
+# merged into a single channel edit.
+_REFRESH_WINDOW = 0.25
+# Seconds between repairs of drifted channels found by reconciliation.
+_REPAIR_INTERVAL = 1
+# Regions per page of |list, and how long (seconds) its ◀ ▶ reactions
+# keep working.
+_LIST_PAGE_SIZE = 25
+_LIST_TIMEOUT = 120
+# Cached |list pages per guild; the cache is emptied if it grows past this.
+_LIST_CACHE_PAGES = 100
+
 class RPManager:
 	''' RP channel management '''
 	def __init__(self, bot, db_handle):
 		self.bot = bot
 		self.db = db_handle
+		# guild id -> {channel id: Region}. Write-through cache of the
+		# regions table, loaded per guild on first use and kept in sync by
+		# _edit_region and _delete_region.
+		self._regions = {}
+		# guild id -> RegionNameIndex over the same regions, used by |open
+		# and |close to resolve names.
+		self._name_index = {}
+		# guild id -> idle timeout in seconds, for guilds that set one. Open
+		# regions in those guilds are keyed (guild id, channel id) in
+		# self._idle, which closes them once their deadline passes.
+		self._idle_timeouts = {}
+		self._idle = DeadlineScheduler(self._idle_close)
+		# channel id -> (merged Region, future) for refreshes waiting out
+		# _REFRESH_WINDOW.
+		self._pending_refresh = {}
+		# How many refreshes were sent to Discord, merged into another
+		# pending refresh, or skipped because the channel was already up to
+		# date; plus how many of the four managed fields (name, topic,
+		# category, permission sync) were left out of the edits that were sent.
+		self.edit_stats = {'sent':0, 'coalesced':0, 'skipped':0, 'fields_skipped':0}
+		# (guild id, channel id) of regions whose channels drifted from
+		# their stored state, repaired one at a time by _repair_worker.
+		self._repair_queue = asyncio.Queue()
+		self._repair_pending = set()
+		self._repair_task = None
+		# Guilds that were unavailable when they would have been
+		# reconciled; on_guild_available reconciles them.
+		self._unreconciled = set()
+		# guild id -> {page key: (page text, next page key)} and guild id ->
+		# region count, for |list. Dropped whenever a region of the guild
+		# is added, renamed or deleted.
+		self._list_pages = {}
+		self._list_counts = {}
+
+	def __unload(self):
+		self._idle.stop()
+		if self._repair_task:
+			self._repair_task.cancel()
 	
 
+	async def _guild_regions(self, guild_id):
+		regions = self._regions.get(guild_id)
+		if regions is None:
+			rows = await self.db.fetchall('SELECT channel_id, guild_id, name, description, status, active_category FROM regions WHERE guild_id=?;',(guild_id,))
+			regions = {}
+			name_index = RegionNameIndex()
+			for row in rows:
+				regions[row[0]] = Region(*row)
+				name_index.add(row[0], self._sanitize_channel_name(row[2]))
+			# Another command may have loaded the guild while we waited.
+			if guild_id not in self._regions:
+				self._regions[guild_id] = regions
+				self._name_index[guild_id] = name_index
+			regions = self._regions[guild_id]
+
+		return regions
+
+
 	async def _list_regions(self, guild_id=None):
-		regions = []
-		query = 'SELECT channel_id, guild_id, name, description, status, active_category FROM regions'
 		if guild_id:
-			query = query + ' WHERE guild_id=?;'
-		else:
-			query = query + ';'
-
-		with sql_cur(self.db) as cur:
-			if guild_id:
-				cur.execute(query,(guild_id,))
-			else:
-				cur.execute(query)
-			for region in cur.fetchall():
-				regions.append({'channel_id':region[0],'guild_id':region[1],'name':region[2],'description':region[3],'status':region[4], 'active_category':region[5]})
+			return [region.copy() for region in (await self._guild_regions(guild_id)).values()]
 
-		return regions
+		rows = await self.db.fetchall('SELECT channel_id, guild_id, name, description, status, active_category FROM regions;')
+		return [Region(*row) for row in rows]
 	
 
 	async def _get_region(self, guild_id, channel_id):
-		regions = await self._list_regions(guild_id)
-		for region in regions:
-			if region['channel_id'] == channel_id:
-				return region
+		region = (await self._guild_regions(guild_id)).get(channel_id)
+		if region:
+			return region.copy()
 
 		return None
+
+
+	async def _find_regions(self, guild_id, location):
+		'''
+		  ' Resolve a user-supplied region name. Returns the best-ranked
+			' non-empty tier of matches (exact, then prefix, then substring
+			' of the sanitized name), so a unique exact or prefix hit wins
+			' even when the query also appears inside other names.
+		'''
+		regions = await self._guild_regions(guild_id)
+		for tier in self._name_index[guild_id].search(self._sanitize_channel_name(location)):
+			if tier:
+				return [regions[channel_id].copy() for channel_id in tier]
+
+		return []
+
+
+	async def _send_ambiguous(self, ctx, regions_filtered):
+		tex = 'Ambiguous input. Matching channels:\n```\n'
+		num_processed = 0
+		for region in regions_filtered:
+			to_check = tex + '"{0}" id {1}\n'.format(region.name,region.channel_id)
+			if len(to_check) > 1800:
+				tex = tex + '...[{0} more]'.format(len(regions_filtered) - num_processed)
+				break
+			else:
+				num_processed = num_processed + 1
+				tex = to_check
+
+		msg = await ctx.send(tex+'```')
+		await track(msg, ctx.author)
+		await ctx.message.add_reaction('❓')
 	
 
 	async def _decode_status(self, status_id):
@@ -105,34 +206,108 @@ class RPManager:
 
 
 	async def _generate_topic(self, region_meta):
-		return '{0} | {1} | STATUS: {2} | Managed by Hector'.format(region_meta['name'], region_meta['description'], await self._decode_status(region_meta['status']))
+		return '{0} | {1} | STATUS: {2} | Managed by Hector'.format(region_meta.name, region_meta.description, await self._decode_status(region_meta.status))
+
+
+	async def _inactive_category(self, guild_id):
+		row = await self.db.fetchone('SELECT inactive_category FROM guild_settings WHERE guild_id=?',(guild_id,))
+		if not row or row[0] is None:
+			raise commands.BadArgument('Please use the {0}rpset inactive command to set up a channel category for inactive channels. {0}help rpset inactive for more information.'.format(self.bot.command_prefix))
+		return row[0]
+
+
+	async def _target_category_id(self, region_meta):
+		''' The category a region's channel belongs in, given its status. '''
+		if region_meta.status != 1:
+			return region_meta.active_category
+		return await self._inactive_category(region_meta.guild_id)
 
 
 	async def _refresh_region_meta(self, region_meta):
-		region = self.bot.get_channel(region_meta['channel_id'])
-		if not region:
-			with sql_cur(self.db) as cur:
-				cur.execute('DELETE FROM regions WHERE channel_id=?',(region_meta['channel_id'],))
-				raise commands.CheckFailure('Channel for region {0} is missing! Removed associated region data.')
-		channel_category_id = None
-		if region_meta['status'] != 1:
-			channel_category_id = region_meta['active_category']
+		'''
+		  ' Apply region_meta to its channel and the database.
+			' 
+			' Calls for the same channel within _REFRESH_WINDOW seconds are
+			' coalesced: each later caller's changes (the fields it changed
+			' relative to the stored region) are merged into the pending
+			' record, one edit is sent, and every caller awaits its result.
+		'''
+		key = region_meta.channel_id
+		pending = self._pending_refresh.get(key)
+		if pending is None:
+			future = asyncio.get_event_loop().create_future()
+			pending = (region_meta.copy(), future)
+			self._pending_refresh[key] = pending
+			asyncio.ensure_future(self._flush_refresh(key))
 		else:
-			with sql_cur(self.db) as cur:
-				cur.execute('SELECT inactive_category FROM guild_settings WHERE guild_id=?',(region.guild.id,))
-				row = cur.fetchone()
-				if not row:
-					raise commands.BadArgument('Please use the {0}rpset inactive command to set up a channel category for inactive channels. {0}help rpset inactive for more information.'.format(self.bot.command_prefix))
-				channel_category_id = row[0]
+			base = self._regions.get(region_meta.guild_id, {}).get(key)
+			pending[0].merge(base, region_meta)
+			self.edit_stats['coalesced'] = self.edit_stats['coalesced'] + 1
+
+		# Shielded so that one caller being cancelled does not cancel the
+		# edit for everyone else.
+		await asyncio.shield(pending[1])
+
+
+	async def _flush_refresh(self, key):
+		await asyncio.sleep(_REFRESH_WINDOW)
+		merged, future = self._pending_refresh.pop(key)
+		try:
+			await self._apply_region_meta(merged)
+		except Exception as e:
+			future.set_exception(e)
+		else:
+			future.set_result(None)
+
+
+	async def _apply_region_meta(self, region_meta):
+		region = self.bot.get_channel(region_meta.channel_id)
+		if not region:
+			await self._delete_region(region_meta.guild_id, region_meta.channel_id)
+			raise commands.CheckFailure('Channel for region {0} is missing! Removed associated region data.')
+		channel_category_id = await self._target_category_id(region_meta)
 		channel_category = None
 		for category in region.guild.categories:
 			if category.id == channel_category_id:
 				channel_category = category
 
-		await region.edit(name=self._sanitize_channel_name(region_meta['name']), position=0, nsfw=region.is_nsfw(), topic=await self._generate_topic(region_meta), sync_permissions=True, category=channel_category, reason='Updating RP region metadata.')
+		patch = await self._region_patch(region, region_meta, channel_category)
+		if patch:
+			self.edit_stats['sent'] = self.edit_stats['sent'] + 1
+			self.edit_stats['fields_skipped'] = self.edit_stats['fields_skipped'] + 4 - len(patch)
+			await region.edit(reason='Updating RP region metadata.', **patch)
+		else:
+			self.edit_stats['skipped'] = self.edit_stats['skipped'] + 1
 		await self._edit_region(region_meta)
 
 
+	async def _region_patch(self, channel, region_meta, channel_category):
+		'''
+		  ' Compare a region's desired state with its cached channel and
+			' return only the channel.edit() arguments that would change
+			' something (empty if the channel is already correct). Moving to a
+			' different category always re-syncs permissions; otherwise they
+			' are only re-synced if the channel has drifted from its category.
+		'''
+		patch = {}
+		name = self._sanitize_channel_name(region_meta.name)
+		if channel.name != name:
+			patch['name'] = name
+
+		topic = await self._generate_topic(region_meta)
+		if channel.topic != topic:
+			patch['topic'] = topic
+
+		category_id = channel_category.id if channel_category else None
+		if channel.category_id != category_id:
+			patch['category'] = channel_category
+			patch['sync_permissions'] = True
+		elif channel_category and channel.overwrites != channel_category.overwrites:
+			patch['sync_permissions'] = True
+
+		return patch
+
+
 	async def _generate_region(self, guild, name="Unnamed Region", description="Use the ``describe`` command in this channel to edit the region description.", active_category=None, existing_channel=None, status_override=1):
 		new_region = None
 		if not existing_channel:
@@ -141,18 +316,225 @@ class RPManager:
 			new_region = await guild.create_text_channel(name=self._sanitize_channel_name(name))
 		else:
 			new_region = existing_channel
-		region_meta = {'channel_id':new_region.id,'guild_id':guild.id,'name':name,'description':description,'status':status_override,'active_category':active_category}
+		region_meta = Region(new_region.id, guild.id, name, description, status_override, active_category)
 		await self._refresh_region_meta(region_meta)
 		return region_meta
 
 
 	async def _edit_region(self, region):
-		with sql_cur(self.db) as cur:
-			cur.execute('SELECT name FROM regions WHERE channel_id=? AND guild_id=?;',(region['channel_id'],region['guild_id']))
-			if len(cur.fetchall()) == 0:
-				cur.execute('INSERT INTO regions (channel_id, guild_id, name, description, status, active_category) VALUES (?,?,?,?,?,?);',(region['channel_id'],region['guild_id'],region['name'],region['description'],region['status'],region['active_category']))
+		await self._edit_regions([region])
+
+
+	async def _edit_regions(self, to_write):
+		''' Write-through update of several regions in one transaction. '''
+		to_write = [region.copy() for region in to_write] # callers may keep editing their own copies
+		for region in to_write:
+			await self._guild_regions(region.guild_id)
+		def write(cur):
+			for region in to_write:
+				cur.execute('SELECT name FROM regions WHERE channel_id=? AND guild_id=?;',(region.channel_id,region.guild_id))
+				if len(cur.fetchall()) == 0:
+					cur.execute('INSERT INTO regions (channel_id, guild_id, name, description, status, active_category) VALUES (?,?,?,?,?,?);',(region.channel_id,region.guild_id,region.name,region.description,region.status,region.active_category))
+				else:
+					cur.execute('UPDATE regions SET name=?,description=?,status=?,active_category=? WHERE channel_id=? AND guild_id=?;',(region.name,region.description,region.status,region.active_category,region.channel_id,region.guild_id))
+
+		await self.db.transaction(write)
+		for region in to_write:
+			previous = self._regions[region.guild_id].get(region.channel_id)
+			if not previous or previous.name != region.name:
+				self._invalidate_list(region.guild_id)
+			self._regions[region.guild_id][region.channel_id] = region
+			self._name_index[region.guild_id].add(region.channel_id, self._sanitize_channel_name(region.name))
+			self._touch_idle(region)
+
+
+	async def _delete_region(self, guild_id, channel_id):
+		await self._delete_regions(guild_id, [channel_id])
+
+
+	async def _delete_regions(self, guild_id, channel_ids):
+		''' Write-through removal of several regions in one transaction. '''
+		regions = await self._guild_regions(guild_id)
+		await self.db.executemany('DELETE FROM regions WHERE channel_id=?;', [(channel_id,) for channel_id in channel_ids])
+		for channel_id in channel_ids:
+			regions.pop(channel_id, None)
+			self._name_index[guild_id].remove(channel_id)
+			self._idle.cancel((guild_id, channel_id))
+		self._invalidate_list(guild_id)
+
+
+	async def _load_guilds(self, guild_ids):
+		''' Load the regions of every listed guild not cached yet, in one query. '''
+		missing = set(guild_id for guild_id in guild_ids if guild_id not in self._regions)
+		if not missing:
+			return
+		loaded = {guild_id : ({}, RegionNameIndex()) for guild_id in missing}
+		for row in await self.db.fetchall('SELECT channel_id, guild_id, name, description, status, active_category FROM regions;'):
+			if row[1] in loaded:
+				regions, name_index = loaded[row[1]]
+				regions[row[0]] = Region(*row)
+				name_index.add(row[0], self._sanitize_channel_name(row[2]))
+		for guild_id, (regions, name_index) in loaded.items():
+			# A command may have loaded the guild while we waited.
+			if guild_id not in self._regions:
+				self._regions[guild_id] = regions
+				self._name_index[guild_id] = name_index
+
+
+	async def _reconcile(self, guild, inactive_ids=None):
+		'''
+		  ' Check every stored region of a guild against the cached channels
+			' in one pass. Rows whose channel no longer exists are removed in a
+			' single transaction; channels whose name, topic or category
+			' drifted from the stored region are queued for _repair_worker.
+			' Returns (regions checked, regions removed, regions queued).
+			'
+			' inactive_ids maps guild id -> inactive category for callers that
+			' read guild_settings for many guilds at once.
+			'
+			' An unavailable guild (e.g. during a Discord outage) has no
+			' cached channels, so every region would look dead. Such guilds
+			' are skipped and reconciled by on_guild_available, and rows are
+			' never removed while the guild has no cached channels at all.
+		'''
+		if guild.unavailable:
+			self._unreconciled.add(guild.id)
+			return (0, 0, 0)
+		regions = await self._guild_regions(guild.id)
+		if inactive_ids is None:
+			row = await self.db.fetchone('SELECT inactive_category FROM guild_settings WHERE guild_id=?',(guild.id,))
+			inactive_id = row[0] if row else None
+		else:
+			inactive_id = inactive_ids.get(guild.id)
+
+		dead = []
+		drifted = 0
+		for region in regions.values():
+			channel = guild.get_channel(region.channel_id)
+			if not channel:
+				dead.append(region.channel_id)
+				continue
+
+			if region.status != 1:
+				category_id = region.active_category
 			else:
-				cur.execute('UPDATE regions SET name=?,description=?,status=?,active_category=? WHERE channel_id=? AND guild_id=?;',(region['name'],region['description'],region['status'],region['active_category'],region['channel_id'],region['guild_id']))
+				category_id = inactive_id if inactive_id is not None else channel.category_id
+			if channel.category_id != category_id or channel.name != self._sanitize_channel_name(region.name) or channel.topic != await self._generate_topic(region):
+				key = (guild.id, region.channel_id)
+				if key not in self._repair_pending:
+					self._repair_pending.add(key)
+					self._repair_queue.put_nowait(key)
+				drifted = drifted + 1
+
+		checked = len(regions)
+		if dead and (guild.unavailable or len(guild.channels) == 0):
+			print('Not removing {0} regions of {1}: the guild has no cached channels.'.format(len(dead), guild))
+			self._unreconciled.add(guild.id)
+			dead = []
+		if dead:
+			await self._delete_regions(guild.id, dead)
+		if dead or drifted:
+			print('Reconciled {0}: {1} regions, {2} with missing channels removed, {3} queued for repair.'.format(guild, checked, len(dead), drifted))
+		return (checked, len(dead), drifted)
+
+
+	async def _repair_worker(self):
+		while True:
+			key = await self._repair_queue.get()
+			self._repair_pending.discard(key)
+			region = await self._get_region(*key)
+			if region:
+				try:
+					await self._refresh_region_meta(region)
+				except Exception as e:
+					print('Could not repair region {0}: {1}'.format(region.name, e))
+			await asyncio.sleep(_REPAIR_INTERVAL)
+
+
+	def _touch_idle(self, region, idle_for=0):
+		''' (Re)start a region's idle countdown, or stop it if the region is not open. '''
+		key = (region.guild_id, region.channel_id)
+		timeout = self._idle_timeouts.get(region.guild_id)
+		if timeout and region.status == 0:
+			self._idle.touch(key, time.monotonic() + timeout - idle_for)
+		else:
+			self._idle.cancel(key)
+
+
+	async def _schedule_idle_guild(self, guild_id):
+		''' Start countdowns for every open region, counting from each channel's last message. '''
+		guild = self.bot.get_guild(guild_id)
+		if not guild:
+			return
+
+		now = datetime.datetime.utcnow()
+		for region in (await self._guild_regions(guild_id)).values():
+			channel = guild.get_channel(region.channel_id)
+			idle_for = 0
+			if channel and channel.last_message_id:
+				idle_for = max(0, (now - discord.utils.snowflake_time(channel.last_message_id)).total_seconds())
+			self._touch_idle(region, idle_for)
+
+
+	async def _idle_close(self, key):
+		guild_id, channel_id = key
+		region = await self._get_region(guild_id, channel_id)
+		if not region or region.status != 0:
+			return
+
+		region.status = 1
+		await self._refresh_region_meta(region)
+		channel = self.bot.get_channel(channel_id)
+		if channel:
+			await channel.send('Region {0} was closed after {1} minutes without activity.'.format(region.name, self._idle_timeouts.get(guild_id, 0) // 60))
+
+
+	async def on_ready(self):
+		if not self._repair_task:
+			self._repair_task = asyncio.ensure_future(self._repair_worker())
+		self._idle.start()
+		for row in await self.db.fetchall('SELECT guild_id, idle_timeout FROM guild_settings WHERE idle_timeout > 0;'):
+			self._idle_timeouts[row[0]] = row[1]
+			await self._schedule_idle_guild(row[0])
+
+		# on_ready also fires after reconnects; the regions stay cached, so
+		# later passes only compare them with the guild cache.
+		await self._load_guilds([guild.id for guild in self.bot.guilds])
+		inactive_ids = {row[0] : row[1] for row in await self.db.fetchall('SELECT guild_id, inactive_category FROM guild_settings;')}
+		totals = [0, 0, 0]
+		for guild in self.bot.guilds:
+			for index, count in enumerate(await self._reconcile(guild, inactive_ids)):
+				totals[index] = totals[index] + count
+			await asyncio.sleep(0) # let events through between guilds
+		unavailable = sum(1 for guild in self.bot.guilds if guild.unavailable)
+		print('Reconciled {0} guilds: {1} regions, {2} with missing channels removed, {3} queued for repair.{4}'.format(len(self.bot.guilds) - unavailable, *totals, ' {0} unavailable guilds will be reconciled when they return.'.format(unavailable) if unavailable else ''))
+
+
+	async def on_guild_join(self, guild):
+		await self._reconcile(guild)
+
+
+	async def on_guild_unavailable(self, guild):
+		self._unreconciled.add(guild.id)
+
+
+	async def on_guild_available(self, guild):
+		# Also fires for every guild while connecting, before on_ready;
+		# only guilds that _reconcile skipped or that went away since need
+		# a pass here.
+		if guild.id in self._unreconciled:
+			self._unreconciled.discard(guild.id)
+			await self._reconcile(guild)
+
+
+	async def on_message(self, message):
+		# Only open regions in guilds with an idle timeout are scheduled, so
+		# this is a dict lookup for every other message.
+		if not message.guild:
+			return
+		key = (message.guild.id, message.channel.id)
+		if key in self._idle:
+			self._idle.touch(key, time.monotonic() + self._idle_timeouts[message.guild.id])
 
 	
 	@commands.group()
@@ -164,22 +546,46 @@ class RPManager:
 	@rpset.command(name="inactive")
 	async def set_inactive(self, ctx):
 		''' Set the category where inactive region channels are stored '''
-		with sql_cur(self.db) as cur:
+		def write(cur):
 			cur.execute('SELECT inactive_category FROM guild_settings WHERE guild_id=?;',(ctx.guild.id,))
 			if cur.fetchone():
 				cur.execute('UPDATE guild_settings SET inactive_category=? WHERE guild_id=?;',(ctx.channel.category_id, ctx.guild.id))
 			else:
 				cur.execute('INSERT INTO guild_settings (guild_id, inactive_category) VALUES (?,?);',(ctx.guild.id, ctx.channel.category_id))
 
+		await self.db.transaction(write)
+
+		await ctx.message.add_reaction('✅')
+
+	@rpset.command(name="idle")
+	async def set_idle(self, ctx, minutes: int):
+		''' Close open regions after <minutes> without messages (0 disables) '''
+		if minutes < 0:
+			raise commands.BadArgument('Please provide a number of minutes, or 0 to disable.')
+		timeout = minutes * 60
+
+		def write(cur):
+			cur.execute('SELECT idle_timeout FROM guild_settings WHERE guild_id=?;',(ctx.guild.id,))
+			if cur.fetchone():
+				cur.execute('UPDATE guild_settings SET idle_timeout=? WHERE guild_id=?;',(timeout, ctx.guild.id))
+			else:
+				cur.execute('INSERT INTO guild_settings (guild_id, idle_timeout) VALUES (?,?);',(ctx.guild.id, timeout))
+
+		await self.db.transaction(write)
+		if timeout:
+			self._idle_timeouts[ctx.guild.id] = timeout
+		else:
+			self._idle_timeouts.pop(ctx.guild.id, None)
+		await self._schedule_idle_guild(ctx.guild.id)
+
 		await ctx.message.add_reaction('✅')
 
 	@commands.command()
 	@permissions.require(permissions.p_open)
 	async def open(self, ctx, *location_raw):
 		''' Opens a region (chanops can use this to make new regions) '''
-		regions = await self._list_regions(ctx.guild.id)
-		regions_filtered = []
 		final_region = None
+		refreshed = False
 		location = ''
 		for piece in location_raw:
 			# Put checks for switches, etc. here
@@ -187,9 +593,7 @@ class RPManager:
 
 		location = location.strip()
 
-		for region in regions:
-			if self._sanitize_channel_name(location) in self._sanitize_channel_name(region['name'].strip()):
-				regions_filtered.append(region)
+		regions_filtered = await self._find_regions(ctx.guild.id, location)
 
 		if len(location) == 0:
 			region = await self._get_region(ctx.guild.id, ctx.channel.id)
@@ -218,7 +622,7 @@ class RPManager:
 					await msg.clear_reactions()
 					await msg.edit(content='Confirmed. Generating new region ``{0}`` (sanitized name ``#{1}``)...'.format(location, self._sanitize_channel_name(location)))
 					final_region = await self._generate_region(ctx.guild, location, active_category=ctx.message.channel.category_id, status_override=0)
-					final_region_chan = ctx.guild.get_channel(final_region['channel_id'])
+					final_region_chan = ctx.guild.get_channel(final_region.channel_id)
 
 
 					await msg.edit(content='Successfully generated new region ``{0}``. Please drag the channel to the desired start category, then press ✳️. (5-minute timeout)'.format(location))
@@ -230,14 +634,15 @@ class RPManager:
 						pass
 
 					finally:
-						final_region['active_category'] = final_region_chan.category_id
+						final_region.active_category = final_region_chan.category_id
 						response = ''
 						if final_region_chan.category:
-							response = 'Set category for {0} to {1}.'.format(final_region['name'],final_region['active_category'])
+							response = 'Set category for {0} to {1}.'.format(final_region.name,final_region.active_category)
 						else:
-							response = '{0} will have no category.'.format(final_region['name'])
+							response = '{0} will have no category.'.format(final_region.name)
 
 						await self._refresh_region_meta(final_region)
+						refreshed = True
 						await msg.clear_reactions()
 						await msg.edit(content=response)
 
@@ -252,30 +657,19 @@ class RPManager:
 				return
 
 		elif len(regions_filtered) > 1:
-			tex = 'Ambiguous input. Matching channels:\n```\n'
-			num_processed = 0
-			for region in regions_filtered:
-				to_check = tex + '"{0}" id {1}\n'.format(region['name'],region['channel_id'])
-				if len(to_check) > 1800:
-					tex = tex + '...[{0} more]'.format(len(regions_filtered) - num_processed)
-				else:
-					num_processed = num_processed + 1
-					tex = to_check
-
-			msg = await ctx.send(tex+'```')
-			await track(msg, ctx.author)
-			await ctx.message.add_reaction('❓')
+			await self._send_ambiguous(ctx, regions_filtered)
 			return
 
 		else:
 			final_region = regions_filtered[0]
 			await ctx.message.add_reaction('✅')
 		
-		final_region['status'] = 0
-		await self._refresh_region_meta(final_region)
-		final_msg = await ctx.send('Region {0} opened in channel {1}.'.format(final_region['name'],self._sanitize_channel_name(final_region['name'])))
-		regional_channel = ctx.guild.get_channel(final_region['channel_id'])
-		final_msg_2 = await regional_channel.send('Region {0} is now open, {1}.'.format(final_region['name'],ctx.author.mention))
+		final_region.status = 0
+		if not refreshed: # a newly created region was already refreshed as open
+			await self._refresh_region_meta(final_region)
+		final_msg = await ctx.send('Region {0} opened in channel {1}.'.format(final_region.name,self._sanitize_channel_name(final_region.name)))
+		regional_channel = ctx.guild.get_channel(final_region.channel_id)
+		final_msg_2 = await regional_channel.send('Region {0} is now open, {1}.'.format(final_region.name,ctx.author.mention))
 		await track(final_msg, ctx.author)
 		await track(final_msg_2, ctx.author)
 	
@@ -306,8 +700,7 @@ class RPManager:
 		if not region:
 			raise commands.CheckFailure('Channel #{0} is not a region!'.format(ctx.channel.name))
 
-		with sql_cur(self.db) as cur:
-			cur.execute('DELETE FROM regions WHERE channel_id=?;', (ctx.channel.id,))
+		await self._delete_region(ctx.guild.id, ctx.channel.id)
 
 		await ctx.message.add_reaction('✅')
 	
@@ -335,12 +728,12 @@ class RPManager:
 			pass
 
 		finally:
-			target_region['active_category'] = channel.category_id
+			target_region.active_category = channel.category_id
 			response = ''
 			if ctx.channel.category_id:
-				response = 'Set category for {0} to {1}.'.format(target_region['name'],target_region['active_category'])
+				response = 'Set category for {0} to {1}.'.format(target_region.name,target_region.active_category)
 			else:
-				response = '{0} will have no category.'.format(target_region['name'])
+				response = '{0} will have no category.'.format(target_region.name)
 
 			await self._refresh_region_meta(target_region)
 			await msg.clear_reactions()
@@ -355,7 +748,7 @@ class RPManager:
 		if not target_region:
 			raise commands.CheckFailure('Channel #{0} has no associate Region!'.format(ctx.channel.name))
 
-		target_region['description'] = str(description)
+		target_region.description = str(description)
 
 		await self._refresh_region_meta(target_region)
 		await ctx.message.add_reaction('✅')
@@ -379,8 +772,6 @@ class RPManager:
 	@permissions.require(permissions.close)
 	async def close(self, ctx, *location_raw):
 		''' Closes a region and moves it to the inactive category. '''
-		regions = await self._list_regions(ctx.guild.id)
-		regions_filtered = []
 		final_region = None
 		location = ''
 		for piece in location_raw:
@@ -389,9 +780,7 @@ class RPManager:
 
 		location = location.strip()
 
-		for region in regions:
-			if location in region['name'].strip().lower():
-				regions_filtered.append(region)
+		regions_filtered = await self._find_regions(ctx.guild.id, location)
 		
 		if len(location) == 0:
 			region = await self._get_region(ctx.guild.id, ctx.channel.id)
@@ -402,61 +791,299 @@ class RPManager:
 		elif len(regions_filtered) == 0:
 			raise commands.BadArgument('No regions matching query "{0}"'.format(location))
 		elif len(regions_filtered) > 1:
-			tex = 'Ambiguous input. Matching channels:\n```\n'
-			num_processed = 0
-			for region in regions_filtered:
-				to_check = tex + '"{0}" id {1}\n'.format(region['name'],region['channel_id'])
-				if len(to_check) > 1800:
-					tex = tex + '...[{0} more]'.format(len(regions_filtered) - num_processed)
-				else:
-					num_processed = num_processed + 1
-					tex = to_check
-
-			msg = await ctx.send(tex+'```')
-			await track(msg, ctx.author)
-			await ctx.message.add_reaction('❓')
+			await self._send_ambiguous(ctx, regions_filtered)
 			return
 		else:
 			final_region = regions_filtered[0]
 
-		if final_region['status'] == 1:
-			raise commands.BadArgument('Region {0} is already closed.'.format(region['name']))
+		if final_region.status == 1:
+			raise commands.BadArgument('Region {0} is already closed.'.format(final_region.name))
 		else:
-			final_region['status'] = 1
+			final_region.status = 1
 			await self._refresh_region_meta(final_region)
 			await ctx.message.add_reaction('✅')
 
 
+	async def _resolve_names(self, guild_id, names):
+		''' Resolve comma-separated region names; each must match exactly one region. '''
+		resolved = {}
+		problems = []
+		for name in names.split(','):
+			name = name.strip()
+			if not name:
+				continue
+			matches = await self._find_regions(guild_id, name)
+			if len(matches) == 1:
+				resolved[matches[0].channel_id] = matches[0]
+			elif len(matches) == 0:
+				problems.append('"{0}" matches no region'.format(name))
+			else:
+				problems.append('"{0}" is ambiguous ({1} matches)'.format(name, len(matches)))
+
+		if len(problems) > 0:
+			raise commands.BadArgument('; '.join(problems))
+		return [region for region in resolved.values()]
+
+
+	async def _bulk_set_status(self, ctx, targets, status, action):
+		'''
+		  ' Open (status 0) or close (status 1) many regions at once.
+			' 
+			' Category changes and permission syncs are batched into as few
+			' bulk channel-position requests as possible. Name and topic edits
+			' then run concurrently under a semaphore, and only for channels
+			' whose name or topic actually changes. Progress is reported by
+			' editing a single message.
+			'
+			' A failed request only fails the regions it covered: the new
+			' status is stored for every region whose channel was moved, and
+			' the final progress message lists the regions that were not.
+			' Regions whose channel is missing are skipped, never deleted.
+		'''
+		guild = ctx.guild
+		targets = [region for region in targets if region.status != status]
+		if len(targets) == 0:
+			raise commands.BadArgument('None of the selected regions need {0}.'.format(action.lower()))
+
+		inactive_id = None
+		if status == 1:
+			inactive_id = await self._inactive_category(guild.id)
+
+		moves = []
+		edits = []
+		live = []
+		missing = []
+		for region in targets:
+			channel = guild.get_channel(region.channel_id)
+			if not channel:
+				missing.append(region)
+				continue
+
+			region.status = status
+			live.append(region)
+			category_id = region.active_category if status != 1 else inactive_id
+			if channel.category_id != category_id:
+				moves.append({'id':channel.id, 'position':0, 'parent_id':category_id, 'lock_permissions':True})
+			name = self._sanitize_channel_name(region.name)
+			topic = await self._generate_topic(region)
+			if channel.name != name or channel.topic != topic:
+				edits.append((channel, name, topic))
+
+		progress = await ctx.send('{0} {1} regions...'.format(action, len(live)))
+		moved = 0
+		edited = 0
+		not_moved = {} # channel id -> error
+		not_edited = {}
+		last_report = time.monotonic()
+
+		def failures():
+			names = {region.channel_id : region.name for region in live}
+			groups = [
+				('have no channel and were skipped', [region.name for region in missing]),
+				('could not be moved', [names[channel_id] for channel_id in not_moved]),
+				('kept their old name or topic', [names[channel_id] for channel_id in not_edited])]
+			lines = []
+			for problem, regions in groups:
+				if regions:
+					shown = ', '.join(sorted(regions)[:_BULK_FAILURES_SHOWN])
+					if len(regions) > _BULK_FAILURES_SHOWN:
+						shown = shown + ' and {0} more'.format(len(regions) - _BULK_FAILURES_SHOWN)
+					lines.append('{0} regions {1}: {2}'.format(len(regions), problem, shown))
+			errors = set(str(error) for error in list(not_moved.values()) + list(not_edited.values()))
+			if errors:
+				lines.append('Discord said: {0}'.format('; '.join(sorted(errors))))
+			return lines
+
+		async def report(final=False):
+			nonlocal last_report
+			now = time.monotonic()
+			if not final and now - last_report < _BULK_PROGRESS_INTERVAL:
+				return
+			last_report = now
+			content = '{0} {1} regions: moved {2}/{3} channels, updated {4}/{5} names and topics.'.format(action, len(live), moved, len(moves), edited, len(edits))
+			if final:
+				content = '\n'.join([content + ' Done.'] + failures())
+			await progress.edit(content=content)
+
+		reason = '{0} regions in bulk (requesting user: {1})'.format(action, ctx.author)
+		for start in range(0, len(moves), _BULK_POSITION_CHUNK):
+			chunk = moves[start:start+_BULK_POSITION_CHUNK]
+			try:
+				await self.bot.http.bulk_channel_update(guild.id, chunk, reason=reason)
+			except discord.HTTPException as e:
+				for move in chunk:
+					not_moved[move['id']] = e
+			else:
+				moved = moved + len(chunk)
+			await report()
+
+		# A channel that stayed where it was keeps its old name and topic.
+		edits = [edit for edit in edits if edit[0].id not in not_moved]
+		semaphore = asyncio.Semaphore(_BULK_EDIT_CONCURRENCY)
+		async def edit(channel, name, topic):
+			nonlocal edited
+			async with semaphore:
+				try:
+					await channel.edit(name=name, topic=topic, reason=reason)
+				except discord.HTTPException as e:
+					not_edited[channel.id] = e
+					return
+			edited = edited + 1
+			await report()
+
+		results = await asyncio.gather(*[edit(channel, name, topic) for channel, name, topic in edits], return_exceptions=True)
+		await self._edit_regions([region for region in live if region.channel_id not in not_moved])
+		await report(final=True)
+		await track(progress, ctx.author)
+		for result in results:
+			if isinstance(result, BaseException):
+				raise result
+		if not missing and not not_moved and not not_edited:
+			await ctx.message.add_reaction('✅')
+
+
+	@commands.group()
+	async def bulk(self, ctx):
+		''' Open or close many regions at once '''
+		pass
+
+	@bulk.command(name='closecategory')
+	@permissions.require(permissions.close)
+	async def bulk_close_category(self, ctx, *, category: discord.CategoryChannel=None):
+		''' Closes every open region in a category (default: this channel's category). '''
+		if not category:
+			category = ctx.channel.category
+		if not category:
+			raise commands.BadArgument('Please name a category, or run this command in a channel that has one.')
+
+		targets = []
+		for region in await self._list_regions(ctx.guild.id):
+			channel = ctx.guild.get_channel(region.channel_id)
+			if channel and channel.category_id == category.id:
+				targets.append(region)
+		await self._bulk_set_status(ctx, targets, 1, 'Closing')
+
+	@bulk.command(name='closeexcept')
+	@permissions.require(permissions.close)
+	async def bulk_close_except(self, ctx, *, names):
+		''' Closes every open region except the comma-separated regions given. '''
+		keep = {region.channel_id for region in await self._resolve_names(ctx.guild.id, names)}
+		if len(keep) == 0:
+			raise commands.BadArgument('Please name at least one region to keep open.')
+		targets = [region for region in await self._list_regions(ctx.guild.id) if region.channel_id not in keep]
+		await self._bulk_set_status(ctx, targets, 1, 'Closing')
+
+	@bulk.command(name='open')
+	@permissions.require(permissions.p_open)
+	async def bulk_open(self, ctx, *, names):
+		''' Opens every region in a comma-separated list of names. '''
+		await self._bulk_set_status(ctx, await self._resolve_names(ctx.guild.id, names), 0, 'Opening')
+
+
+	def _invalidate_list(self, guild_id):
+		self._list_pages.pop(guild_id, None)
+		self._list_counts.pop(guild_id, None)
+
+
+	async def _region_count(self, guild_id):
+		count = self._list_counts.get(guild_id)
+		if count is None:
+			regions = self._regions.get(guild_id)
+			if regions is not None:
+				count = len(regions)
+			else:
+				count = (await self.db.fetchone('SELECT COUNT(*) FROM regions WHERE guild_id=?;', (guild_id,)))[0]
+			self._list_counts[guild_id] = count
+		return count
+
+
+	async def _region_page(self, guild_id, after=None):
+		'''
+		  ' One page of |list: region names in case-insensitive order,
+			' starting after the (name, channel id) key `after` (from the
+			' beginning if None). Returns (page text, key of the next page),
+			' the key being None on the last page.
+			'
+			' Pages are read with a keyset query on the regions_guild_name
+			' index, so a page costs the same wherever it is in the list,
+			' and are cached until the guild's regions change.
+		'''
+		pages = self._list_pages.setdefault(guild_id, {})
+		page = pages.get(after)
+		if page is None:
+			if after is None:
+				rows = await self.db.fetchall('SELECT name, channel_id FROM regions WHERE guild_id=? ORDER BY name COLLATE NOCASE, channel_id LIMIT ?;', (guild_id, _LIST_PAGE_SIZE + 1))
+			else:
+				rows = await self.db.fetchall('SELECT name, channel_id FROM regions WHERE guild_id=? AND name >= ? COLLATE NOCASE AND (name > ? COLLATE NOCASE OR channel_id > ?) ORDER BY name COLLATE NOCASE, channel_id LIMIT ?;', (guild_id, after[0], after[0], after[1], _LIST_PAGE_SIZE + 1))
+			next_key = None
+			if len(rows) > _LIST_PAGE_SIZE:
+				rows = rows[:_LIST_PAGE_SIZE]
+				next_key = (rows[-1][0], rows[-1][1])
+			page = ('\n'.join('"{0}" id {1}'.format(row[0], row[1]) for row in rows), next_key)
+			if len(pages) >= _LIST_CACHE_PAGES:
+				pages.clear()
+			pages[after] = page # lands in an orphaned dict if the guild was invalidated meanwhile
+		return page
+
+
+	async def _format_region_page(self, guild_id, text, page_number):
+		if not text:
+			return 'No regions to list.'
+		return 'Regions on this server ({0} in total), page {1}:\n```\n{2}\n```'.format(await self._region_count(guild_id), page_number, text)
+
+
 	@commands.command()
-	async def list(self, ctx, offset='0'):
-		''' Provides a list of regions present on this server.
-		  ' :param offset: optional parameter to start the list at the <offset>'th region.
+	async def list(self, ctx, *, start=None):
+		''' Provides a list of regions present on this server. Use ◀ ▶ to turn pages.
+		  ' :param start: optional parameter to start the list at the first region named <start> or later in the alphabet.
 		'''
-		regions = await self._list_regions(ctx.guild.id)
-		num_offset = 0
-		if offset[0] == '+':
-			num_offset = int(offset[1:])
-		else:
-			num_offset = int(offset)
+		if start and start.lstrip('+').isdigit():
+			# |list N and |list +N were the old offset syntax.
+			msg = await ctx.send('``{0}list`` no longer takes a number. Use ◀ ▶ on the list to turn pages, or ``{0}list <name>`` to start at a region name.'.format(self.bot.command_prefix))
+			await track(msg, ctx.author)
+			return
 
-		tex = 'Regions on this server:\n```\n'
-		num_processed = 0
-		for region in regions:
-			if num_processed < num_offset:
-				num_processed = num_processed + 1
-				continue
-			to_check = tex + '{0:03d}| "{1}" id {2}\n'.format(num_processed,region['name'],region['channel_id'])
-			if len(to_check) > 1800:
-				tex = tex + '...[{0} more]({1}list +{2} for more)'.format(len(regions) - (num_processed), self.bot.command_prefix, num_processed)
+		guild_id = ctx.guild.id
+		keys = [(start, -1) if start else None] # keys of the pages shown so far, for ◀
+		text, next_key = await self._region_page(guild_id, keys[-1])
+		msg = await ctx.send(await self._format_region_page(guild_id, text, len(keys)))
+		await track(msg, ctx.author)
+		if next_key is None:
+			return
+
+		await msg.add_reaction('◀')
+		await msg.add_reaction('▶')
+		def check(reaction, user):
+			return user == ctx.author and reaction.message.id == msg.id and str(reaction.emoji) in ('◀', '▶')
+
+		while True:
+			try:
+				reaction, user = await self.bot.wait_for('reaction_add', timeout=_LIST_TIMEOUT, check=check)
+			except TimeoutError:
 				break
+			try:
+				await msg.remove_reaction(reaction.emoji, user) # so the same arrow can be pressed again
+			except discord.HTTPException:
+				pass # no manage_messages permission; the user has to unreact first
+
+			if str(reaction.emoji) == '▶' and next_key is not None:
+				keys.append(next_key)
+			elif str(reaction.emoji) == '◀' and len(keys) > 1:
+				keys.pop()
 			else:
-				num_processed = num_processed + 1
-				tex = to_check
-		
-		msg = await ctx.send(tex + '```')
-		await track(msg, ctx.author)
+				continue
+			text, next_key = await self._region_page(guild_id, keys[-1])
+			try:
+				await msg.edit(content=await self._format_region_page(guild_id, text, len(keys)))
+			except discord.NotFound:
+				return # deleted with 🚮
+
+		for emoji in ('◀', '▶'):
+			try:
+				await msg.remove_reaction(emoji, self.bot.user)
+			except discord.HTTPException:
+				pass
 
-					
 
 def setup(bot):
-	bot.add_cog(RPManager(bot, sql_con()))
+	bot.add_cog(RPManager(bot, bot.db))
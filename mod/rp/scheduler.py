@@ -0,0 +1,96 @@
+import asyncio
+import heapq
+import time
+
+class DeadlineScheduler:
+	'''
+	  ' Calls callback(key) once a key's deadline passes.
+		' 
+		' touch() only records the key's latest deadline in a dict; it
+		' pushes onto the heap only when the key is not scheduled yet (or
+		' the new deadline is earlier than the scheduled one). When a heap
+		' entry comes due, the recorded deadline is checked first: if
+		' activity has pushed it later, the entry is re-pushed for the new
+		' deadline instead of firing. The heap therefore holds about one
+		' entry per key, and a single task sleeps until the earliest
+		' deadline rather than polling every key.
+		' 
+		' Deadlines are time.monotonic() values. Keys must be orderable
+		' (e.g. tuples of ids) so that equal deadlines can be compared.
+	'''
+	def __init__(self, callback):
+		self.callback = callback
+		self._deadlines = {} # key -> latest deadline
+		self._scheduled = {} # key -> deadline of its live heap entry
+		self._heap = []
+		self._wakeup = asyncio.Event()
+		self._task = None
+
+	def __len__(self):
+		return len(self._deadlines)
+
+	def __contains__(self, key):
+		return key in self._deadlines
+
+	def start(self):
+		if not self._task:
+			self._task = asyncio.ensure_future(self._run())
+
+	def stop(self):
+		if self._task:
+			self._task.cancel()
+			self._task = None
+
+	def touch(self, key, deadline):
+		self._deadlines[key] = deadline
+		scheduled = self._scheduled.get(key)
+		if scheduled is None or deadline < scheduled:
+			self._push(key, deadline)
+
+	def cancel(self, key):
+		# The heap entry is discarded lazily when it comes due.
+		self._deadlines.pop(key, None)
+		self._scheduled.pop(key, None)
+
+	def _push(self, key, deadline):
+		self._scheduled[key] = deadline
+		heapq.heappush(self._heap, (deadline, key))
+		if self._heap[0][1] == key:
+			self._wakeup.set()
+
+	async def _sleep(self, timeout):
+		self._wakeup.clear()
+		try:
+			await asyncio.wait_for(self._wakeup.wait(), timeout)
+		except asyncio.TimeoutError:
+			pass
+
+	async def _run(self):
+		while True:
+			if not self._heap:
+				await self._sleep(None)
+				continue
+
+			deadline, key = self._heap[0]
+			now = time.monotonic()
+			if deadline > now:
+				await self._sleep(deadline - now)
+				continue
+
+			heapq.heappop(self._heap)
+			if self._scheduled.get(key) != deadline:
+				continue # stale entry: cancelled or rescheduled earlier
+
+			latest = self._deadlines[key]
+			if latest > now:
+				self._push(key, latest)
+				continue
+
+			self.cancel(key)
+			asyncio.ensure_future(self._fire(key))
+
+	async def _fire(self, key):
+		try:
+			await self.callback(key)
+		except Exception as e:
+			print('Scheduled callback for {0} failed: {1}'.format(key, e))
@@ -5,7 +5,7 @@ import discord
 from discord.ext import commands
 from discord import Member, Role
 
-from sql.sql import sql_cur, sql_con
+from sql.sql import shared_db
 from messages import track
 
 ''' -----Permission offsets----- '''
@@ -81,23 +81,47 @@ def _construct_from_preset_string(preset_string):
 	
 	return role_perms
 
+# Grant flags sit on the even bits and deny flags on the odd bit above them,
+# so every permission can be combined at once with whole-word operations.
+_grant_mask = 0
+for _perm in _perms_lut.values():
+	_grant_mask |= 1 << _perm
+
 def _perms_combine(high_priority, low_priority):
-	final_perm = 0
-	for perm in _perms_lut.values():
-		if _denied(high_priority, perm):
-			final_perm = _deny_perm(final_perm, perm)
-		elif _has(low_priority, perm) or _has(high_priority, perm):
-			final_perm = _grant_perm(final_perm, perm)
-		elif _denied(low_priority, perm):
-			final_perm = _deny_perm(final_perm, perm)
-	
-	return final_perm
+	''' Fold a higher-priority role's code over a lower-priority one.
+	  ' Per permission: a deny on the higher role wins; otherwise a grant
+	  ' on either role wins; otherwise a deny on the lower role carries.
+	'''
+	high_grant = high_priority & _grant_mask
+	high_deny = (high_priority >> 1) & _grant_mask
+	either_grant = high_grant | (low_priority & _grant_mask)
+	low_deny = (low_priority >> 1) & _grant_mask
+
+	grant = either_grant & ~high_deny
+	deny = high_deny | (low_deny & ~either_grant)
+	return grant | (deny << 1)
+
+''' -----Effective-permission cache----- '''
+# _compiled_roles maps guild id -> (tuple of (role id, stored permission
+# code) sorted from lowest to highest role position, frozenset of those role
+# ids), so that resolving a member does not read the permissions table.
+# _effective_cache maps guild id -> {frozenset of the member's tracked role
+# ids: folded code}. Both are dropped per guild by invalidate() whenever
+# stored permissions or the guild's roles change; a warm check does no SQL.
+_compiled_roles = {}
+_effective_cache = {}
+_cache_generation = {}
+
+def invalidate(guild_id):
+	_compiled_roles.pop(guild_id, None)
+	_effective_cache.pop(guild_id, None)
+	_cache_generation[guild_id] = _cache_generation.get(guild_id, 0) + 1
 
 class Permissions:
 	''' Manages user permissions '''
 	def __init__(self, bot):
 		self.bot = bot
-		self.db = sql_con()
+		self.db = bot.db
 
 		self._GRANT = 0
 		self._DENY = 1
@@ -105,8 +129,8 @@ class Permissions:
 		self._OVERWRITE = 3
 
 
-	def _perms_write(self, guild_id, role_id, perms):
-		with sql_cur(self.db) as cur:
+	async def _perms_write(self, guild_id, role_id, perms):
+		def write(cur):
 			cur.execute('SELECT permissions FROM permissions WHERE guild_id=? AND role_id=?;', (guild_id, role_id))
 			res = cur.fetchone()
 
@@ -116,17 +140,18 @@ class Permissions:
 			else:
 				cur.execute('INSERT INTO permissions (guild_id, role_id, permissions) VALUES (?,?,?);', (guild_id, role_id, perms))
 
+		await self.db.transaction(write)
+		invalidate(guild_id)
+
 
-	def _perms_set(self, guild_id, role_id, permissions, mode=None):
+	async def _perms_set(self, guild_id, role_id, permissions, mode=None):
 		if not mode:
 			mode = self._GRANT
 
 		current_perms = 0
-		with sql_cur(self.db) as cur:
-			cur.execute('SELECT permissions FROM permissions WHERE guild_id=? AND role_id=?;', (guild_id, role_id))
-			res = cur.fetchone()
-			if res:
-				current_perms = res[0]
+		res = await self.db.fetchone('SELECT permissions FROM permissions WHERE guild_id=? AND role_id=?;', (guild_id, role_id))
+		if res:
+			current_perms = res[0]
 				
 		new_perms = current_perms
 		for perm in permissions:
@@ -145,7 +170,7 @@ class Permissions:
 			else:
 				raise commands.CommandError('Unknown value {0} for permission mode enum.'.format(mode))
 		
-		self._perms_write(guild_id, role_id, new_perms)
+		await self._perms_write(guild_id, role_id, new_perms)
 
 	@require(manage)
 	@commands.group()
@@ -178,7 +203,7 @@ class Permissions:
 				warn_msg = await ctx.send('Warning: Permission(s) {0} not found. Skipping these permissions.'.format(unknown_permissions))
 				await track(warn_msg)
 
-			self._perms_set(ctx.guild.id, role.id, extant_permissions, mode=mode)
+			await self._perms_set(ctx.guild.id, role.id, extant_permissions, mode=mode)
 
 			await ctx.message.add_reaction('✅')
 
@@ -267,10 +292,8 @@ class Permissions:
 			raise commands.BadArgument('Preset {0} not found. Try `{1}perms list` for a list of presets.'.format(preset_name, self.bot.command_prefix))
 
 		existing_perms = False
-		with sql_cur(self.db) as cur:
-			cur.execute('SELECT * FROM permissions WHERE guild_id=?;', (ctx.guild.id,))
-			if cur.fetchone():
-				existing_perms = True
+		if await self.db.fetchone('SELECT * FROM permissions WHERE guild_id=?;', (ctx.guild.id,)):
+			existing_perms = True
 
 		if existing_perms:
 			embed = discord.Embed(title='\U0001f6a8 WARNING!', colour=discord.Colour(0xc7b61a), description='Hector already has permission records for this server! Continuing will erase these records and replace them with preset values!')
@@ -294,22 +317,30 @@ class Permissions:
 			else:
 				await warn_msg.clear_reactions()
 				await warn_msg.edit(content='Confirmed. Setting up permissions from preset {0}.'.format(preset['name']))
-				with sql_cur(self.db) as cur:
-					cur.execute('DELETE FROM permissions WHERE guild_id=?;', (ctx.guild.id,))
+				await self.db.execute('DELETE FROM permissions WHERE guild_id=?;', (ctx.guild.id,))
+				invalidate(ctx.guild.id)
 		for role in preset['roles']:
 			perm_val = _construct_from_preset_string(role['permissions'])
 			if role['name'] == '*':
 				# Handle @everyone separately
-				with sql_cur(self.db) as cur:
-					cur.execute('INSERT INTO permissions (guild_id, role_id, permissions) VALUES (?,?,?);', (ctx.guild.id, ctx.guild.default_role.id, perm_val))
+				await self.db.execute('INSERT INTO permissions (guild_id, role_id, permissions) VALUES (?,?,?);', (ctx.guild.id, ctx.guild.default_role.id, perm_val))
 			else:
 				if not 'color' in role.keys():
 					role['color'] = 0x419492
 				new_role = await ctx.guild.create_role(name=role['name'],colour=discord.Colour(role['color']),mentionable=True,reason='Setting up permissions from preset (requesting user: {0})'.format(ctx.message.author))
-				with sql_cur(self.db) as cur:
-					cur.execute('INSERT INTO permissions (guild_id, role_id, permissions) VALUES (?,?,?);', (ctx.guild.id, new_role.id, perm_val))
+				await self.db.execute('INSERT INTO permissions (guild_id, role_id, permissions) VALUES (?,?,?);', (ctx.guild.id, new_role.id, perm_val))
+			invalidate(ctx.guild.id)
 		await ctx.message.add_reaction('✅')
 	
+	async def on_guild_role_update(self, before, after):
+		invalidate(after.guild.id)
+
+	async def on_guild_role_delete(self, role):
+		invalidate(role.guild.id)
+
+	async def on_guild_remove(self, guild):
+		invalidate(guild.id)
+
 	@commands.command(name='myperms')
 	async def my_perms(self, ctx, user:discord.Member=None):
 		''' Check your own permissions or those of another user. '''
@@ -338,23 +369,56 @@ class Permissions:
 				
 
 
-async def get_permissions(member, guild):
+def _compile_roles(guild, tracked_roles):
+	ordered = []
+	for role_id, code in tracked_roles.items():
+		role = guild.get_role(role_id)
+		if role:
+			ordered.append((role.position, role_id, code))
+	ordered.sort()
+	order = tuple((role_id, code) for position, role_id, code in ordered)
+	return (order, frozenset(role_id for role_id, code in order))
+
+async def _get_compiled_roles(guild):
+	compiled = _compiled_roles.get(guild.id)
+	if compiled is not None:
+		return compiled
+
+	generation = _cache_generation.get(guild.id, 0)
 	tracked_roles = {}
-	with sql_cur(sql_con()) as cur:
-		cur.execute('SELECT role_id,permissions FROM permissions WHERE guild_id=?', (guild.id,))
-		for role in cur.fetchall():
-			tracked_roles[role[0]] = role[1]
-	
-	if len(tracked_roles) == 0:
-		return 0
+	for role in await shared_db().fetchall('SELECT role_id,permissions FROM permissions WHERE guild_id=?', (guild.id,)):
+		tracked_roles[role[0]] = role[1]
+
+	compiled = _compile_roles(guild, tracked_roles)
+	if _cache_generation.get(guild.id, 0) == generation:
+		# Only cache if nothing invalidated the guild while we were reading.
+		_compiled_roles[guild.id] = compiled
+	return compiled
 
+def _resolve(order, role_ids):
+	''' Fold the held roles from lowest to highest position. '''
 	permissions = 0
+	for role_id, code in order:
+		if role_id in role_ids:
+			permissions = _perms_combine(code, permissions)
+	return permissions
+
+async def get_permissions(member, guild):
+	compiled = await _get_compiled_roles(guild)
+	order, tracked_ids = compiled
 	
-	for role in member.roles:
-		if role.id in tracked_roles.keys():
-			role_perms = tracked_roles[role.id]
-			permissions = _perms_combine(role_perms, permissions)
-	
+	if len(order) == 0:
+		return 0
+
+	held_roles = frozenset(role.id for role in member.roles if role.id in tracked_ids)
+	guild_cache = _effective_cache.setdefault(guild.id, {})
+	if held_roles in guild_cache:
+		return guild_cache[held_roles]
+
+	permissions = _resolve(order, held_roles)
+
+	if _compiled_roles.get(guild.id) is compiled:
+		guild_cache[held_roles] = permissions
 	return permissions
 
 async def has_permission(ctx, perm):
@@ -0,0 +1,285 @@
+import os
+import io
+import time
+import pstats
+import asyncio
+import cProfile
+import datetime
+import tracemalloc
+
+import discord
+from discord.ext import commands
+
+from messages import track
+
+_modes = ('cpu', 'memory')
+_max_invocations = 50
+_max_window = 600 # seconds
+_summary_lines = 8
+_tracemalloc_frames = 10
+
+def _short_location(filename, lineno, name=None):
+	if filename == '~': # C builtins, e.g. <built-in method builtins.sorted>
+		return name
+	location = '{0}:{1}'.format(os.path.basename(filename), lineno)
+	return '{0} ({1})'.format(name, location) if name else location
+
+def _code_block(lines):
+	text = '\n'.join(lines)
+	if len(text) > 1000: # embed fields hold 1024 characters
+		text = text[:1000] + '\n…'
+	return '```{0}```'.format(text or 'nothing recorded')
+
+def _format_size(size):
+	for unit in ('B', 'KiB', 'MiB'):
+		if abs(size) < 1024:
+			return '{0:+.1f} {1}'.format(size, unit)
+		size = size / 1024
+	return '{0:+.1f} GiB'.format(size)
+
+
+class ProfileSession:
+	'''
+	  ' One armed profile: either the next `remaining` invocations of a
+		' command, or everything that runs until a deadline.
+		'
+		' cpu sessions accumulate into a single cProfile.Profile, which is
+		' enabled only while at least one profiled invocation is running.
+		' cProfile sees everything on the event loop thread in that time,
+		' including other tasks that run while the command awaits; work on
+		' the database thread is not included.
+		'
+		' memory sessions take a tracemalloc snapshot when each invocation
+		' starts and compare it with one taken when it ends. The
+		' differences are summed per source line across invocations.
+	'''
+	def __init__(self, mode, channel, author, command=None, remaining=0, seconds=0):
+		self.mode = mode
+		self.channel = channel
+		self.author = author
+		self.command = command
+		self.remaining = remaining
+		self.seconds = seconds
+		self.invocations = 0
+		self.active = 0
+		self.started = time.time()
+		self.profile = cProfile.Profile() if mode == 'cpu' else None
+		self.memory = {} # source line -> [size diff, block count diff]
+		self.window_start = None
+
+	def describe(self):
+		target = 'the next {0} invocation(s) of ``{1}``'.format(self.remaining, self.command.qualified_name) if self.command else '{0}s window'.format(self.seconds)
+		return '{0} profile of {1}, armed {2:.0f}s ago, {3} invocation(s) captured'.format(self.mode, target, time.time() - self.started, self.invocations)
+
+	def begin(self):
+		''' Start capturing; returns a token for end(). '''
+		self.active = self.active + 1
+		if self.profile:
+			if self.active == 1:
+				self.profile.enable()
+			return None
+		return tracemalloc.take_snapshot()
+
+	def end(self, token):
+		self.active = self.active - 1
+		if self.profile:
+			if self.active == 0:
+				self.profile.disable()
+			return
+		if not tracemalloc.is_tracing():
+			return # stopped early while this invocation was still running
+		after = tracemalloc.take_snapshot()
+		ignore = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>'))
+		for stat in after.filter_traces(ignore).compare_to(token.filter_traces(ignore), 'lineno'):
+			if not stat.size_diff and not stat.count_diff:
+				continue
+			frame = stat.traceback[0]
+			totals = self.memory.setdefault(_short_location(frame.filename, frame.lineno), [0, 0])
+			totals[0] = totals[0] + stat.size_diff
+			totals[1] = totals[1] + stat.count_diff
+
+
+class Profiler:
+	'''
+	  ' On-demand CPU (cProfile) and memory (tracemalloc) profiling of live
+		' commands.
+		'
+		' Nothing is installed until a profile is armed: arming a command
+		' replaces that one command's invoke() with a profiling wrapper,
+		' and finishing the profile removes the wrapper again, so
+		' unprofiled commands (and all commands while nothing is armed)
+		' run exactly as before. tracemalloc is only running while a
+		' memory profile is armed.
+		'
+		' Results are written to data/profiles/: a .prof file (load with
+		' pstats or snakeviz) for cpu profiles, a text report for memory
+		' profiles. A summary is posted where the profile was armed.
+	'''
+	def __init__(self, bot, output_dir='data/profiles'):
+		self.bot = bot
+		self.output_dir = output_dir
+		self.session = None
+		self._window_handle = None
+
+	def __unload(self):
+		if self.session:
+			self._disarm()
+
+	def _wrap(self, command):
+		session = self.session
+		original = command.invoke
+
+		async def invoke(ctx):
+			if session.remaining <= 0:
+				return await original(ctx)
+			session.remaining = session.remaining - 1
+			session.invocations = session.invocations + 1
+			token = session.begin()
+			try:
+				return await original(ctx)
+			finally:
+				session.end(token)
+				if session.remaining <= 0 and session.active == 0:
+					asyncio.ensure_future(self._finish(session))
+
+		command.invoke = invoke
+
+	def _arm(self, session):
+		self.session = session
+		if session.mode == 'memory':
+			tracemalloc.start(_tracemalloc_frames)
+		if session.command:
+			self._wrap(session.command)
+		else:
+			session.window_start = session.begin()
+			self._window_handle = self.bot.loop.call_later(session.seconds, lambda: asyncio.ensure_future(self._finish(session)))
+
+	def _disarm(self):
+		''' Remove every hook installed by _arm(). Returns the finished session. '''
+		session = self.session
+		self.session = None
+		if session.command and 'invoke' in session.command.__dict__:
+			del session.command.invoke # back to the class's invoke()
+		if self._window_handle:
+			self._window_handle.cancel()
+			self._window_handle = None
+		if not session.command and session.active:
+			session.end(session.window_start)
+		elif session.profile and session.active:
+			session.profile.disable()
+		if session.mode == 'memory':
+			tracemalloc.stop()
+		return session
+
+	def _file_stem(self, session):
+		label = session.command.qualified_name.replace(' ', '_') if session.command else 'window'
+		return os.path.join(self.output_dir, '{0}-{1}-{2}'.format(label, session.mode, datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S')))
+
+	def _write_cpu(self, session, embed):
+		path = self._file_stem(session) + '.prof'
+		session.profile.dump_stats(path)
+		stats = pstats.Stats(session.profile, stream=io.StringIO()).stats
+		entries = list(stats.items())
+
+		by_cumulative = sorted(entries, key=lambda entry: entry[1][3], reverse=True)[:_summary_lines]
+		by_own = sorted(entries, key=lambda entry: entry[1][2], reverse=True)[:_summary_lines]
+		embed.add_field(name='Cumulative time', value=_code_block('{0:8.3f}s {1:>7} {2}'.format(value[3], value[1], _short_location(*key[:2], name=key[2])) for key, value in by_cumulative), inline=False)
+		embed.add_field(name='Own time', value=_code_block('{0:8.3f}s {1:>7} {2}'.format(value[2], value[1], _short_location(*key[:2], name=key[2])) for key, value in by_own), inline=False)
+		return path
+
+	def _write_memory(self, session, embed):
+		path = self._file_stem(session) + '.txt'
+		ranked = sorted(session.memory.items(), key=lambda item: abs(item[1][0]), reverse=True)
+		with open(path, 'w') as report:
+			report.write('# size change, block count change, location ({0} invocation(s))\n'.format(session.invocations))
+			for location, (size, count) in ranked:
+				report.write('{0} {1:+d} {2}\n'.format(size, count, location))
+		embed.add_field(name='Largest allocation changes', value=_code_block('{0:>12} {1:+7d} {2}'.format(_format_size(size), count, location) for location, (size, count) in ranked[:_summary_lines]), inline=False)
+		return path
+
+	async def _finish(self, session=None):
+		if not self.session or (session and session is not self.session):
+			return # already finished (e.g. by |profile stop)
+		session = self._disarm()
+		os.makedirs(self.output_dir, exist_ok=True)
+
+		target = '``{0}`` ({1} invocation(s))'.format(session.command.qualified_name, session.invocations) if session.command else 'a {0}s window'.format(session.seconds)
+		embed = discord.Embed(title='\U0001f52c {0} profile of {1}'.format(session.mode.upper() if session.mode == 'cpu' else 'Memory', target), colour=discord.Colour(0x419492))
+		if session.mode == 'cpu':
+			path = self._write_cpu(session, embed)
+		else:
+			path = self._write_memory(session, embed)
+		embed.set_footer(text='Full results: {0}'.format(path))
+
+		msg = await session.channel.send(content='', embed=embed)
+		await track(msg, session.author)
+
+	def _check_mode(self, mode):
+		mode = mode.lower()
+		if mode not in _modes:
+			raise commands.BadArgument('Profile mode must be one of: {0}.'.format(', '.join(_modes)))
+		return mode
+
+	async def _refuse_if_armed(self, ctx):
+		if not self.session:
+			return False
+		msg = await ctx.send('A {0}. Use ``{1}profile stop`` first.'.format(self.session.describe(), self.bot.command_prefix))
+		await track(msg, ctx.author)
+		return True
+
+
+	@commands.is_owner()
+	@commands.group()
+	async def profile(self, ctx):
+		''' (Owner-only) Profile live commands with cProfile or tracemalloc '''
+		pass
+
+	@profile.command(name='command')
+	async def profile_command(self, ctx, name, count: int=1, mode='cpu'):
+		''' Profile the next [count] invocations of a command (mode: cpu or memory) '''
+		mode = self._check_mode(mode)
+		command = self.bot.get_command(name)
+		if not command:
+			raise commands.BadArgument('There is no command named "{0}".'.format(name))
+		if command.root_parent is self.profile or command is self.profile:
+			raise commands.BadArgument('The profile command cannot profile itself.')
+		if not 1 <= count <= _max_invocations:
+			raise commands.BadArgument('Please profile between 1 and {0} invocations.'.format(_max_invocations))
+		if await self._refuse_if_armed(ctx):
+			return
+
+		self._arm(ProfileSession(mode, ctx.channel, ctx.author, command=command, remaining=count))
+		msg = await ctx.send('Armed a {0} profile for the next {1} invocation(s) of ``{2}``.'.format(mode, count, command.qualified_name))
+		await track(msg, ctx.author)
+
+	@profile.command(name='window')
+	async def profile_window(self, ctx, seconds: int, mode='cpu'):
+		''' Profile everything Hector does for <seconds> (mode: cpu or memory) '''
+		mode = self._check_mode(mode)
+		if not 1 <= seconds <= _max_window:
+			raise commands.BadArgument('Please profile for between 1 and {0} seconds.'.format(_max_window))
+		if await self._refuse_if_armed(ctx):
+			return
+
+		self._arm(ProfileSession(mode, ctx.channel, ctx.author, seconds=seconds))
+		msg = await ctx.send('Profiling ({0}) for {1} seconds.'.format(mode, seconds))
+		await track(msg, ctx.author)
+
+	@profile.command(name='status')
+	async def profile_status(self, ctx):
+		''' Show the armed profile, if any '''
+		msg = await ctx.send('A {0}.'.format(self.session.describe()) if self.session else 'No profile is armed.')
+		await track(msg, ctx.author)
+
+	@profile.command(name='stop')
+	async def profile_stop(self, ctx):
+		''' Finish the armed profile now and report what was captured '''
+		if not self.session:
+			msg = await ctx.send('No profile is armed.')
+			await track(msg, ctx.author)
+			return
+		await self._finish()
+
+
+def setup(bot):
+	bot.add_cog(Profiler(bot))
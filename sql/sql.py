@@ -1,11 +1,51 @@
 import sqlite3
 import json
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 class database_initialize_error(BaseException):
 	'''
 	  ' Raised when the database can't be initialized properly
 	'''
 
+''' -----Connection tuning defaults----- '''
+# Overridden by the optional "database" block in .bot_info.json.
+_tuning_defaults = {
+	'journal_mode' : 'WAL',        # readers don't block the writer (required for clusters)
+	'synchronous' : 'NORMAL',      # in WAL mode, fsync at checkpoints rather than every commit
+	'cache_size' : -16000,         # page cache; negative values are KiB
+	'mmap_size' : 64 * 1024 * 1024, # bytes of the file read through mmap; 0 disables
+	'cached_statements' : 256      # prepared statements kept per connection
+}
+
+_journal_modes = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+_synchronous_levels = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+def check_tuning(tuning=None):
+	'''
+	  ' Returns the defaults overridden by tuning, with journal_mode and
+		' synchronous upper-cased and the sizes as ints. Raises
+		' database_initialize_error for values SQLite would not accept.
+	'''
+	checked = dict(_tuning_defaults)
+	if tuning:
+		checked.update(tuning)
+
+	checked['journal_mode'] = str(checked['journal_mode']).upper()
+	checked['synchronous'] = str(checked['synchronous']).upper()
+	if checked['journal_mode'] not in _journal_modes:
+		raise database_initialize_error('Unknown journal_mode "{0}" (expected one of {1}).'.format(checked['journal_mode'], ', '.join(_journal_modes)))
+	if checked['synchronous'] not in _synchronous_levels:
+		raise database_initialize_error('Unknown synchronous level "{0}" (expected one of {1}).'.format(checked['synchronous'], ', '.join(_synchronous_levels)))
+	for key in ('cache_size', 'mmap_size', 'cached_statements'):
+		try:
+			checked[key] = int(checked[key])
+		except (TypeError, ValueError):
+			raise database_initialize_error('{0} must be an integer, not "{1}".'.format(key, checked[key]))
+	return checked
+
 class sql_cur:
 	'''
 	  ' Cursor object for sqlite3 database.
@@ -19,168 +59,232 @@ class sql_cur:
 		'   do_other_things() # Cursor object is closed and committed before
 		'                       this line - use cursor.rollback() to roll
 		'                       back changes
+		' 
+		' Pass readonly=True for cursors that only SELECT; they are closed
+		' without committing.
+		' 
+		' If sql_cur.observer is set, it is called as observer(seconds,
+		' readonly) after every block, on the thread that ran it (see
+		' metrics.py). When it is None, blocks are not timed at all.
 	'''
-	def __init__(self, connection):
+	observer = None
+
+	def __init__(self, connection, readonly=False):
 		self.con = connection
+		self.readonly = readonly
+		self.started = None
 	
 	def __enter__(self):
+		if sql_cur.observer:
+			self.started = time.perf_counter()
 		self.cur = self.con.raw.cursor()
 		return self.cur
 	
 	def __exit__(self, xtype, xvalue, xtraceback):
-		self.con.raw.commit()
+		if not self.readonly:
+			self.con.raw.commit()
 		self.cur.close()
+		observer = sql_cur.observer
+		if observer and self.started is not None:
+			observer(time.perf_counter() - self.started, self.readonly)
 
 class sql_con:
-	def __init__(self):
-		self.table_prefix = ''
-		self.raw = sqlite3.connect('data/sqlite3.db')
+	def __init__(self, apply_migrations=True, busy_timeout=30, tuning=None, path='data/sqlite3.db', readonly=False):
+		self.tuning = check_tuning(tuning)
+
+		# The connection is handed to the sql_async database thread after
+		# setup, so it must not be pinned to the constructing thread.
+		# Several bot processes may share the file (see cluster.py): wait
+		# up to busy_timeout seconds for another process's write lock
+		# rather than failing.
+		#
+		# readonly connections (for inspecting the schema) neither create
+		# the file nor apply the tuning, since journal_mode is stored in
+		# the file; they cannot migrate.
+		if readonly:
+			self.raw = sqlite3.connect('file:{0}?mode=ro'.format(path), uri=True, timeout=busy_timeout, check_same_thread=False)
+		else:
+			self.raw = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, cached_statements=self.tuning['cached_statements'])
+			self._apply_tuning()
 		with open('sql/schema.json') as schema_file:
 			self.schema = json.load(schema_file)
 
-		table_status = self.table_check()
-		if table_status == 0:
-			return
-		elif table_status == 1:
-			print('Database is empty. Initializing...')
-			self.setup_tables(force=False)
-		elif table_status == 2:
-			print('Some tables are missing. Creating missing tables...')
-			self.setup_tables(force=False)
-		else:
-			print('Database does not match expected schema! Re-initialize?')
-			reinit = input('[y/n]:')
-			if reinit.lower() == 'y':
-				print('Deleting all data and re-initializing...')
-				self.setup_tables(force=True)
-			else:
-				print('Table setup cannot continue. Aborting.')
-				raise database_initialize_error()
-	
-	def table_check(self, schema=None, table_prefix=None):
+		if apply_migrations and not readonly:
+			self.migrate()
+
+	def _apply_tuning(self):
 		'''
-		  ' Verify the table structure in the database
-			' 
-			' Parameters:
-			'   schema = dict from schema.json, detailing the expected
-			'            table schema for the database.
+		  ' Apply the journal, sync, cache and mmap pragmas. Only
+			' journal_mode is stored in the database file; the others last
+			' for this connection.
+		'''
+		self.raw.execute('PRAGMA journal_mode={0};'.format(self.tuning['journal_mode']))
+		self.raw.execute('PRAGMA synchronous={0};'.format(self.tuning['synchronous']))
+		self.raw.execute('PRAGMA cache_size={0:d};'.format(self.tuning['cache_size']))
+		self.raw.execute('PRAGMA mmap_size={0:d};'.format(self.tuning['mmap_size']))
+
+	def schema_version(self):
+		''' Returns the migration version recorded in the database file. '''
+		with sql_cur(self, readonly=True) as cur:
+			cur.execute('PRAGMA user_version;')
+			return cur.fetchone()[0]
+
+	def _migrations(self):
+		migrations = sorted(self.schema['migrations'], key=lambda m: m['version'])
+		for expected, migration in enumerate(migrations, start=1):
+			if migration['version'] != expected:
+				raise database_initialize_error('schema.json: expected migration {0}, found {1}.'.format(expected, migration['version']))
+		return migrations
+
+	def pending_migrations(self):
+		'''
+		  ' Returns the migrations that migrate() would apply, without
+			' applying them. Raises database_initialize_error if schema.json is
+			' malformed or the database is newer than it.
+		'''
+		migrations = self._migrations()
+		current = self.schema_version()
+		if current > len(migrations):
+			raise database_initialize_error('Database is at schema version {0}, but this version of Hector only knows up to {1}.'.format(current, len(migrations)))
+		return migrations[current:]
+
+	def migrate(self):
+		'''
+		  ' Bring the database up to the latest version in schema.json.
 			' 
-			'   table_prefix = if present, prepend this to table names as
-			'                  specified in the schema.
+			' Migrations are numbered and forward-only. The applied version is
+			' stored in PRAGMA user_version, so an up-to-date database costs a
+			' single integer comparison. Pending migrations are applied
+			' together in one transaction; if any statement fails, nothing is
+			' applied and database_initialize_error is raised.
 			' 
-			' Returns:
-			'   0 if everything is normal
-			'   1 if the database is empty
-			'   2 if some tables are present but others are absent
-			'   3 if tables do not follow the expected schema
+			' The version is checked again after taking the write lock, so
+			' processes starting at the same time apply each migration once.
 		'''
-		if not schema:
-			schema = self.schema
-		if not table_prefix:
-			table_prefix = self.table_prefix
-			
-		all_tables_present = True
-		database_empty = True
-		schema_ok = True
-
-		with sql_cur(self) as cur:
-			cur.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
-			res_raw = cur.fetchall()
-
-		res_fixed = []
-		for result in res_raw:
-			res_fixed.append(result[0])
-
-		for table in schema:
-			tname = table_prefix + table['name']
-			if tname in res_fixed:
-				database_empty = False
-				with sql_cur(self) as cur:
-					cur.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='{0}'".format(tname))
-					res_raw = cur.fetchall()
-					res_preproc = res_raw[0][0][res_raw[0][0].find('(')+1:res_raw[0][0].find(')')].split(',')
-					res = []
-					for column in res_preproc:
-						column = column.strip()
-						column_processed = [column[:column.find(' ')], column[column.find(' ')+1:].split(' ')[0]]
-						res.append(column_processed)
-				
-				if len(res) != len(table['schema']):
-					schema_ok = False # missing column(s)
-
-				for column in res:
-					match = False
-					for col_descriptor in table['schema']:
-						if col_descriptor['name'] == column[0]:
-							if col_descriptor['type'].lower() == column[1].lower():
-								match = True
-								break
-							else:
-								print('type mismatch on column: ' + str(column))
-								schema_ok = False # Type mismatch
-
-					if not match:
-						print('unexpected column: ' + str(column))
-						print('dump: ' + str(res_raw) + ' -> ' + str(res))
-						schema_ok = False # Unexpected column
+		migrations = self._migrations()
+		latest = len(migrations)
+		current = self.schema_version()
+		if current == latest:
+			return
+		elif current > latest:
+			raise database_initialize_error('Database is at schema version {0}, but this version of Hector only knows up to {1}.'.format(current, latest))
+
+		cur = self.raw.cursor()
+		try:
+			cur.execute('BEGIN IMMEDIATE;')
+			cur.execute('PRAGMA user_version;')
+			current = cur.fetchone()[0]
+			if current >= latest:
+				self.raw.rollback()
+				return
+			for migration in migrations[current:]:
+				print('Applying database migration {0}: {1}'.format(migration['version'], migration['description']))
+				for statement in migration['statements']:
+					cur.execute(statement)
+			cur.execute('PRAGMA user_version = {0:d};'.format(latest))
+			self.raw.commit()
+		except sqlite3.Error as e:
+			self.raw.rollback()
+			raise database_initialize_error('Migration failed, database left at version {0}: {1}'.format(current, e))
+		finally:
+			cur.close()
+
 
+class sql_async:
+	'''
+	  ' Awaitable interface to a sql_con.
+		' 
+		' Every statement runs on a single dedicated database thread, so
+		' coroutines never block the event loop on sqlite3. Because the
+		' thread is shared, statements are serialized in submission order.
+		' 
+		' To use:
+		' 
+		'   db = shared_db() # or sql_async(sql_con()) for a private handle
+		'   row = await db.fetchone('SELECT ... WHERE x=?;', (x,))
+		' 
+		'   def work(cur):
+		'     cur.execute(...)
+		'     cur.execute(...)
+		'   await db.transaction(work) # runs both statements, then commits
+	'''
+	def __init__(self, connection):
+		self.con = connection
+		self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hector-db')
+
+	async def _run(self, func, *args):
+		loop = asyncio.get_event_loop()
+		return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+	def _execute(self, query, params, mode):
+		# Fetches only read, so their cursor skips the commit.
+		with sql_cur(self.con, readonly=mode in ('one', 'all')) as cur:
+			if mode == 'many':
+				cur.executemany(query, params)
+				return cur.rowcount
+
+			cur.execute(query, params)
+			if mode == 'one':
+				return cur.fetchone()
+			elif mode == 'all':
+				return cur.fetchall()
 			else:
-				all_tables_present = False # missing table
-
-		if not schema_ok:
-			return 3
-		elif database_empty:
-			return 1
-		elif not all_tables_present:
-			return 2
-		else:
-			return 0
+				return cur.rowcount
+
+	def _transaction(self, func):
+		with sql_cur(self.con) as cur:
+			return func(cur)
 
-	def setup_tables(self, force=False):
+	async def execute(self, query, params=()):
+		''' Run a single statement and commit. Returns the affected row count. '''
+		return await self._run(self._execute, query, params, None)
+
+	async def executemany(self, query, param_seq):
+		''' Run a statement once per parameter tuple in a single commit. '''
+		return await self._run(self._execute, query, list(param_seq), 'many')
+
+	async def fetchone(self, query, params=()):
+		''' Run a read-only query and return its first row. Use execute() or transaction() to write. '''
+		return await self._run(self._execute, query, params, 'one')
+
+	async def fetchall(self, query, params=()):
+		return await self._run(self._execute, query, params, 'all')
+
+	async def transaction(self, func):
 		'''
-		  ' Sets up the proper tables in the sqlite3 database
-			' 
-			' Parameters:
-			'   force = whether to delete all tables and re-initialize. This
-			'           option is DANGEROUS, and should not be used unless
-			'           necessary
+		  ' Run func(cursor) on the database thread inside a single sql_cur
+			' block. Use this when several statements must see each other's
+			' results (e.g. select-then-insert) without another coroutine's
+			' statements landing in between.
+		'''
+		return await self._run(self._transaction, func)
+
+	def transaction_sync(self, func):
 		'''
+		  ' Like transaction(), but blocks until func(cursor) has run. Only
+			' for use when no event loop is running (e.g. flushing buffers
+			' during shutdown).
+		'''
+		return self._executor.submit(self._transaction, func).result()
+
+	def close(self):
+		''' Wait for queued statements to finish, then close the connection. '''
+		self._executor.shutdown(wait=True)
+		if self.con:
+			self.con.raw.close()
+
+
+_shared_db = None
 
-		if force: # delete all present tables
-			with sql_cur(self) as cur:
-				cur.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
-				table_list_unfixed = cur.fetchall()
-
-				for table in table_list_unfixed:
-					tname = table[0]
-					cmd = 'DROP TABLE ' + tname + ';'
-					print(str('Removing table ' + tname))
-					cur.execute(cmd)
-
-		with sql_cur(self) as cur:
-			cur.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
-			table_list_unfixed = cur.fetchall()
-
-			table_list = []
-
-			for table in table_list_unfixed:
-				table_list.append(table[0])
-				print(str(table[0]))
-
-			for table in self.schema:
-				tname = self.table_prefix + table['name']
-				if tname in table_list:
-					continue # ignore tables which already exist
-				else:
-					cmd = 'CREATE TABLE ' + tname + ' ('
-					for index, column in enumerate(table['schema']):
-						if index != 0:
-							cmd = cmd + ', '
-						cmd = cmd + column['name'] + ' ' + column['type']
-						if 'primary' in column: # columns with primary:true are PRIMARY KEY columns
-							if column['primary']:
-								cmd = cmd + ' PRIMARY KEY'
-					
-					cmd = cmd + ');'
-					print(str('Creating table ' + tname + ' with command ' + cmd))
-					cur.execute(cmd) # create table
+def shared_db(tuning=None, path='data/sqlite3.db'):
+	'''
+	  ' Returns the process-wide sql_async handle.
+		' 
+		' The database is opened (with the given connection tuning and file
+		' path) and its schema verified on the first call; every later call
+		' (from any cog or helper) gets the same handle.
+	'''
+	global _shared_db
+	if not _shared_db:
+		_shared_db = sql_async(sql_con(tuning=tuning, path=path))
+	return _shared_db
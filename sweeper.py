@@ -0,0 +1,133 @@
+import asyncio
+import datetime
+import traceback
+
+from messages import tracker
+
+''' -----Retention defaults----- '''
+# Overridden by the optional "retention" block in .bot_info.json. A window of
+# 0 days keeps that table's rows forever.
+_defaults = {
+	'tracked_messages_days' : 30,   # 🚮 reactions stop working after this
+	'error_messages_days' : 90,     # ✳ backtrace expansion stops working after this
+	'sweep_interval_minutes' : 60,
+	'sweep_batch_size' : 500,       # rows deleted per statement
+	'vacuum_pages' : 1000           # free pages returned to the OS per sweep
+}
+
+_AUTO_VACUUM_INCREMENTAL = 2
+
+def enable_incremental_vacuum(con):
+	'''
+	  ' PRAGMA incremental_vacuum only works once auto_vacuum is set to
+		' INCREMENTAL, which on an existing database takes effect after a
+		' full VACUUM. That rewrites the whole file and holds the write lock
+		' throughout, so it is a one-off maintenance step (hector.py
+		' --vacuum) run on its own connection while Hector is stopped, not
+		' something the sweeper does on the shared database thread.
+		' Returns False if the database was already converted.
+	'''
+	if con.raw.execute('PRAGMA auto_vacuum;').fetchone()[0] == _AUTO_VACUUM_INCREMENTAL:
+		return False
+	con.raw.execute('PRAGMA auto_vacuum = INCREMENTAL;')
+	con.raw.execute('VACUUM;')
+	return True
+
+class Sweeper:
+	''' Expires old tracked_messages and error_messages rows in the background '''
+	def __init__(self, bot, db_hook, retention=None):
+		self.bot = bot
+		self.db = db_hook
+		self.settings = dict(_defaults)
+		if retention:
+			self.settings.update(retention)
+
+		self._task = None
+		self._incremental = False
+
+	def __unload(self):
+		if self._task:
+			self._task.cancel()
+
+	async def on_ready(self):
+		# on_ready fires again after reconnects; only start one sweeper.
+		if not self._task:
+			self._task = self.bot.loop.create_task(self._run())
+
+	async def _run(self):
+		mode = await self.db.fetchone('PRAGMA auto_vacuum;')
+		self._incremental = mode[0] == _AUTO_VACUUM_INCREMENTAL
+		if not self._incremental and self.settings['vacuum_pages']:
+			print('Sweeper: the database is not in incremental auto-vacuum mode, so free pages are kept. Stop Hector and run "python3 hector.py --vacuum" once to convert it.')
+		while not self.bot.is_closed():
+			try:
+				await self.sweep()
+			except Exception as e:
+				print('Sweeper failed:\n{0}'.format(''.join(traceback.format_exception(type(e), e, e.__traceback__))))
+			await asyncio.sleep(self.settings['sweep_interval_minutes'] * 60)
+
+	async def _expire(self, table, time_column, id_column, days):
+		'''
+		  ' Delete rows older than the retention window in batches.
+			' Returns the message ids of the removed rows.
+		'''
+		if not days:
+			return []
+
+		cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+		batch_size = self.settings['sweep_batch_size']
+
+		def expire_batch(cur):
+			cur.execute('SELECT rowid, {0} FROM {1} WHERE {2} < ? LIMIT ?;'.format(id_column, table, time_column), (cutoff, batch_size))
+			rows = cur.fetchall()
+			cur.executemany('DELETE FROM {0} WHERE rowid=?;'.format(table), [(row[0],) for row in rows])
+			return [row[1] for row in rows]
+
+		removed = []
+		while True:
+			batch = await self.db.transaction(expire_batch)
+			removed.extend(batch)
+			if len(batch) < batch_size:
+				return removed
+			# Let other queued statements use the database thread between batches.
+			await asyncio.sleep(0)
+
+	async def _expire_traces(self):
+		''' Delete deduplicated backtraces that no error record points to any more. '''
+		if not self.settings['error_messages_days']:
+			return 0
+		return await self.db.execute('DELETE FROM error_traces WHERE fingerprint NOT IN (SELECT fingerprint FROM error_messages WHERE fingerprint IS NOT NULL);')
+
+	async def _vacuum(self):
+		pages = self.settings['vacuum_pages']
+		if not pages or not self._incremental:
+			return 0
+
+		def vacuum(cur):
+			cur.execute('PRAGMA freelist_count;')
+			before = cur.fetchone()[0]
+			cur.execute('PRAGMA incremental_vacuum({0:d});'.format(pages)).fetchall()
+			cur.execute('PRAGMA freelist_count;')
+			return before - cur.fetchone()[0]
+
+		return await self.db.transaction(vacuum)
+
+	async def sweep(self):
+		'''
+		  ' Delete expired rows in bounded batches, then release free pages.
+			' Returns (tracked messages removed, error records removed, pages released).
+		'''
+		tracked = await self._expire('tracked_messages', 'track_time', 'messid', self.settings['tracked_messages_days'])
+		errors = await self._expire('error_messages', 'error_time', 'message_id', self.settings['error_messages_days'])
+		tracker().forget(tracked_ids=tracked, error_ids=errors)
+		traces = await self._expire_traces()
+		pages = await self._vacuum()
+		print('Sweeper: removed {0} tracked messages, {1} error records and {2} backtraces, released {3} pages.'.format(len(tracked), len(errors), traces, pages))
+		return (len(tracked), len(errors), pages)
+
+
+def setup(bot):
+	# In a multi-process cluster every process shares one database; one sweeper is enough.
+	if getattr(bot, 'cluster_id', 0):
+		return
+	bot.add_cog(Sweeper(bot, bot.db, bot.settings.get('retention')))
@@ -0,0 +1,70 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+# The bot's modules live at the repository root and are imported by name;
+# the fakes for discord.py objects live in bench/fixtures.py.
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'bench'))
+os.chdir(root) # sql_con reads sql/schema.json relative to the repository
+
+
+@pytest.fixture(scope='session')
+def loop():
+	loop = asyncio.new_event_loop()
+	asyncio.set_event_loop(loop)
+	yield loop
+	loop.close()
+
+@pytest.fixture
+def run(loop):
+	return loop.run_until_complete
+
+@pytest.fixture(scope='session')
+def db(tmp_path_factory):
+	''' The process-wide shared_db(), opened on a temporary file before anything else opens it. '''
+	from sql.sql import shared_db
+	return shared_db(path=str(tmp_path_factory.mktemp('db') / 'test.db'))
+
+@pytest.fixture
+def rp(db, loop):
+	''' An RPManager on a fake bot, with empty regions and guild_settings tables. '''
+	pytest.importorskip('discord')
+	from fixtures import FakeBot
+	from mod.rp.rp import RPManager
+	loop.run_until_complete(db.execute('DELETE FROM regions;'))
+	loop.run_until_complete(db.execute('DELETE FROM guild_settings;'))
+	manager = RPManager(FakeBot(db, loop), db)
+	yield manager
+	manager._idle.stop()
+	if manager._repair_task:
+		manager._repair_task.cancel()
+	loop.run_until_complete(asyncio.sleep(0))
+
+@pytest.fixture
+def seed(rp, run):
+	'''
+	  ' seed(guild_id, names, status=0) stores one region per name (channel
+		' ids guild_id * 1000 + index) and gives the fake guild channels that
+		' already match them. Returns the guild.
+	'''
+	from fixtures import FakeChannel, build_guild
+
+	def seed(guild_id, names, status=0):
+		guild = build_guild(guild_id, categories=2)
+		guild.me = rp.bot.user
+		active, inactive = guild.categories[0], guild.categories[-1]
+		rows = [(guild_id * 1000 + index, guild_id, name, 'Region {0}.'.format(index), status, active.id) for index, name in enumerate(names)]
+		run(rp.db.execute('INSERT INTO guild_settings (guild_id, inactive_category) VALUES (?,?);', (guild_id, inactive.id)))
+		run(rp.db.executemany('INSERT INTO regions (channel_id, guild_id, name, description, status, active_category) VALUES (?,?,?,?,?,?);', rows))
+		for region in run(rp._list_regions(guild_id)):
+			category_id = inactive.id if region.status == 1 else active.id
+			guild.add_channel(FakeChannel(region.channel_id, rp._sanitize_channel_name(region.name), guild, category_id, run(rp._generate_topic(region))))
+		rp.bot.guilds.append(guild)
+		rp.bot.index()
+		return guild
+
+	return seed
@@ -0,0 +1,92 @@
+''' RPManager._bulk_set_status with requests that fail part-way. '''
+import pytest
+
+discord = pytest.importorskip('discord')
+from fixtures import FakeMember, FakeMessage
+
+
+class Response:
+	status = 403
+	reason = 'Forbidden'
+
+def forbidden():
+	return discord.HTTPException(Response(), 'Missing Permissions')
+
+
+class HTTP:
+	''' bulk_channel_update that applies the moves, failing for the chunks containing a channel in fail. '''
+	def __init__(self, guild, fail=()):
+		self.guild = guild
+		self.fail = set(fail)
+
+	async def bulk_channel_update(self, guild_id, moves, reason=None):
+		if any(move['id'] in self.fail for move in moves):
+			raise forbidden()
+		for move in moves:
+			self.guild.get_channel(move['id']).category_id = move['parent_id']
+
+class Context:
+	def __init__(self, guild):
+		self.guild = guild
+		self.author = FakeMember(2, [])
+		self.channel = next(iter(guild.channels.values()))
+		self.message = FakeMessage(self.channel, self.author)
+		self.sent = []
+
+	async def send(self, content=None, embed=None):
+		message = await self.channel.send(content, embed=embed)
+		self.sent.append(message)
+		return message
+
+
+def _statuses(rp, run, guild_id):
+	return dict(run(rp.db.fetchall('SELECT name, status FROM regions WHERE guild_id=?;', (guild_id,))))
+
+def test_closes_every_region(rp, run, seed):
+	guild = seed(1, ['Old Mill', 'River Keep', 'North Tower'])
+	rp.bot.http = HTTP(guild)
+	ctx = Context(guild)
+	run(rp._bulk_set_status(ctx, run(rp._list_regions(guild.id)), 1, 'Closing'))
+	assert set(_statuses(rp, run, guild.id).values()) == {1}
+	assert all(channel.category_id == guild.categories[-1].id for channel in guild.channels.values())
+	assert '✅' in ctx.message.reactions
+	assert ctx.sent[0].content.endswith('Done.')
+
+def test_failed_requests_only_fail_their_regions(rp, run, seed, monkeypatch):
+	import mod.rp.rp
+	monkeypatch.setattr(mod.rp.rp, '_BULK_POSITION_CHUNK', 2)
+	guild = seed(2, ['A', 'B', 'C', 'D', 'E'])
+	# Moves are chunked in channel order: A and B fail together, C and D
+	# move, and E moves but cannot be renamed. No channel is missing.
+	rp.bot.http = HTTP(guild, fail=[2000])
+	async def edit(reason=None, **fields):
+		raise forbidden()
+	guild.get_channel(2004).edit = edit
+	ctx = Context(guild)
+	run(rp._bulk_set_status(ctx, run(rp._list_regions(guild.id)), 1, 'Closing'))
+
+	assert _statuses(rp, run, guild.id) == {'A' : 0, 'B' : 0, 'C' : 1, 'D' : 1, 'E' : 1}
+	assert guild.get_channel(2000).topic == run(rp._generate_topic(run(rp._get_region(guild.id, 2000))))
+	report = ctx.sent[0].content
+	assert '2 regions could not be moved: A, B' in report
+	assert '1 regions kept their old name or topic: E' in report
+	assert 'Missing Permissions' in report
+	assert '✅' not in ctx.message.reactions
+
+def test_missing_channel_is_skipped_not_deleted(rp, run, seed):
+	guild = seed(3, ['Old Mill', 'River Keep'])
+	del guild.channels[3001]
+	rp.bot.http = HTTP(guild)
+	ctx = Context(guild)
+	run(rp._bulk_set_status(ctx, run(rp._list_regions(guild.id)), 1, 'Closing'))
+	assert _statuses(rp, run, guild.id) == {'Old Mill' : 1, 'River Keep' : 0}
+	assert '1 regions have no channel and were skipped: River Keep' in ctx.sent[0].content
+
+def test_close_except_needs_a_region_to_keep(rp, run, seed):
+	from discord.ext import commands
+	guild = seed(4, ['Old Mill', 'River Keep'])
+	rp.bot.http = HTTP(guild)
+	assert rp.bulk_close_except.clean_params['names'].default is rp.bulk_close_except.clean_params['names'].empty
+	with pytest.raises(commands.BadArgument):
+		run(rp.bulk_close_except.callback(rp, Context(guild), names=' , '))
+	assert set(_statuses(rp, run, guild.id).values()) == {0}
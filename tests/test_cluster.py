@@ -0,0 +1,91 @@
+''' Launcher must space out worker starts so their shards do not IDENTIFY at once. '''
+import pytest
+
+pytest.importorskip('discord')
+import cluster
+
+
+class Clock:
+	''' time.monotonic and time.sleep for the launcher; sleeping runs the events that fall due. '''
+	def __init__(self):
+		self.now = 0.0
+		self.stop_at = None
+		self.launcher = None
+		self.events = {} # time -> callable
+
+	def monotonic(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.now = self.now + seconds
+		if self.now in self.events:
+			self.events.pop(self.now)()
+		if self.stop_at is not None and self.now >= self.stop_at:
+			self.launcher._stopping = True
+
+class Worker:
+	''' A Popen that runs until told to exit with a code. '''
+	def __init__(self, command, started):
+		self.command = command
+		self.started = started
+		self.code = None
+
+	def poll(self):
+		return self.code
+
+	def terminate(self):
+		if self.code is None:
+			self.code = 0
+
+	def wait(self, timeout=None):
+		return self.code
+
+@pytest.fixture
+def launch(monkeypatch):
+	clock = Clock()
+	started = []
+	def popen(command):
+		worker = Worker(command, clock.now)
+		started.append(worker)
+		return worker
+	monkeypatch.setattr(cluster.time, 'monotonic', clock.monotonic)
+	monkeypatch.setattr(cluster.time, 'sleep', clock.sleep)
+	monkeypatch.setattr(cluster.subprocess, 'Popen', popen)
+	monkeypatch.setattr(cluster.Launcher, '_prepare_database', lambda self: None)
+
+	def launch(processes, shard_count, stop_at, **options):
+		clock.launcher = cluster.Launcher('hector.py', processes, shard_count, **options)
+		clock.stop_at = stop_at
+		return clock.launcher, clock, started
+	return launch
+
+def _cluster_id(worker):
+	return int(worker.command[worker.command.index('--cluster-id') + 1])
+
+def test_workers_start_identify_seconds_per_shard_apart(launch):
+	launcher, clock, started = launch(3, 7, stop_at=60) # shards 0-1, 2-3, 4-6
+	launcher.run()
+	assert [(_cluster_id(worker), worker.started) for worker in started] == [(0, 0), (1, 10), (2, 20)]
+
+def _exit_all(started, code):
+	def exit_all():
+		for worker in started:
+			worker.code = code
+	return exit_all
+
+def test_simultaneous_crashes_restart_in_turn(launch):
+	launcher, clock, started = launch(3, 6, stop_at=120, restart_delay=2) # two shards each
+	clock.events[40] = _exit_all(started, 1)
+	launcher.run()
+
+	restarts = [(_cluster_id(worker), worker.started) for worker in started[3:]]
+	assert [cluster_id for cluster_id, when in restarts] == [0, 1, 2]
+	times = [when for cluster_id, when in restarts]
+	assert times[0] >= 42
+	assert times[1] - times[0] >= 10 and times[2] - times[1] >= 10
+
+def test_clean_exits_are_not_restarted(launch):
+	launcher, clock, started = launch(2, 2, stop_at=None)
+	clock.events[20] = _exit_all(started, 0)
+	assert launcher.run() == 0
+	assert len(started) == 2
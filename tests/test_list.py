@@ -0,0 +1,85 @@
+''' |list paging: RPManager._region_page walked end to end. '''
+import random
+
+import pytest
+
+
+_words = ('old', 'mill', 'river', 'keep', 'Old', 'MILL', 'a', 'b')
+
+@pytest.fixture
+def paged(rp, run, seed, monkeypatch):
+	''' 60 regions with many case-equal names, on pages of 7 so that pages split runs of equal names. '''
+	import mod.rp.rp
+	monkeypatch.setattr(mod.rp.rp, '_LIST_PAGE_SIZE', 7)
+	rng = random.Random(0)
+	names = [' '.join(rng.choice(_words) for word in range(rng.randint(1, 2))) for index in range(60)]
+	return seed(1, names)
+
+def expected(rp, run, guild, start=None):
+	''' Every region in list order. SQLite's NOCASE only folds ASCII, so the names are ASCII. '''
+	rows = run(rp.db.fetchall('SELECT name, channel_id FROM regions WHERE guild_id=?;', (guild.id,)))
+	rows = sorted(rows, key=lambda row: (row[0].lower(), row[1]))
+	return [tuple(row) for row in rows if start is None or row[0].lower() >= start.lower()]
+
+def walk(rp, run, guild_id, key=None):
+	''' All (name, channel id) rows from key on, and the number of pages read. '''
+	rows = []
+	pages = 0
+	while True:
+		text, key = run(rp._region_page(guild_id, key))
+		pages = pages + 1
+		for line in text.split('\n') if text else []:
+			name, channel_id = line.rsplit(' id ', 1)
+			rows.append((name.strip('"'), int(channel_id)))
+		if key is None:
+			return rows, pages
+
+
+def test_pages_cover_every_region_in_order(rp, run, paged):
+	rows, pages = walk(rp, run, paged.id)
+	assert rows == expected(rp, run, paged)
+	assert pages == 9 # 60 regions, 7 per page
+	assert len(set(name.lower() for name, channel_id in rows)) < len(rows) # case-equal names were split
+
+def test_exact_page_boundary_has_no_empty_last_page(rp, run, seed, monkeypatch):
+	import mod.rp.rp
+	monkeypatch.setattr(mod.rp.rp, '_LIST_PAGE_SIZE', 5)
+	guild = seed(2, ['Same'] * 10)
+	rows, pages = walk(rp, run, guild.id)
+	assert pages == 2
+	assert rows == expected(rp, run, guild)
+
+def test_start_name_includes_equal_names(rp, run, paged):
+	for start in ('mill', 'MILL', 'old m', 'zzz', 'a'):
+		rows, pages = walk(rp, run, paged.id, (start, -1))
+		assert rows == expected(rp, run, paged, start), start
+
+def test_empty_guild(rp, run):
+	assert run(rp._region_page(99)) == ('', None)
+
+def test_rename_and_delete_drop_cached_pages(rp, run, paged):
+	walk(rp, run, paged.id)
+	assert rp._list_pages.get(paged.id)
+
+	region = run(rp._get_region(paged.id, 1000))
+	region.name = '0 renamed'
+	run(rp._edit_region(region))
+	assert rp._list_pages.get(paged.id) is None
+	rows, pages = walk(rp, run, paged.id)
+	assert rows[0] == ('0 renamed', 1000)
+	assert rows == expected(rp, run, paged)
+
+	for channel_id in (1001, 1002, 1003):
+		run(rp._delete_region(paged.id, channel_id))
+	assert rp._list_pages.get(paged.id) is None
+	rows, pages = walk(rp, run, paged.id)
+	assert rows == expected(rp, run, paged)
+	assert len(rows) == 57
+
+def test_page_after_its_key_region_is_deleted(rp, run, paged):
+	''' A list left open across a delete continues after the deleted key, without skipping or repeating. '''
+	text, key = run(rp._region_page(paged.id))
+	run(rp._delete_region(paged.id, key[1]))
+	rows, pages = walk(rp, run, paged.id, key)
+	remaining = expected(rp, run, paged)
+	assert rows == [row for row in remaining if (row[0].lower(), row[1]) > (key[0].lower(), key[1])]
@@ -0,0 +1,68 @@
+''' RPManager._region_patch sends only the channel fields that would change. '''
+import random
+
+import pytest
+
+
+@pytest.fixture
+def guild(rp, seed):
+	return seed(1, ['Old Mill', 'River Keep'])
+
+def _patch(rp, run, guild, region):
+	channel = guild.get_channel(region.channel_id)
+	category = guild.get_category(run(rp._target_category_id(region)))
+	return run(rp._region_patch(channel, region, category))
+
+def test_healthy_channel_needs_no_edit(rp, run, guild):
+	region = run(rp._get_region(guild.id, 1000))
+	assert _patch(rp, run, guild, region) == {}
+	run(rp._apply_region_meta(region))
+	assert guild.get_channel(1000).edits == 0
+	assert rp.edit_stats['skipped'] == 1
+
+def test_description_only_changes_the_topic(rp, run, guild):
+	region = run(rp._get_region(guild.id, 1000))
+	region.description = 'A ruined mill.'
+	assert _patch(rp, run, guild, region) == {'topic' : run(rp._generate_topic(region))}
+
+def test_rename_changes_name_and_topic(rp, run, guild):
+	region = run(rp._get_region(guild.id, 1000))
+	region.name = 'New Mill'
+	assert _patch(rp, run, guild, region) == {'name' : 'new-mill', 'topic' : run(rp._generate_topic(region))}
+
+def test_closing_moves_and_syncs(rp, run, guild):
+	region = run(rp._get_region(guild.id, 1000))
+	region.status = 1
+	patch = _patch(rp, run, guild, region)
+	assert set(patch) == {'topic', 'category', 'sync_permissions'}
+	assert patch['category'] is guild.categories[-1]
+	assert patch['sync_permissions'] is True
+
+def test_drifted_permissions_are_synced_in_place(rp, run, guild):
+	region = run(rp._get_region(guild.id, 1000))
+	guild.get_channel(1000).overwrites = ['someone']
+	assert _patch(rp, run, guild, region) == {'sync_permissions' : True}
+
+def test_no_category_moves_out_of_it(rp, run, guild):
+	region = run(rp._get_region(guild.id, 1000))
+	region.active_category = None
+	assert _patch(rp, run, guild, region) == {'category' : None, 'sync_permissions' : True}
+
+def test_never_sends_position_or_nsfw(rp, run, guild):
+	rng = random.Random(0)
+	for trial in range(200):
+		region = run(rp._get_region(guild.id, rng.choice([1000, 1001])))
+		if rng.random() < 0.5:
+			region.name = rng.choice(['Old Mill', 'River Keep', 'Market'])
+		if rng.random() < 0.5:
+			region.description = rng.choice(['Region 0.', 'A ruined mill.'])
+		region.status = rng.choice([0, 1])
+		region.active_category = rng.choice([guild.categories[0].id, guild.categories[1].id])
+		patch = _patch(rp, run, guild, region)
+		assert set(patch) <= {'name', 'topic', 'category', 'sync_permissions'}
+
+		# Applying the patch leaves nothing to send.
+		channel = guild.get_channel(region.channel_id)
+		run(channel.edit(**patch))
+		assert _patch(rp, run, guild, region) == {}
+		run(channel.edit(**_patch(rp, run, guild, run(rp._get_region(guild.id, region.channel_id)))))
@@ -0,0 +1,114 @@
+'''
+  ' The bitwise permission engine in permissions.py must match the
+	' original per-permission loop exactly. The reference implementations
+	' below are the pre-optimisation code, kept verbatim.
+'''
+import random
+
+import pytest
+
+pytest.importorskip('discord')
+import permissions
+from permissions import _perms_lut, _has, _denied, _grant_perm, _deny_perm
+
+
+def reference_combine(high_priority, low_priority):
+	final_perm = 0
+	for perm in _perms_lut.values():
+		if _denied(high_priority, perm):
+			final_perm = _deny_perm(final_perm, perm)
+		elif _has(low_priority, perm) or _has(high_priority, perm):
+			final_perm = _grant_perm(final_perm, perm)
+		elif _denied(low_priority, perm):
+			final_perm = _deny_perm(final_perm, perm)
+
+	return final_perm
+
+def reference_fold(member, tracked_roles):
+	''' The original get_permissions loop, over member.roles as discord.py orders them. '''
+	permissions = 0
+	for role in member.roles:
+		if role.id in tracked_roles.keys():
+			role_perms = tracked_roles[role.id]
+			permissions = reference_combine(role_perms, permissions)
+
+	return permissions
+
+
+class Role:
+	def __init__(self, role_id, position):
+		self.id = role_id
+		self.position = position
+
+class Guild:
+	def __init__(self, roles):
+		self.roles = {role.id : role for role in roles}
+
+	def get_role(self, role_id):
+		return self.roles.get(role_id)
+
+class Member:
+	def __init__(self, roles):
+		self.roles = sorted(roles, key=lambda role: role.position) # discord.py: lowest first
+
+
+_code_bits = 2 * len(set(_perms_lut.values())) # a grant and a deny flag per permission
+
+def test_combine_exhaustive_low_byte():
+	''' Every pair of codes over the first four permissions, in both argument orders. '''
+	for high in range(256):
+		for low in range(256):
+			assert permissions._perms_combine(high, low) == reference_combine(high, low), (high, low)
+
+def test_combine_exhaustive_per_permission():
+	''' All 16 flag states of one permission against another code, at every permission's offset. '''
+	rng = random.Random(1)
+	for perm in set(_perms_lut.values()):
+		for high_flags in range(4):
+			for low_flags in range(4):
+				for trial in range(20):
+					background_high = rng.getrandbits(_code_bits) & ~(3 << perm)
+					background_low = rng.getrandbits(_code_bits) & ~(3 << perm)
+					high = background_high | (high_flags << perm)
+					low = background_low | (low_flags << perm)
+					assert permissions._perms_combine(high, low) == reference_combine(high, low), (perm, high, low)
+
+def test_combine_random_full_width():
+	rng = random.Random(2)
+	for trial in range(50000):
+		high = rng.getrandbits(_code_bits)
+		low = rng.getrandbits(_code_bits)
+		assert permissions._perms_combine(high, low) == reference_combine(high, low), (high, low)
+
+def test_combine_ignores_unused_bits():
+	''' Stored codes never set bits above the last deny flag, but they must not leak if they do. '''
+	rng = random.Random(3)
+	for trial in range(5000):
+		high = rng.getrandbits(_code_bits + 8)
+		low = rng.getrandbits(_code_bits + 8)
+		assert permissions._perms_combine(high, low) == reference_combine(high, low), (high, low)
+
+@pytest.mark.parametrize('role_count', [1, 2, 5, 20, 100])
+def test_resolve_matches_sequential_fold(role_count):
+	rng = random.Random(role_count)
+	for trial in range(300):
+		positions = rng.sample(range(1, role_count * 3 + 1), role_count)
+		roles = [Role(1000 + index, position) for index, position in enumerate(positions)]
+		guild = Guild(roles)
+		# Some roles have no stored code, and some stored codes belong to
+		# roles the guild no longer has.
+		tracked_roles = {role.id : rng.getrandbits(_code_bits) for role in roles if rng.random() < 0.7}
+		if rng.random() < 0.3:
+			tracked_roles[999999] = rng.getrandbits(_code_bits)
+		order, tracked_ids = permissions._compile_roles(guild, tracked_roles)
+
+		for member_trial in range(10):
+			member = Member(rng.sample(roles, rng.randint(0, role_count)))
+			held = frozenset(role.id for role in member.roles if role.id in tracked_ids)
+			assert permissions._resolve(order, held) == reference_fold(member, tracked_roles)
+
+def test_compile_roles_orders_by_position():
+	roles = [Role(1, 30), Role(2, 10), Role(3, 20)]
+	order, tracked_ids = permissions._compile_roles(Guild(roles), {1 : 1, 2 : 4, 3 : 16, 4 : 64})
+	assert order == ((2, 4), (3, 16), (1, 1))
+	assert tracked_ids == frozenset((1, 2, 3))
@@ -0,0 +1,48 @@
+''' RPManager._reconcile must never delete regions because of a missing guild cache. '''
+
+def _stored(rp, run, guild_id):
+	return run(rp.db.fetchone('SELECT COUNT(*) FROM regions WHERE guild_id=?;', (guild_id,)))[0]
+
+def test_removes_regions_whose_channel_was_deleted(rp, run, seed):
+	guild = seed(1, ['Old Mill', 'River Keep', 'North Tower'])
+	del guild.channels[1001]
+	assert run(rp._reconcile(guild)) == (3, 1, 0)
+	assert _stored(rp, run, 1) == 2
+	assert run(rp._find_regions(1, 'River Keep')) == []
+
+def test_unavailable_guild_keeps_its_regions(rp, run, seed):
+	guild = seed(2, ['Old Mill', 'River Keep', 'North Tower'])
+	channels = guild.channels
+	guild.unavailable = True
+	guild.channels = {} # an outage empties the guild's cache
+	assert run(rp._reconcile(guild)) == (0, 0, 0)
+	assert _stored(rp, run, 2) == 3
+
+	# Reconciled once the guild is back, with nothing to remove.
+	guild.unavailable = False
+	guild.channels = channels
+	run(rp.on_guild_available(guild))
+	assert guild.id not in rp._unreconciled
+	assert _stored(rp, run, 2) == 3
+
+def test_unavailable_guilds_are_skipped_on_ready(rp, run, seed):
+	available = seed(3, ['Old Mill'])
+	away = seed(4, ['River Keep', 'North Tower'])
+	away.unavailable = True
+	away.channels = {}
+	run(rp.on_ready())
+	assert _stored(rp, run, available.id) == 1
+	assert _stored(rp, run, away.id) == 2
+	assert rp._unreconciled == {away.id}
+
+def test_guild_without_cached_channels_keeps_its_regions(rp, run, seed):
+	guild = seed(5, ['Old Mill', 'River Keep'])
+	guild.channels = {} # available, but the cache is empty
+	assert run(rp._reconcile(guild))[1] == 0
+	assert _stored(rp, run, 5) == 2
+
+def test_available_event_ignores_guilds_already_reconciled(rp, run, seed):
+	guild = seed(6, ['Old Mill'])
+	del guild.channels[6000]
+	run(rp.on_guild_available(guild)) # startup: fires before on_ready
+	assert _stored(rp, run, 6) == 1
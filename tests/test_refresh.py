@@ -0,0 +1,104 @@
+''' RPManager._refresh_region_meta merging refreshes of one channel into one edit. '''
+import asyncio
+
+import pytest
+
+discord = pytest.importorskip('discord')
+
+
+class Response:
+	status = 403
+	reason = 'Forbidden'
+
+@pytest.fixture
+def target(rp, run, seed):
+	''' An open region, and its channel recording the arguments of each edit. '''
+	guild = seed(1, ['Old Mill'])
+	region = run(rp._get_region(guild.id, 1000))
+	channel = guild.get_channel(region.channel_id)
+	channel.patches = []
+	edit = channel.edit
+	async def recording_edit(reason=None, **fields):
+		channel.patches.append(fields)
+		await edit(reason=reason, **fields)
+	channel.edit = recording_edit
+	return region, channel
+
+def _stored(rp, run, region):
+	return run(rp._get_region(region.guild_id, region.channel_id))
+
+def test_changes_within_the_window_are_merged(rp, run, target):
+	region, channel = target
+	described = region.copy()
+	described.description = 'A ruined mill.'
+	closed = region.copy()
+	closed.status = 1
+	run(asyncio.gather(rp._refresh_region_meta(described), rp._refresh_region_meta(closed)))
+
+	assert len(channel.patches) == 1
+	assert rp.edit_stats['coalesced'] == 1
+	stored = _stored(rp, run, region)
+	assert (stored.description, stored.status) == ('A ruined mill.', 1)
+	assert channel.topic == run(rp._generate_topic(stored))
+
+def test_later_caller_only_overrides_the_fields_it_changed(rp, run, target):
+	''' The second caller started from the stored region, so its stale name must not undo the rename. '''
+	region, channel = target
+	renamed = region.copy()
+	renamed.name = 'New Mill'
+	described = region.copy()
+	described.description = 'A ruined mill.'
+	async def both():
+		first = asyncio.ensure_future(rp._refresh_region_meta(renamed))
+		await asyncio.sleep(0.05)
+		await rp._refresh_region_meta(described)
+		await first
+	run(both())
+
+	stored = _stored(rp, run, region)
+	assert (stored.name, stored.description) == ('New Mill', 'A ruined mill.')
+	assert len(channel.patches) == 1
+	assert channel.name == 'new-mill'
+
+def test_refreshes_after_the_window_edit_again(rp, run, target):
+	region, channel = target
+	described = region.copy()
+	described.description = 'A ruined mill.'
+	run(rp._refresh_region_meta(described))
+	closed = _stored(rp, run, region)
+	closed.status = 1
+	run(rp._refresh_region_meta(closed))
+	assert len(channel.patches) == 2
+	assert rp.edit_stats['coalesced'] == 0
+
+def test_every_caller_gets_the_same_failure(rp, run, target):
+	region, channel = target
+	error = discord.HTTPException(Response(), 'Missing Permissions')
+	async def failing_edit(reason=None, **fields):
+		raise error
+	channel.edit = failing_edit
+	first, second = region.copy(), region.copy()
+	first.description = 'A ruined mill.'
+	second.status = 1
+	results = run(asyncio.gather(rp._refresh_region_meta(first), rp._refresh_region_meta(second), return_exceptions=True))
+	assert results[0] is error and results[1] is error
+	assert _stored(rp, run, region).status == 0 # nothing is stored for a failed edit
+	assert rp._pending_refresh == {}
+
+def test_cancelled_caller_does_not_cancel_the_edit(rp, run, target):
+	region, channel = target
+	first, second = region.copy(), region.copy()
+	first.description = 'A ruined mill.'
+	second.status = 1
+	async def cancel_one():
+		cancelled = asyncio.ensure_future(rp._refresh_region_meta(first))
+		kept = asyncio.ensure_future(rp._refresh_region_meta(second))
+		await asyncio.sleep(0)
+		cancelled.cancel()
+		await kept
+		return cancelled
+	cancelled = run(cancel_one())
+	assert cancelled.cancelled()
+	stored = _stored(rp, run, region)
+	assert (stored.description, stored.status) == ('A ruined mill.', 1)
+	assert len(channel.patches) == 1
@@ -0,0 +1,100 @@
+''' RegionNameIndex against a brute-force scan of every name. '''
+import random
+
+import pytest
+
+from mod.rp.regions import RegionNameIndex
+
+
+def brute_search(names, query):
+	''' What search() must return, by checking every name. '''
+	tiers = ([], [], [])
+	if not query:
+		return tiers
+	for channel_id, name in names.items():
+		if name == query:
+			tiers[0].append(channel_id)
+		elif name.startswith(query):
+			tiers[1].append(channel_id)
+		elif query in name:
+			tiers[2].append(channel_id)
+	for tier in tiers:
+		tier.sort(key=lambda channel_id: (len(names[channel_id]), names[channel_id], channel_id))
+	return tiers
+
+def brute_grams(index, names):
+	grams = {}
+	for channel_id, name in names.items():
+		for gram in index._grams_of(name):
+			grams.setdefault(gram, set()).add(channel_id)
+	return grams
+
+def random_name(rng):
+	# A small alphabet, so that names share many grams and queries match several tiers.
+	return ''.join(rng.choice('abc-1') for position in range(rng.randint(1, 9)))
+
+def queries(rng, names):
+	for trial in range(20):
+		yield random_name(rng)[:rng.randint(1, 6)]
+	for name in rng.sample(list(names.values()), min(len(names), 20)):
+		start = rng.randint(0, len(name) - 1)
+		yield name[start:rng.randint(start + 1, len(name))]
+
+
+def test_ranking_tiers():
+	index = RegionNameIndex()
+	for channel_id, name in enumerate(['old-mill', 'old', 'mill', 'windmill', 'old-mill-road', 'olden']):
+		index.add(channel_id, name)
+	assert index.search('old') == ([1], [5, 0, 4], [])
+	assert index.search('mill') == ([2], [], [0, 3, 4]) # equal lengths: by name
+	assert index.search('old-mill') == ([0], [4], [])
+	assert index.search('xyz') == ([], [], [])
+	assert index.search('') == ([], [], [])
+
+@pytest.mark.parametrize('gram_size', [1, 2, 3, 4])
+def test_matches_brute_force_through_renames_and_deletes(gram_size):
+	rng = random.Random(gram_size)
+	index = RegionNameIndex(gram_size)
+	names = {}
+	next_id = 0
+	for step in range(400):
+		action = rng.random()
+		if action < 0.5 or not names:
+			names[next_id] = random_name(rng)
+			index.add(next_id, names[next_id])
+			next_id = next_id + 1
+		elif action < 0.8:
+			channel_id = rng.choice(list(names))
+			names[channel_id] = random_name(rng) if rng.random() < 0.9 else names[channel_id] # sometimes unchanged
+			index.add(channel_id, names[channel_id])
+		else:
+			channel_id = rng.choice(list(names))
+			del names[channel_id]
+			index.remove(channel_id)
+
+		if step % 20 == 0:
+			assert index._names == names
+			assert index._grams == brute_grams(index, names) # no stale postings or empty sets
+			for query in queries(rng, names):
+				assert index.search(query) == brute_search(names, query), query
+
+def test_remove_unknown_channel_is_ignored():
+	index = RegionNameIndex()
+	index.add(1, 'old-mill')
+	index.remove(2)
+	index.remove(1)
+	index.remove(1)
+	assert index._names == {} and index._grams == {}
+
+def test_find_regions_follows_renames_and_deletes(rp, run, seed):
+	guild = seed(1, ['Old Mill', 'Old Road', 'Mill Pond'])
+	mill = run(rp._get_region(guild.id, 1000))
+	mill.name = 'Windmill'
+	run(rp._edit_region(mill))
+	assert [region.name for region in run(rp._find_regions(guild.id, 'old'))] == ['Old Road']
+	assert [region.name for region in run(rp._find_regions(guild.id, 'mill'))] == ['Mill Pond']
+	assert [region.name for region in run(rp._find_regions(guild.id, 'windmill'))] == ['Windmill']
+
+	run(rp._delete_region(guild.id, 1002))
+	assert [region.name for region in run(rp._find_regions(guild.id, 'mill'))] == ['Windmill']
+	assert run(rp._find_regions(guild.id, 'pond')) == []
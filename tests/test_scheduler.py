@@ -0,0 +1,148 @@
+''' DeadlineScheduler, and RPManager closing idle regions with it. '''
+import time
+import asyncio
+
+import pytest
+
+from mod.rp.scheduler import DeadlineScheduler
+
+
+@pytest.fixture
+def scheduler(loop):
+	fired = []
+	async def callback(key):
+		fired.append((key, time.monotonic()))
+	scheduler = DeadlineScheduler(callback)
+	scheduler.fired = fired
+	scheduler.start()
+	yield scheduler
+	scheduler.stop()
+
+def _keys(scheduler):
+	return [key for key, when in scheduler.fired]
+
+def test_fires_earliest_deadline_first(scheduler, run):
+	now = time.monotonic()
+	scheduler.touch(('a',), now + 0.15)
+	scheduler.touch(('b',), now + 0.05)
+	scheduler.touch(('c',), now + 0.10)
+	run(asyncio.sleep(0.25))
+	assert _keys(scheduler) == [('b',), ('c',), ('a',)]
+	for key, when in scheduler.fired:
+		assert when >= now + {('a',) : 0.15, ('b',) : 0.05, ('c',) : 0.10}[key]
+	assert len(scheduler) == 0
+
+def test_later_deadline_is_repushed_not_fired(scheduler, run):
+	now = time.monotonic()
+	scheduler.touch('a', now + 0.05)
+	scheduler.touch('a', now + 0.20)
+	assert len(scheduler._heap) == 1 # moving a deadline later does not push
+	run(asyncio.sleep(0.10))
+	assert scheduler.fired == []
+	assert 'a' in scheduler
+	run(asyncio.sleep(0.20))
+	assert _keys(scheduler) == ['a']
+	assert scheduler.fired[0][1] >= now + 0.20
+
+def test_earlier_deadline_fires_once(scheduler, run):
+	now = time.monotonic()
+	scheduler.touch('a', now + 10)
+	scheduler.touch('a', now + 0.05) # wakes the sleeping task
+	run(asyncio.sleep(0.15))
+	assert _keys(scheduler) == ['a']
+	scheduler.touch('a', now + 0.05) # already due again: fires on the next pass
+	run(asyncio.sleep(0.05))
+	assert _keys(scheduler) == ['a', 'a']
+
+def test_cancelled_key_does_not_fire(scheduler, run):
+	now = time.monotonic()
+	scheduler.touch('a', now + 0.05)
+	scheduler.touch('b', now + 0.05)
+	scheduler.cancel('a')
+	assert 'a' not in scheduler
+	run(asyncio.sleep(0.15))
+	assert _keys(scheduler) == ['b']
+
+def test_failing_callback_does_not_stop_the_scheduler(loop, run):
+	fired = []
+	async def callback(key):
+		fired.append(key)
+		if key == 'a':
+			raise ValueError('boom')
+	scheduler = DeadlineScheduler(callback)
+	scheduler.start()
+	now = time.monotonic()
+	scheduler.touch('a', now + 0.02)
+	scheduler.touch('b', now + 0.06)
+	run(asyncio.sleep(0.15))
+	scheduler.stop()
+	assert fired == ['a', 'b']
+
+
+_timeout = 60
+
+@pytest.fixture
+def idle(rp, run, seed):
+	''' A guild with four open regions and a one-minute idle timeout, but nothing scheduled yet. '''
+	guild = seed(1, ['Old Mill', 'River Keep', 'North Tower', 'Market'])
+	rp._idle_timeouts[guild.id] = _timeout
+	rp._idle.start()
+	return guild
+
+def _region(rp, run, guild, name):
+	return run(rp._find_regions(guild.id, name))[0]
+
+def _due_in(rp, region, seconds):
+	rp._touch_idle(region, idle_for=_timeout - seconds)
+
+def _closed(rp, run, guild):
+	return sorted(row[0] for row in run(rp.db.fetchall('SELECT name FROM regions WHERE guild_id=? AND status=1;', (guild.id,))))
+
+def test_idle_regions_close(rp, run, idle):
+	mill = _region(rp, run, idle, 'Old Mill')
+	keep = _region(rp, run, idle, 'River Keep')
+	_due_in(rp, mill, 0.05)
+	_due_in(rp, keep, 30)
+	run(asyncio.sleep(0.4)) # past the 0.25 s refresh window
+	assert _closed(rp, run, idle) == ['Old Mill']
+	channel = idle.get_channel(mill.channel_id)
+	assert channel.category_id == idle.categories[-1].id
+	assert [message.content for message in channel.messages.values()] == ['Region Old Mill was closed after 1 minutes without activity.']
+	assert (idle.id, keep.channel_id) in rp._idle
+
+def test_activity_postpones_closing(rp, run, idle):
+	from fixtures import FakeMember, FakeMessage
+	mill = _region(rp, run, idle, 'Old Mill')
+	tower = _region(rp, run, idle, 'North Tower')
+	_due_in(rp, mill, 0.05)
+	_due_in(rp, tower, 0.05)
+	run(rp.on_message(FakeMessage(idle.get_channel(mill.channel_id), FakeMember(2, []), 'Hello!')))
+	run(asyncio.sleep(0.4))
+	assert _closed(rp, run, idle) == ['North Tower']
+	assert (idle.id, mill.channel_id) in rp._idle
+
+def test_deleted_and_closed_regions_are_cancelled(rp, run, idle):
+	mill = _region(rp, run, idle, 'Old Mill')
+	keep = _region(rp, run, idle, 'River Keep')
+	market = _region(rp, run, idle, 'Market')
+	for region in (mill, keep, market):
+		_due_in(rp, region, 0.05)
+
+	run(rp._delete_region(idle.id, mill.channel_id))
+	keep.status = 1
+	run(rp._edit_region(keep)) # closed by hand before the timeout
+	assert (idle.id, mill.channel_id) not in rp._idle
+	assert (idle.id, keep.channel_id) not in rp._idle
+
+	run(asyncio.sleep(0.4))
+	assert _closed(rp, run, idle) == ['Market', 'River Keep']
+	assert idle.get_channel(mill.channel_id).messages == {}
+	assert idle.get_channel(keep.channel_id).messages == {}
+
+def test_region_closed_before_its_deadline_is_left_alone(rp, run, idle):
+	''' _idle_close re-reads the region, in case it was closed without cancelling. '''
+	keep = _region(rp, run, idle, 'River Keep')
+	keep.status = 1
+	run(rp._edit_region(keep))
+	run(rp._idle_close((idle.id, keep.channel_id)))
+	assert idle.get_channel(keep.channel_id).messages == {}
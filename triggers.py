@@ -0,0 +1,166 @@
+import re
+
+import discord
+from discord.ext import commands
+
+from sql.sql import shared_db
+from messages import track
+import permissions
+
+_builtin_triggers = {
+	'scp-1360' : '*((I have a name, you know.))*',
+	'scp 1360' : '*((I have a name, you know.))*'
+}
+_max_triggers = 25 # per guild; |trigger list shows one embed field each
+_max_phrase_length = 100
+_max_response_length = 500
+
+class Matcher:
+	'''
+	  ' Finds the first trigger phrase in a message with one scan.
+		'
+		' All phrases are compiled into a single regular expression
+		' alternation, longest first so that the longest phrase wins when
+		' two start at the same place. Phrases match anywhere in the
+		' (lowercased) text, as substrings.
+	'''
+	def __init__(self, triggers):
+		self.responses = dict(triggers)
+		phrases = sorted(self.responses, key=len, reverse=True)
+		self.pattern = re.compile('|'.join(re.escape(phrase) for phrase in phrases)) if phrases else None
+
+	def match(self, text):
+		''' Returns the response for the first phrase in text (already lowercased), or None. '''
+		if not self.pattern:
+			return None
+		found = self.pattern.search(text)
+		return self.responses[found.group(0)] if found else None
+
+
+class TriggerTable:
+	'''
+	  ' The phrase -> response table for on_message.
+		'
+		' Every guild matches the built-in triggers; a guild with its own
+		' triggers gets its own Matcher compiled from both, rebuilt only
+		' when its triggers change. Guilds without custom triggers share
+		' one Matcher, so the per-message cost is one regex search no
+		' matter how many guilds or triggers there are.
+		'
+		' Until load() has run, only the built-in triggers are matched.
+	'''
+	def __init__(self, db):
+		self.db = db
+		self.default = Matcher(_builtin_triggers)
+		self._custom = {} # guild id -> {phrase : response}
+		self._matchers = {} # guild id -> Matcher, for guilds with custom triggers
+		self.loaded = False
+
+	async def load(self):
+		''' Read every guild's triggers into memory. '''
+		custom = {}
+		for row in await self.db.fetchall('SELECT guild_id, phrase, response FROM triggers;'):
+			custom.setdefault(row[0], {})[row[1]] = row[2]
+		self._custom = custom
+		self._matchers = {guild_id : self._compile(triggers) for guild_id, triggers in custom.items()}
+		self.loaded = True
+
+	def _compile(self, triggers):
+		combined = dict(triggers)
+		combined.update(_builtin_triggers) # built-ins cannot be overridden
+		return Matcher(combined)
+
+	def matcher(self, guild_id):
+		return self._matchers.get(guild_id, self.default)
+
+	def custom(self, guild_id):
+		''' The guild's own triggers, as {phrase : response}. '''
+		return dict(self._custom.get(guild_id, {}))
+
+	def _update(self, guild_id, triggers):
+		if triggers:
+			self._custom[guild_id] = triggers
+			self._matchers[guild_id] = self._compile(triggers)
+		else:
+			self._custom.pop(guild_id, None)
+			self._matchers.pop(guild_id, None)
+
+	async def add(self, guild_id, phrase, response):
+		await self.db.execute('INSERT OR REPLACE INTO triggers (guild_id, phrase, response) VALUES (?,?,?);', (guild_id, phrase, response))
+		triggers = self.custom(guild_id)
+		triggers[phrase] = response
+		self._update(guild_id, triggers)
+
+	async def remove(self, guild_id, phrase):
+		await self.db.execute('DELETE FROM triggers WHERE guild_id=? AND phrase=?;', (guild_id, phrase))
+		triggers = self.custom(guild_id)
+		triggers.pop(phrase, None)
+		self._update(guild_id, triggers)
+
+
+_table = None
+
+def table():
+	''' Returns the process-wide TriggerTable, created on first use. '''
+	global _table
+	if not _table:
+		_table = TriggerTable(shared_db())
+	return _table
+
+
+class Triggers:
+	''' Per-guild automatic replies to phrases in chat '''
+	def __init__(self, bot):
+		self.bot = bot
+
+	@permissions.require(permissions.manage)
+	@commands.group()
+	async def trigger(self, ctx):
+		''' (Manage-Perms-Only) Commands for managing automatic replies '''
+		pass
+
+	@trigger.command(name='add')
+	async def trigger_add(self, ctx, phrase, *, response):
+		''' Replies with <response> whenever a message contains <phrase>.
+		  ' Phrases are not case-sensitive; quote phrases with spaces.
+		'''
+		phrase = phrase.lower().strip()
+		response = response.strip()
+		if not phrase or len(phrase) > _max_phrase_length:
+			raise commands.BadArgument('Trigger phrases must be between 1 and {0} characters long.'.format(_max_phrase_length))
+		if not response or len(response) > _max_response_length:
+			raise commands.BadArgument('Trigger responses must be between 1 and {0} characters long.'.format(_max_response_length))
+		if '@everyone' in response or '@here' in response:
+			raise commands.BadArgument('Trigger responses cannot mention @everyone or @here.')
+		if phrase in _builtin_triggers:
+			raise commands.BadArgument('"{0}" is a built-in trigger.'.format(phrase))
+		existing = table().custom(ctx.guild.id)
+		if phrase not in existing and len(existing) >= _max_triggers:
+			raise commands.BadArgument('This server already has {0} triggers. Remove one first.'.format(_max_triggers))
+
+		await table().add(ctx.guild.id, phrase, response)
+		await ctx.message.add_reaction('✅')
+
+	@trigger.command(name='remove')
+	async def trigger_remove(self, ctx, *, phrase):
+		''' Removes the trigger for <phrase> '''
+		phrase = phrase.lower().strip().strip('"')
+		if phrase not in table().custom(ctx.guild.id):
+			raise commands.BadArgument('There is no trigger for "{0}".'.format(phrase))
+		await table().remove(ctx.guild.id, phrase)
+		await ctx.message.add_reaction('✅')
+
+	@trigger.command(name='list')
+	async def trigger_list(self, ctx):
+		''' Lists this server's triggers '''
+		embed = discord.Embed(title='\U0001f4ac Triggers', colour=discord.Colour(0x419492), description='Hector replies when a message contains one of these phrases.')
+		for phrase, response in sorted(table().custom(ctx.guild.id).items()):
+			embed.add_field(name=phrase, value=response if len(response) <= 150 else response[:150] + '…', inline=False)
+		if len(embed.fields) == 0:
+			embed.add_field(name='No triggers set.', value='Add one with ``{0}trigger add "<phrase>" <response>``.'.format(self.bot.command_prefix), inline=False)
+		msg = await ctx.send(content='', embed=embed)
+		await track(msg, ctx.author)
+
+
+def setup(bot):
+	bot.add_cog(Triggers(bot))